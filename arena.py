@@ -0,0 +1,284 @@
+import argparse
+import logging
+import math
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import cycle, islice
+from typing import NamedTuple
+
+from utils import *
+from chess_engine import new_engine
+from engine_base import EngineBase
+from fen import START_FEN, format_fen, read_fens
+from pgn import format_game, move_san
+from search import Searcher, SearchResult
+
+
+log = logging.getLogger('arena')
+
+
+"""
+Self-play matches between two engine configurations. Every opening is played twice with colours swapped,
+games run in a process pool and each worker keeps one engine and searcher per player for all its games.
+Search is deterministic, so without an openings file the openings are made by a few random moves from the
+start position, drawn from a seeded generator so a match can be replayed. Searches see the game's earlier
+positions through the engine's undo history and score a return to one as a draw.
+Both players' engines get every move, a game ends on mate, stalemate, threefold repetition, the 50-move
+rule, insufficient material, a flag fall or the ply limit.
+"""
+MAX_PLIES = 400
+# random moves from the start position making each generated opening
+OPENING_PLIES = 4
+# time control: expect this many moves still to play, as the UCI frontend does
+MOVES_TO_GO = 30
+
+
+class PlayerSpec(NamedTuple):
+    name: str
+    backend: str = 'object'
+    depth: int | None = None
+    nodes: int | None = None
+    movetime: float | None = None
+    # clock in seconds per game plus increment per move, used when base is set
+    base: float | None = None
+    increment: float = 0.0
+    hash_mb: float = 16
+    # opening book played from before searching, weighted random so repeated openings still vary
+    book: str | None = None
+
+
+class GameRecord(NamedTuple):
+    index: int
+    white: int
+    black: int
+    result: str
+    reason: str
+    plies: int
+    pgn: str
+    nodes: int
+    search_time: float
+
+
+def parse_player(text: str) -> PlayerSpec:
+    # name:key=value,key=value with keys backend, depth, nodes, movetime, tc=base+increment, hash, book
+    name, _, options = text.partition(':')
+    fields: dict = {'name': name}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        if key == 'tc':
+            base, _, increment = value.partition('+')
+            fields['base'], fields['increment'] = float(base), float(increment or 0)
+        elif key in ('depth', 'nodes'):
+            fields[key] = int(value)
+        elif key in ('movetime', 'hash'):
+            fields['hash_mb' if key == 'hash' else key] = float(value)
+        elif key in ('backend', 'book'):
+            fields[key] = value
+        else:
+            raise ValueError(f'unknown player option {key!r} in {text!r}')
+    if not any(fields.get(key) for key in ('depth', 'nodes', 'movetime', 'base')):
+        fields['depth'] = 3
+    return PlayerSpec(**fields)
+
+
+def insufficient_material(squares: bytearray) -> bool:
+    # bare kings, or a single knight or bishop beside them
+    pieces = bytes(code & TYPE_MASK for code in squares if code)
+    return len(pieces) <= 3 and pieces.count(KING) == 2 and (len(pieces) == 2 or KNIGHT in pieces or BISHOP in pieces)
+
+
+_players: list[tuple[PlayerSpec, EngineBase, Searcher]] = []
+
+
+def _init_worker(specs: list[PlayerSpec]) -> None:
+    logging.disable(logging.DEBUG)
+    for spec in specs:
+        engine = new_engine(backend=spec.backend)
+        if spec.book:
+            engine.load_book(spec.book)
+        _players.append((spec, engine, Searcher(engine, spec.hash_mb)))
+
+
+def play_game(index: int, opening: str, white: int, black: int, max_plies: int = MAX_PLIES) -> GameRecord:
+    sides = [_players[white], _players[black]]
+    for _, engine, searcher in sides:
+        engine.load_fen(opening)
+        searcher.clear()
+    referee = sides[0][1]
+    first_ply = referee.move
+    clocks = [spec.base or 0.0 for spec, _, _ in sides]
+    keys = [referee.hash_key]
+    sans: list[str] = []
+    nodes, search_time = 0, 0.0
+    result = reason = ''
+    while not result:
+        color = referee.move % 2
+        if not referee.has_legal_move():
+            result, reason = ('0-1' if color == 0 else '1-0', 'checkmate') if referee.in_check() else \
+                ('1/2-1/2', 'stalemate')
+            break
+        if referee.halfmove_clock >= 100:
+            result, reason = '1/2-1/2', '50-move rule'
+        elif keys.count(keys[-1]) >= 3:
+            result, reason = '1/2-1/2', 'repetition'
+        elif insufficient_material(referee.board.squares):
+            result, reason = '1/2-1/2', 'insufficient material'
+        elif len(sans) >= max_plies:
+            result, reason = '1/2-1/2', 'ply limit'
+        if result:
+            break
+        spec, engine, searcher = sides[color]
+        movetime = spec.movetime
+        if spec.base:
+            budget = clocks[color] / MOVES_TO_GO + spec.increment * 0.8
+            movetime = max(min(budget, clocks[color] / 2), 0.001)
+        move = engine.book_move()
+        found = searcher.search(spec.depth, movetime, spec.nodes) if move == NO_MOVE else \
+            SearchResult(move, 0, [move], 0, 0, 0.0, 0)
+        nodes += found.nodes
+        search_time += found.time
+        if spec.base:
+            clocks[color] -= found.time
+            if clocks[color] < 0:
+                result, reason = ('0-1' if color == 0 else '1-0', 'time forfeit')
+                break
+            clocks[color] += spec.increment
+        move = found.move
+        sans.append(move_san(referee, move))
+        for _, other, _ in sides:
+            other.make_move(move)
+        keys.append(referee.hash_key)
+    headers = {'Event': 'arena', 'Round': str(index + 1), 'White': sides[0][0].name, 'Black': sides[1][0].name}
+    if opening != START_FEN:
+        headers |= {'SetUp': '1', 'FEN': opening}
+    headers['Termination'] = reason
+    return GameRecord(index, white, black, result, reason, len(sans), format_game(headers, sans, result, first_ply),
+                      nodes, search_time)
+
+
+def elo(wins: int, draws: int, losses: int) -> tuple[float, float]:
+    # Elo difference from the score and the half width of its 95% interval, a Wilson score interval on the
+    # per-game score variance, which keeps a width when every game has the same result; scores are held as far
+    # from 0 and 1 as one more drawn game would leave them, so a clean sweep reads as a large but finite difference
+    games = wins + draws + losses
+    if not games:
+        return 0.0, math.inf
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    spread = 1.96 ** 2 / games
+    center = (score + spread / 2) / (1 + spread)
+    margin = math.sqrt(spread * variance + spread ** 2 / 4) / (1 + spread)
+    limit = 0.5 / (games + 1)
+
+    def to_elo(value: float) -> float:
+        value = min(max(value, limit), 1 - limit)
+        return 400 * math.log10(value / (1 - value))
+
+    return to_elo(score), (to_elo(center + margin) - to_elo(center - margin)) / 2
+
+
+def random_openings(count: int, plies: int = OPENING_PLIES, seed: int = 0) -> list[str]:
+    # up to count distinct FENs, each plies random legal moves from the start position and not already over
+    generator = random.Random(seed)
+    engine = new_engine(START_FEN)
+    openings: dict[str, None] = {}
+    for _ in range(count * 100):
+        if len(openings) >= count:
+            break
+        engine.load_fen(START_FEN)
+        for _ in range(plies):
+            if not (moves := engine.valid_moves()):
+                break
+            engine.make_move(generator.choice(moves))
+        if engine.has_legal_move():
+            openings[engine.to_fen()] = None
+    return list(openings)
+
+
+def schedule(openings: list[str], games: int) -> list[tuple[int, str, int, int]]:
+    # (index, opening, white player, black player), each opening once per colour before moving on
+    pairs = ((opening, swap) for opening in cycle(openings) for swap in (0, 1))
+    return [(index, opening, swap, swap ^ 1) for index, (opening, swap) in enumerate(islice(pairs, games))]
+
+
+def run_match(specs: list[PlayerSpec], openings: list[str], games: int, jobs: int = 1, max_plies: int = MAX_PLIES):
+    # yields GameRecords as games finish, in completion order
+    tasks = schedule(openings, games)
+    if jobs <= 1:
+        _players.clear()
+        _init_worker(specs)
+        for index, opening, white, black in tasks:
+            yield play_game(index, opening, white, black, max_plies)
+        return
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(specs,)) as pool:
+        futures = [pool.submit(play_game, index, opening, white, black, max_plies)
+                   for index, opening, white, black in tasks]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Self-play match between two engine configurations')
+    parser.add_argument('-p', '--player', action='append', default=[], metavar='NAME:OPTIONS',
+                        help='e.g. new:depth=4 or old:tc=10+0.1,hash=32,backend=bitboard; give two')
+    parser.add_argument('-n', '--games', type=int, default=20)
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='games played at once')
+    parser.add_argument('-o', '--openings', help='FEN/EPD file of starting positions, random openings if absent')
+    parser.add_argument('--random-plies', type=int, default=OPENING_PLIES,
+                        help='random moves making each opening when there is no openings file, 0 for the start position')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random openings')
+    parser.add_argument('--pgn', help='append every finished game to this PGN file')
+    parser.add_argument('--max-plies', type=int, default=MAX_PLIES)
+    args = parser.parse_args(argv)
+    logging.disable(logging.DEBUG)
+
+    players = args.player or ['a:depth=3', 'b:depth=2']
+    if len(players) != 2:
+        parser.error('give exactly two players')
+    specs = [parse_player(player) for player in players]
+    if args.openings:
+        openings = [format_fen(position) for position in read_fens(args.openings)]
+    elif args.random_plies:
+        openings = random_openings((args.games + 1) // 2, args.random_plies, args.seed)
+    else:
+        openings = [START_FEN]
+
+    output = open(args.pgn, 'a') if args.pgn else None
+    # wins, draws, losses of the first player
+    score = [0, 0, 0]
+    nodes = search_time = 0
+    start = time.perf_counter()
+    try:
+        for done, record in enumerate(run_match(specs, openings, args.games, args.jobs, args.max_plies), 1):
+            first_white = record.white == 0
+            if record.result == '1/2-1/2':
+                score[1] += 1
+            elif (record.result == '1-0') == first_white:
+                score[0] += 1
+            else:
+                score[2] += 1
+            nodes += record.nodes
+            search_time += record.search_time
+            print(f'game {record.index + 1:>4}: {specs[record.white].name} - {specs[record.black].name} '
+                  f'{record.result:<7} {record.reason:<21} {record.plies:>3} plies  '
+                  f'[{done}/{args.games}  +{score[0]} ={score[1]} -{score[2]}]', flush=True)
+            if output:
+                output.write(record.pgn + '\n')
+                output.flush()
+    finally:
+        if output:
+            output.close()
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    games = sum(score)
+    difference, margin = elo(*score)
+    print(f'{specs[0].name} vs {specs[1].name}: +{score[0]} ={score[1]} -{score[2]}  '
+          f'elo {difference:+.1f} +/- {margin:.1f}')
+    print(f'{games} games in {elapsed:.1f}s  {games * 3600 / elapsed:.0f} games/hour  '
+          f'{nodes / max(search_time, 1e-9):.0f} nps average')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+import argparse
+import logging
+import sys
+import time
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from utils import *
+from evaluation import (DOUBLED_PAWN, EG_SCORES, ISOLATED_PAWN, MG_SCORES, PHASE_WEIGHTS, TOTAL_PHASE,
+                        evaluate_position)
+
+
+log = logging.getLogger('batch_evaluation')
+
+
+"""
+Vectorized evaluate_position over many positions at once, for scoring datasets.
+Positions are encoded as an (N, 64) int8 tensor of the same piece codes Board.load_arrangement writes,
+so every batched score equals evaluate_position on the same squares. Mobility needs move generation
+and is left out, scores are from white's point of view.
+"""
+CHUNK_SIZE = 65536
+# one plane per piece code PAWN..KING for white then black, the order of PIECE_NAMES without the gaps
+PLANE_CODES = (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING,
+               PAWN | BLACK_PIECE, KNIGHT | BLACK_PIECE, BISHOP | BLACK_PIECE,
+               ROOK | BLACK_PIECE, QUEEN | BLACK_PIECE, KING | BLACK_PIECE)
+
+_MG = np.array(MG_SCORES, dtype=np.int32)
+_EG = np.array(EG_SCORES, dtype=np.int32)
+_PHASE = np.array(PHASE_WEIGHTS, dtype=np.int32)
+_SQUARES = np.arange(64)
+
+
+def encode(positions: Iterable[str | bytes | bytearray]) -> np.ndarray:
+    # (N, 64) int8 piece codes from FEN strings or 64-byte square arrays such as Board.squares
+    data = b''.join(encode_placement(position) if isinstance(position, str) else bytes(position)
+                    for position in positions)
+    if len(data) % 64:
+        raise ValueError('square arrays must hold 64 codes')
+    return np.frombuffer(data, dtype=np.int8).reshape(-1, 64)
+
+
+def planes(codes: np.ndarray) -> np.ndarray:
+    # (N, 64) piece codes to (N, 12, 64) int8 one-hot planes in PLANE_CODES order
+    return (codes[:, None, :] == np.array(PLANE_CODES, dtype=np.int8)[None, :, None]).astype(np.int8)
+
+
+def pawn_structure(codes: np.ndarray) -> np.ndarray:
+    score = np.zeros(len(codes), dtype=np.int64)
+    for pawn, sign in ((PAWN, 1), (PAWN | BLACK_PIECE, -1)):
+        # (N, 8) pawns per file, padded with an empty file on each side
+        files = (codes == pawn).reshape(-1, 8, 8).sum(axis=1, dtype=np.int64)
+        padded = np.pad(files, ((0, 0), (1, 1)))
+        isolated = (padded[:, :-2] == 0) & (padded[:, 2:] == 0)
+        penalty = DOUBLED_PAWN * np.maximum(files - 1, 0) + ISOLATED_PAWN * files * isolated
+        score += sign * penalty.sum(axis=1)
+    return score
+
+
+def evaluate_batch(codes: np.ndarray) -> np.ndarray:
+    # (N, 64) piece codes or (N, 12, 64) planes to (N,) int64 scores, white's point of view
+    if codes.ndim == 3:
+        codes = (codes * np.array(PLANE_CODES, dtype=np.int8)[None, :, None]).sum(axis=1)
+    codes = codes.astype(np.intp)
+    mg = _MG[codes, _SQUARES].sum(axis=1, dtype=np.int64)
+    eg = _EG[codes, _SQUARES].sum(axis=1, dtype=np.int64)
+    phase = np.minimum(_PHASE[codes].sum(axis=1, dtype=np.int64), TOTAL_PHASE)
+    blend = mg * phase + eg * (TOTAL_PHASE - phase)
+    # rounded towards zero, as taper does
+    return np.sign(blend) * (np.abs(blend) // TOTAL_PHASE) + pawn_structure(codes)
+
+
+def chunks(positions: Iterable, chunk_size: int) -> Iterator[list]:
+    chunk = []
+    for position in positions:
+        chunk.append(position)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def evaluate_stream(positions: Iterable[str | bytes | bytearray], chunk_size: int = CHUNK_SIZE) -> Iterator[np.ndarray]:
+    # scores chunk by chunk so only one chunk of positions is held in memory
+    for chunk in chunks(positions, chunk_size):
+        yield evaluate_batch(encode(chunk))
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Score FEN/EPD positions in vectorized batches')
+    parser.add_argument('file', help='one FEN or EPD position per line, - for stdin')
+    parser.add_argument('-c', '--chunk', type=int, default=CHUNK_SIZE, help='positions per batch')
+    parser.add_argument('-o', '--output', help='write one score per line to this file')
+    parser.add_argument('--check', action='store_true', help='compare every score with evaluate_position')
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.file == '-' else open(args.file)
+    output = open(args.output, 'w') if args.output else None
+    lines = (line for line in source if line.strip())
+    count = mismatches = 0
+    elapsed = 0.0
+    try:
+        for chunk in chunks(lines, args.chunk):
+            start = time.perf_counter()
+            scores = evaluate_batch(encode(chunk))
+            elapsed += time.perf_counter() - start
+            count += len(scores)
+            if output:
+                output.write('\n'.join(map(str, scores.tolist())) + '\n')
+            if args.check:
+                for line, score in zip(chunk, scores.tolist()):
+                    expected = evaluate_position(bytearray(encode_placement(line)))
+                    if expected != score:
+                        mismatches += 1
+                        print(f'mismatch {score} != {expected}: {line.strip()}')
+    finally:
+        if output:
+            output.close()
+        if source is not sys.stdin:
+            source.close()
+    # timed over encoding and scoring only, not reading, writing or checking
+    print(f'{count} positions  {elapsed:.3f}s  {count / max(elapsed, 1e-9):.0f} positions/s')
+    if args.check:
+        print(f'checked {count} positions, {mismatches} mismatches')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
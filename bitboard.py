@@ -0,0 +1,531 @@
+from utils import *
+from transposition import CASTLING_KEYS, EN_PASSANT_KEYS, PIECE_KEYS, SIDE_KEY
+from fen import Position
+from evaluation import EG_SCORES, EXCHANGE_VALUES, MG_SCORES, PHASE_WEIGHTS
+from engine_base import EngineBase
+import logging
+
+
+log = logging.getLogger('bitboard')
+
+
+"""
+Bitboards use the same square numbering as Board.squares: bit n is square n, a8 is bit 0, h1 is bit 63.
+Moving a square towards rank 8 is a shift right by 8, towards the h-file a shift left by 1.
+"""
+_N, _S, _E, _W = RAY_MASKS[NORTH], RAY_MASKS[SOUTH], RAY_MASKS[EAST], RAY_MASKS[WEST]
+_NE, _NW, _SE, _SW = RAY_MASKS[NORTH_EAST], RAY_MASKS[NORTH_WEST], RAY_MASKS[SOUTH_EAST], RAY_MASKS[SOUTH_WEST]
+
+
+def rook_attacks(square: int, occupied: int) -> int:
+    # rays towards higher squares stop at their lowest blocker, rays towards lower squares at the highest
+    ray = _S[square]
+    blockers = ray & occupied
+    attacks = ray ^ _S[(blockers & -blockers).bit_length() - 1] if blockers else ray
+    ray = _E[square]
+    blockers = ray & occupied
+    attacks |= ray ^ _E[(blockers & -blockers).bit_length() - 1] if blockers else ray
+    ray = _N[square]
+    blockers = ray & occupied
+    attacks |= ray ^ _N[blockers.bit_length() - 1] if blockers else ray
+    ray = _W[square]
+    blockers = ray & occupied
+    attacks |= ray ^ _W[blockers.bit_length() - 1] if blockers else ray
+    return attacks
+
+
+def bishop_attacks(square: int, occupied: int) -> int:
+    ray = _SE[square]
+    blockers = ray & occupied
+    attacks = ray ^ _SE[(blockers & -blockers).bit_length() - 1] if blockers else ray
+    ray = _SW[square]
+    blockers = ray & occupied
+    attacks |= ray ^ _SW[(blockers & -blockers).bit_length() - 1] if blockers else ray
+    ray = _NE[square]
+    blockers = ray & occupied
+    attacks |= ray ^ _NE[blockers.bit_length() - 1] if blockers else ray
+    ray = _NW[square]
+    blockers = ray & occupied
+    attacks |= ray ^ _NW[blockers.bit_length() - 1] if blockers else ray
+    return attacks
+
+
+class BitboardEngine(EngineBase):
+    backend = 'bitboard'
+
+    def __init__(self, arrangment=None) -> None:
+        # pieces[code] is the bitboard of that piece code, occupancy[0] white and occupancy[1] black
+        self.pieces: list[int] = [0] * 15
+        self.occupancy: list[int] = [0, 0]
+        # pinned pieces of the side to move, from check_for_check along with checkers and pin_rays
+        self.pinned: int = 0
+        super().__init__(arrangment)
+
+    def place(self, position: Position) -> None:
+        self.board.squares[:] = position.squares
+        self.pieces = [0] * 15
+        self.occupancy = [0, 0]
+        self.history.clear()
+        self.moves_stale = True
+        self.checks_key = -1
+        for square, code in enumerate(self.board.squares):
+            if code:
+                self.pieces[code] |= 1 << square
+                self.occupancy[code >> 3] |= 1 << square
+        self.move = 2 * (position.fullmove_number - 1) + position.side
+        self.castling_rights = position.castling_rights
+        self.en_passant_square = position.en_passant_square
+        self.halfmove_clock = position.halfmove_clock
+
+    def attack_map(self, side: int) -> int:
+        pieces = self.pieces
+        occupied = self.occupancy[0] | self.occupancy[1]
+        flag = side << 3
+        attacks = 0
+        for code, table in ((PAWN | flag, PAWN_CAPTURE_MASKS[side]), (KNIGHT | flag, KNIGHT_MASKS),
+                            (KING | flag, KING_MASKS)):
+            bb = pieces[code]
+            while bb:
+                bit = bb & -bb
+                bb ^= bit
+                attacks |= table[bit.bit_length() - 1]
+        queens = pieces[QUEEN | flag]
+        bb = pieces[BISHOP | flag] | queens
+        while bb:
+            bit = bb & -bb
+            bb ^= bit
+            attacks |= bishop_attacks(bit.bit_length() - 1, occupied)
+        bb = pieces[ROOK | flag] | queens
+        while bb:
+            bit = bb & -bb
+            bb ^= bit
+            attacks |= rook_attacks(bit.bit_length() - 1, occupied)
+        return attacks
+
+    def is_attacked(self, square: int, side: int, occupied: int | None = None) -> bool:
+        # is square attacked by the pieces of side (0 white, 1 black), sliders stopping at occupied
+        pieces = self.pieces
+        if occupied is None:
+            occupied = self.occupancy[0] | self.occupancy[1]
+        flag = side << 3
+        if KNIGHT_MASKS[square] & pieces[KNIGHT | flag] or KING_MASKS[square] & pieces[KING | flag]:
+            return True
+        if PAWN_CAPTURE_MASKS[side ^ 1][square] & pieces[PAWN | flag]:
+            return True
+        queens = pieces[QUEEN | flag]
+        sliders = pieces[BISHOP | flag] | queens
+        if BISHOP_MASKS[square] & sliders and bishop_attacks(square, occupied) & sliders:
+            return True
+        sliders = pieces[ROOK | flag] | queens
+        return bool(ROOK_MASKS[square] & sliders and rook_attacks(square, occupied) & sliders)
+
+    def in_check(self) -> bool:
+        side = self.move & 1
+        king = self.pieces[KING | side << 3]
+        return self.is_attacked(king.bit_length() - 1, side ^ 1, self.occupancy[0] | self.occupancy[1])
+
+    def check_for_check(self) -> None:
+        # checkers, evasion mask and pins against the king of the side to move
+        pieces = self.pieces
+        side = self.move & 1
+        flag, enemy_flag = side << 3, (side ^ 1) << 3
+        us = self.occupancy[side]
+        occupied = us | self.occupancy[side ^ 1]
+        king_square = pieces[KING | flag].bit_length() - 1
+        enemy_queens = pieces[QUEEN | enemy_flag]
+        enemy_rooks = pieces[ROOK | enemy_flag] | enemy_queens
+        enemy_bishops = pieces[BISHOP | enemy_flag] | enemy_queens
+
+        checkers = (KNIGHT_MASKS[king_square] & pieces[KNIGHT | enemy_flag]
+                    | PAWN_CAPTURE_MASKS[side][king_square] & pieces[PAWN | enemy_flag]
+                    | rook_attacks(king_square, occupied) & enemy_rooks
+                    | bishop_attacks(king_square, occupied) & enemy_bishops)
+        if not checkers:
+            evasion = FULL
+        elif checkers & (checkers - 1):
+            evasion = 0
+        else:
+            evasion = BETWEEN[king_square][checkers.bit_length() - 1] | checkers
+
+        # a piece is pinned when it is the only piece between the king and an enemy slider on the same line
+        pinned = 0
+        pin_rays: dict[int, int] = {}
+        snipers = ROOK_MASKS[king_square] & enemy_rooks | BISHOP_MASKS[king_square] & enemy_bishops
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            sniper = bit.bit_length() - 1
+            between = BETWEEN[king_square][sniper]
+            blockers = between & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & us:
+                pinned |= blockers
+                pin_rays[blockers.bit_length() - 1] = between | bit
+        self.checkers, self.evasion_mask, self.pinned, self.pin_rays = checkers, evasion, pinned, pin_rays
+        self.checks_key = self.hash_key
+
+    def generate_moves(self, kind: int = ALL_MOVES, square: int = OFF_BOARD, limit: int = MAX_MOVES) -> array:
+        # as ChessEngine.generate_moves: legal moves of one kind, of one piece unless square is OFF_BOARD,
+        # stopping after the first piece that brings the count to limit
+        if not self.moves_stale and not kind & CHECKS_ONLY:
+            if kind == ALL_MOVES and square == OFF_BOARD:
+                return self.all_valid_moves
+            return array('H', [move for move in self.all_valid_moves
+                               if MOVE_KINDS[move >> 12] & kind and (square == OFF_BOARD or move & 63 == square)])
+        if self.checks_key != self.hash_key:
+            self.check_for_check()
+        moves = self.move_buffer
+        count = 0
+        pieces = self.pieces
+        side = self.move & 1
+        flag = side << 3
+        us, them = self.occupancy[side], self.occupancy[side ^ 1]
+        occupied = us | them
+        king_square = pieces[KING | flag].bit_length() - 1
+        king_bit = 1 << king_square
+        only = FULL if square == OFF_BOARD else 1 << square
+        # the end squares a move of this kind may have, promotions are sorted out by the pawns
+        allowed = (them if kind & TACTICAL_MOVES else 0) | (~occupied & FULL if kind & QUIET_MOVES else 0)
+        checks = self.check_squares() if kind & CHECKS_ONLY else None
+
+        if only & king_bit:
+            targets = KING_MASKS[king_square] & allowed
+            if checks is not None:
+                # a king only checks by uncovering one
+                check_masks, discoverers, enemy_king = checks
+                targets &= ~LINE[enemy_king][king_square] if discoverers & king_bit else 0
+            without_king = occupied ^ king_bit
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                end = bit.bit_length() - 1
+                if not self.is_attacked(end, side ^ 1, without_king):
+                    moves[count] = king_square | end << 6 | (CAPTURE << 12 if bit & them else 0)
+                    count += 1
+            if not self.checkers and kind & QUIET_MOVES and checks is None:
+                count = self._castling_moves(side, king_square, occupied, count)
+
+        evasion = self.evasion_mask & allowed
+        if not self.evasion_mask or count >= limit or only == king_bit:
+            return moves[:count]
+        pinned, pin_rays = self.pinned, self.pin_rays
+        for code, attacks in ((KNIGHT | flag, None), (BISHOP | flag, bishop_attacks),
+                              (ROOK | flag, rook_attacks), (QUEEN | flag, None)):
+            bb = pieces[code] & only
+            while bb:
+                bit = bb & -bb
+                bb ^= bit
+                square = bit.bit_length() - 1
+                if checks is not None and not bit & checks[1] and \
+                        not checks[0][code & TYPE_MASK] & REACH_MASKS[code & TYPE_MASK][square]:
+                    continue
+                if code & TYPE_MASK == KNIGHT:
+                    if bit & pinned:
+                        continue
+                    targets = KNIGHT_MASKS[square] & evasion
+                elif attacks is None:
+                    targets = (rook_attacks(square, occupied) | bishop_attacks(square, occupied)) & evasion
+                else:
+                    targets = attacks(square, occupied) & evasion
+                if bit & pinned:
+                    targets &= pin_rays[square]
+                if checks is not None:
+                    check_masks, discoverers, enemy_king = checks
+                    targets &= check_masks[code & TYPE_MASK] | (~LINE[enemy_king][square] if bit & discoverers else 0)
+                captures = targets & them
+                targets ^= captures
+                while targets:
+                    target = targets & -targets
+                    targets ^= target
+                    moves[count] = square | (target.bit_length() - 1) << 6
+                    count += 1
+                capture = square | CAPTURE << 12
+                while captures:
+                    target = captures & -captures
+                    captures ^= target
+                    moves[count] = capture | (target.bit_length() - 1) << 6
+                    count += 1
+                if count >= limit:
+                    return moves[:count]
+
+        count = self._pawn_moves(side, them, occupied, kind, only, king_square, count, limit, checks)
+        return moves[:count]
+
+    def check_squares(self) -> tuple[list[int], int, int]:
+        # as ChessEngine.check_squares: per piece type the squares checking the enemy king, the pieces uncovering
+        # a check when they leave their line with it, and its square
+        pieces = self.pieces
+        side = self.move & 1
+        flag = side << 3
+        us = self.occupancy[side]
+        occupied = us | self.occupancy[side ^ 1]
+        enemy_king = pieces[KING | flag ^ BLACK_PIECE].bit_length() - 1
+        empty = ~occupied & FULL
+        diagonal = bishop_attacks(enemy_king, occupied) & empty
+        straight = rook_attacks(enemy_king, occupied) & empty
+        queens = pieces[QUEEN | flag]
+        discoverers = 0
+        snipers = ROOK_MASKS[enemy_king] & (pieces[ROOK | flag] | queens) | \
+            BISHOP_MASKS[enemy_king] & (pieces[BISHOP | flag] | queens)
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            blockers = BETWEEN[enemy_king][bit.bit_length() - 1] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & us:
+                discoverers |= blockers
+        check_masks = [0, PAWN_CAPTURE_MASKS[side ^ 1][enemy_king], KNIGHT_MASKS[enemy_king], diagonal, straight,
+                       diagonal | straight, 0]
+        return check_masks, discoverers, enemy_king
+
+    def attackers_to(self, square: int, occupied: int) -> int:
+        # the pieces of both sides in occupied attacking square, sliders looking through squares not in occupied
+        pieces = self.pieces
+        queens = pieces[QUEEN] | pieces[QUEEN | BLACK_PIECE]
+        return (PAWN_CAPTURE_MASKS[1][square] & pieces[PAWN] | PAWN_CAPTURE_MASKS[0][square] & pieces[PAWN | BLACK_PIECE]
+                | KNIGHT_MASKS[square] & (pieces[KNIGHT] | pieces[KNIGHT | BLACK_PIECE])
+                | KING_MASKS[square] & (pieces[KING] | pieces[KING | BLACK_PIECE])
+                | bishop_attacks(square, occupied) & (pieces[BISHOP] | pieces[BISHOP | BLACK_PIECE] | queens)
+                | rook_attacks(square, occupied) & (pieces[ROOK] | pieces[ROOK | BLACK_PIECE] | queens)) & occupied
+
+    def see(self, move: int) -> int:
+        # as ChessEngine.see, with pieces that have captured taken out of the occupancy the attacks are read against
+        start, end, flags = move & 63, move >> 6 & 63, move >> 12
+        pieces = self.pieces
+        squares = self.board.squares
+        code = squares[start]
+        side = code >> 3
+        occupied = (self.occupancy[0] | self.occupancy[1]) ^ 1 << start
+        gains = [EXCHANGE_VALUES[squares[end]]]
+        if flags == EN_PASSANT:
+            occupied ^= 1 << (end + (8 if side == 0 else -8))
+            gains[0] = EXCHANGE_VALUES[PAWN]
+        elif flags & PROMOTION:
+            code = PROMOTION_PIECES[flags] | side << 3
+            gains[0] += EXCHANGE_VALUES[code] - EXCHANGE_VALUES[PAWN]
+        attackers = self.attackers_to(end, occupied)
+        queens = pieces[QUEEN] | pieces[QUEEN | BLACK_PIECE]
+        diagonal = pieces[BISHOP] | pieces[BISHOP | BLACK_PIECE] | queens
+        straight = pieces[ROOK] | pieces[ROOK | BLACK_PIECE] | queens
+        while True:
+            side ^= 1
+            flag = side << 3
+            for piece_type in range(PAWN, KING + 1):
+                candidates = attackers & pieces[piece_type | flag]
+                if candidates:
+                    break
+            else:
+                break
+            gain = EXCHANGE_VALUES[code] - gains[-1]
+            if max(-gains[-1], gain) < 0:
+                break
+            gains.append(gain)
+            bit = candidates & -candidates
+            occupied ^= bit
+            attackers ^= bit
+            code = piece_type | flag
+            # only a slider can stand behind the piece that left, on its line with the square
+            if piece_type == PAWN or piece_type == BISHOP or piece_type == QUEEN:
+                attackers |= bishop_attacks(end, occupied) & diagonal & occupied
+            if piece_type == ROOK or piece_type == QUEEN:
+                attackers |= rook_attacks(end, occupied) & straight & occupied
+        while len(gains) > 1:
+            gain = gains.pop()
+            gains[-1] = -max(-gains[-1], gain)
+        return gains[0]
+
+    def _castling_moves(self, side: int, king_square: int, occupied: int, count: int) -> int:
+        rights = self.castling_rights >> (side * 2)
+        if not rights & 3 or king_square != (4 if side else 60):
+            return count
+        moves = self.move_buffer
+        enemy = side ^ 1
+        if (rights & 1 and not occupied & (3 << (king_square + 1))
+                and not self.is_attacked(king_square + 1, enemy, occupied)
+                and not self.is_attacked(king_square + 2, enemy, occupied)):
+            moves[count] = king_square | king_square + 2 << 6 | KING_CASTLE << 12
+            count += 1
+        if (rights & 2 and not occupied & (7 << (king_square - 3))
+                and not self.is_attacked(king_square - 1, enemy, occupied)
+                and not self.is_attacked(king_square - 2, enemy, occupied)):
+            moves[count] = king_square | king_square - 2 << 6 | QUEEN_CASTLE << 12
+            count += 1
+        return count
+
+    def _pawn_moves(self, side: int, them: int, occupied: int, kind: int, only: int, king_square: int,
+                    count: int, limit: int, checks: tuple[list[int], int, int] | None = None) -> int:
+        moves = self.move_buffer
+        flag = side << 3
+        pawns = self.pieces[PAWN | flag] & only
+        evasion, pinned, pin_rays = self.evasion_mask, self.pinned, self.pin_rays
+        forward, start_row, last_row = (8, 1, 7) if side else (-8, 6, 0)
+        attacks_table = PAWN_CAPTURE_MASKS[side]
+        en_passant = self.en_passant_square if kind & TACTICAL_MOVES else OFF_BOARD
+        while pawns:
+            bit = pawns & -pawns
+            pawns ^= bit
+            square = bit.bit_length() - 1
+            targets = 0
+            double = 0
+            one = square + forward
+            # pushes onto the last row promote, which makes them tactical
+            if not occupied >> one & 1 and kind & (TACTICAL_MOVES if one >> 3 == last_row else QUIET_MOVES):
+                targets = 1 << one
+                if square >> 3 == start_row and not occupied >> (one + forward) & 1:
+                    double = 1 << (one + forward)
+            if kind & TACTICAL_MOVES:
+                targets |= attacks_table[square] & them
+            targets &= evasion
+            double &= evasion
+            if bit & pinned:
+                targets &= pin_rays[square]
+                double &= pin_rays[square]
+            if checks is not None:
+                check_masks, discoverers, enemy_king = checks
+                mask = check_masks[PAWN] | (~LINE[enemy_king][square] if bit & discoverers else 0)
+                targets &= mask
+                double &= mask
+            if double:
+                moves[count] = square | (one + forward) << 6 | DOUBLE_PUSH << 12
+                count += 1
+            while targets:
+                target = targets & -targets
+                targets ^= target
+                end = target.bit_length() - 1
+                move = square | end << 6 | (CAPTURE << 12 if target & them else 0)
+                if end >> 3 == last_row:
+                    for promotion in PROMOTIONS:
+                        moves[count] = move | PROMOTION_FLAGS[promotion] << 12
+                        count += 1
+                else:
+                    moves[count] = move
+                    count += 1
+            if en_passant != OFF_BOARD and attacks_table[square] >> en_passant & 1:
+                captured = en_passant - forward
+                # removing both pawns from one rank can expose the king, test the resulting occupancy directly
+                occupied_after = occupied ^ bit ^ (1 << captured) | 1 << en_passant
+                self.pieces[PAWN | (side ^ 1) << 3] ^= 1 << captured
+                exposed = self.is_attacked(king_square, side ^ 1, occupied_after)
+                self.pieces[PAWN | (side ^ 1) << 3] ^= 1 << captured
+                if not exposed:
+                    moves[count] = square | en_passant << 6 | EN_PASSANT << 12
+                    count += 1
+            if count >= limit:
+                break
+        return count
+
+    def make_move(self, move: int) -> None:
+        self.moves_stale = True
+        start, end, flags = move & 63, move >> 6 & 63, move >> 12
+        squares = self.board.squares
+        pieces = self.pieces
+        occupancy = self.occupancy
+        code = squares[start]
+        captured = squares[end]
+        self.history.push(move, captured, self.castling_rights, self.en_passant_square, self.halfmove_clock,
+                          self.hash_key)
+        self.halfmove_clock = 0 if captured or code & TYPE_MASK == PAWN else self.halfmove_clock + 1
+        side = code >> 3
+        key = (self.hash_key ^ SIDE_KEY ^ PIECE_KEYS[code][start] ^ PIECE_KEYS[code][end] ^ PIECE_KEYS[captured][end]
+               ^ EN_PASSANT_KEYS[self.en_passant_square] ^ CASTLING_KEYS[self.castling_rights])
+        start_bit, end_bit = 1 << start, 1 << end
+        pieces[code] ^= start_bit | end_bit
+        occupancy[side] ^= start_bit | end_bit
+        if captured:
+            pieces[captured] ^= end_bit
+            occupancy[side ^ 1] ^= end_bit
+        squares[end] = code
+        squares[start] = EMPTY
+        mg = self.mg_score + MG_SCORES[code][end] - MG_SCORES[code][start] - MG_SCORES[captured][end]
+        eg = self.eg_score + EG_SCORES[code][end] - EG_SCORES[code][start] - EG_SCORES[captured][end]
+        self.phase -= PHASE_WEIGHTS[captured]
+        en_passant = OFF_BOARD
+        if flags:
+            if flags == DOUBLE_PUSH:
+                en_passant = (start + end) >> 1
+            elif flags == EN_PASSANT:
+                captured_square = end + (8 if side == 0 else -8)
+                pieces[code ^ BLACK_PIECE] ^= 1 << captured_square
+                occupancy[side ^ 1] ^= 1 << captured_square
+                squares[captured_square] = EMPTY
+                key ^= PIECE_KEYS[code ^ BLACK_PIECE][captured_square]
+                mg -= MG_SCORES[code ^ BLACK_PIECE][captured_square]
+                eg -= EG_SCORES[code ^ BLACK_PIECE][captured_square]
+            elif flags & PROMOTION:
+                promoted = PROMOTION_PIECES[flags] | side << 3
+                pieces[code] ^= end_bit
+                pieces[promoted] |= end_bit
+                squares[end] = promoted
+                key ^= PIECE_KEYS[code][end] ^ PIECE_KEYS[promoted][end]
+                mg += MG_SCORES[promoted][end] - MG_SCORES[code][end]
+                eg += EG_SCORES[promoted][end] - EG_SCORES[code][end]
+                self.phase += PHASE_WEIGHTS[promoted]
+            elif flags == KING_CASTLE or flags == QUEEN_CASTLE:
+                rook_start, rook_end = (start + 3, start + 1) if flags == KING_CASTLE else (start - 4, start - 1)
+                rook = squares[rook_start]
+                rook_bits = 1 << rook_start | 1 << rook_end
+                pieces[rook] ^= rook_bits
+                occupancy[side] ^= rook_bits
+                squares[rook_end] = rook
+                squares[rook_start] = EMPTY
+                key ^= PIECE_KEYS[rook][rook_start] ^ PIECE_KEYS[rook][rook_end]
+                mg += MG_SCORES[rook][rook_end] - MG_SCORES[rook][rook_start]
+                eg += EG_SCORES[rook][rook_end] - EG_SCORES[rook][rook_start]
+        self.mg_score, self.eg_score = mg, eg
+        self.castling_rights &= CASTLING_MASK[start] & CASTLING_MASK[end]
+        self.en_passant_square = en_passant
+        self.hash_key = key ^ EN_PASSANT_KEYS[en_passant] ^ CASTLING_KEYS[self.castling_rights]
+        self.move += 1
+
+    def undo_move(self) -> None:
+        history = self.history
+        if not history:
+            return
+        index = history.pop()
+        move = history.moves[index]
+        start, end, flags = move & 63, move >> 6 & 63, move >> 12
+        squares = self.board.squares
+        pieces = self.pieces
+        occupancy = self.occupancy
+        code = squares[end]
+        side = code >> 3
+        start_bit, end_bit = 1 << start, 1 << end
+        mg, eg = self.mg_score - MG_SCORES[code][end], self.eg_score - EG_SCORES[code][end]
+        if flags & PROMOTION:
+            pieces[code] ^= end_bit
+            self.phase -= PHASE_WEIGHTS[code]
+            code = PAWN | side << 3
+            pieces[code] |= end_bit
+        pieces[code] ^= start_bit | end_bit
+        occupancy[side] ^= start_bit | end_bit
+        squares[start] = code
+        captured = squares[end] = history.captured[index]
+        mg += MG_SCORES[code][start] + MG_SCORES[captured][end]
+        eg += EG_SCORES[code][start] + EG_SCORES[captured][end]
+        if captured:
+            pieces[captured] |= end_bit
+            occupancy[side ^ 1] |= end_bit
+            self.phase += PHASE_WEIGHTS[captured]
+        if flags == EN_PASSANT:
+            captured_square = end + (8 if side == 0 else -8)
+            pieces[code ^ BLACK_PIECE] |= 1 << captured_square
+            occupancy[side ^ 1] |= 1 << captured_square
+            squares[captured_square] = code ^ BLACK_PIECE
+            mg += MG_SCORES[code ^ BLACK_PIECE][captured_square]
+            eg += EG_SCORES[code ^ BLACK_PIECE][captured_square]
+        elif flags == KING_CASTLE or flags == QUEEN_CASTLE:
+            rook_start, rook_end = (start + 3, start + 1) if flags == KING_CASTLE else (start - 4, start - 1)
+            rook = squares[rook_end]
+            rook_bits = 1 << rook_start | 1 << rook_end
+            pieces[rook] ^= rook_bits
+            occupancy[side] ^= rook_bits
+            squares[rook_start] = rook
+            squares[rook_end] = EMPTY
+            mg += MG_SCORES[rook][rook_start] - MG_SCORES[rook][rook_end]
+            eg += EG_SCORES[rook][rook_start] - EG_SCORES[rook][rook_end]
+        self.mg_score, self.eg_score = mg, eg
+        self.castling_rights = history.castling_rights[index]
+        self.en_passant_square = history.en_passant_squares[index]
+        self.halfmove_clock = history.halfmove_clocks[index]
+        self.hash_key = history.hash_keys[index]
+        self.move -= 1
+        self.moves_stale = True
+
@@ -0,0 +1,175 @@
+import argparse
+import logging
+import mmap
+import os
+import random
+import struct
+import sys
+from collections import defaultdict
+from typing import Iterable, NamedTuple
+
+from utils import *
+from polyglot import polyglot_key, polyglot_square
+from pgn import Game, open_pgn, parse_san, read_games, start_engine
+
+
+log = logging.getLogger('book')
+
+
+"""
+Opening books in the Polyglot format: 16-byte big-endian entries (key, move, weight, learn) sorted by key,
+probed by binary search over an mmap so only the touched pages are read. Keys are Polyglot position keys
+(polyglot.py) and moves use the Polyglot encoding (to file, to row, from file, from row, promotion in 3 bit
+fields, castling as king takes rook), so books built here and third-party Polyglot books are interchangeable.
+"""
+ENTRY = struct.Struct('>QHHI')
+KEY = struct.Struct('>Q')
+# polyglot promotion field for each promotion piece type
+POLYGLOT_PROMOTIONS = {EMPTY: 0, KNIGHT: 1, BISHOP: 2, ROOK: 3, QUEEN: 4}
+BUILD_PLIES = 20
+MAX_WEIGHT = 0xFFFF
+
+
+class BookEntry(NamedTuple):
+    move: int
+    weight: int
+    learn: int
+
+
+def encode_move(move: int) -> int:
+    start, end, flags = move & 63, move >> 6 & 63, move >> 12
+    if flags == KING_CASTLE:
+        end = start + 3
+    elif flags == QUEEN_CASTLE:
+        end = start - 4
+    return polyglot_square(start) << 6 | polyglot_square(end) | POLYGLOT_PROMOTIONS[PROMOTION_PIECES[flags]] << 12
+
+
+def book_key(engine) -> int:
+    return polyglot_key(engine.board.squares, engine.move & 1, engine.castling_rights, engine.en_passant_square)
+
+
+class OpeningBook:
+    def __init__(self, path: str, seed: int | None = None) -> None:
+        self.path = path
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.count: int = size // ENTRY.size
+        # mmap cannot map an empty file
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.random = random.Random(seed)
+
+    def lower_bound(self, key: int) -> int:
+        low, high = 0, self.count
+        data = self.data
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def entries(self, key: int) -> list[BookEntry]:
+        result = []
+        index = self.lower_bound(key)
+        while index < self.count:
+            entry_key, move, weight, learn = ENTRY.unpack_from(self.data, index * ENTRY.size)
+            if entry_key != key:
+                break
+            result.append(BookEntry(move, weight, learn))
+            index += 1
+        return result
+
+    def moves(self, engine) -> list[tuple[int, int]]:
+        # (packed legal move, weight) for the engine's position, entries that are not legal here are dropped
+        entries = self.entries(book_key(engine))
+        if not entries:
+            return []
+        legal = {encode_move(move): move for move in engine.valid_moves()}
+        return [(legal[entry.move], entry.weight) for entry in entries if entry.move in legal]
+
+    def choose(self, engine, mode: str = 'weighted') -> int:
+        # 'best' takes the heaviest move, 'weighted' picks at random in proportion to weight; NO_MOVE when out of book
+        moves = [(move, weight) for move, weight in self.moves(engine) if weight]
+        if not moves:
+            return NO_MOVE
+        if mode == 'best':
+            return max(moves, key=lambda item: item[1])[0]
+        return self.random.choices([move for move, _ in moves], [weight for _, weight in moves])[0]
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self) -> 'OpeningBook':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def build_book(games: Iterable[Game], path: str, plies: int = BUILD_PLIES, min_games: int = 1,
+               backend: str = 'object') -> int:
+    # weights count 2 per win and 1 per draw (or unknown result) for the side that played the move,
+    # Polyglot style, then scale so the heaviest entry fits 16 bits; returns the number of entries written
+    scores: dict[tuple[int, int], list[int]] = defaultdict(lambda: [0, 0])
+    engine = None
+    for game in games:
+        try:
+            engine = start_engine(game, engine, backend)
+            for san in game.moves[:plies]:
+                move = parse_san(engine, san)
+                side = engine.move % 2
+                won = game.result == ('1-0', '0-1')[side]
+                drawn = game.result in ('1/2-1/2', '*')
+                score = scores[book_key(engine), encode_move(move)]
+                score[0] += 2 if won else 1 if drawn else 0
+                score[1] += 1
+                engine.make_move(move)
+        except ValueError as error:
+            log.debug('skipping rest of game: %s', error)
+    kept = [(key, move, weight) for (key, move), (weight, count) in scores.items() if count >= min_games]
+    heaviest = max((weight for _, _, weight in kept), default=1) or 1
+    scale = min(1.0, MAX_WEIGHT / heaviest)
+    kept.sort(key=lambda item: (item[0], -item[2], item[1]))
+    with open(path, 'wb') as file:
+        for key, move, weight in kept:
+            file.write(ENTRY.pack(key, move, max(int(weight * scale), 1 if weight else 0), 0))
+    return len(kept)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Build or probe an opening book')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='build a book from a PGN collection')
+    build.add_argument('pgn', help='PGN file, optionally gzipped')
+    build.add_argument('book')
+    build.add_argument('--plies', type=int, default=BUILD_PLIES, help='book moves taken from the start of each game')
+    build.add_argument('--min-games', type=int, default=1, help='drop moves played in fewer games')
+    probe = commands.add_parser('probe', help='list the book moves of a position')
+    probe.add_argument('book')
+    probe.add_argument('--fen', default=None)
+    args = parser.parse_args(argv)
+    logging.disable(logging.DEBUG)
+
+    if args.command == 'build':
+        with open_pgn(args.pgn) as source:
+            count = build_book(read_games(source), args.book, args.plies, args.min_games)
+        print(f'{count} entries written to {args.book}')
+        return 0
+    from chess_engine import ChessEngine
+    engine = ChessEngine(args.fen)
+    with OpeningBook(args.book) as book:
+        moves = book.moves(engine)
+        total = sum(weight for _, weight in moves) or 1
+        for move, weight in sorted(moves, key=lambda item: -item[1]):
+            print(f'{move_name(move):<6} {weight:>6}  {100 * weight / total:5.1f}%')
+        if not moves:
+            print('out of book')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,98 +1,200 @@
+import argparse
 import time
 import sys
 import os
 import pygame
 import random
-from utils import Board, ChessPiece, Pawn, Pos, Move, Color
-from chess_engine import ChessEngine
+from utils import EMPTY, NO_MOVE, PIECE_NAMES, PROMOTION_PIECES, QUEEN, move_name
+from engine_worker import EngineWorker, Snapshot
 import logging
 
-logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger('main')
 
-pygame.init()
-
 
+"""
+Nothing touches the display on import: the engine worker process re-imports this module under the spawn and
+forkserver start methods, so pygame is initialised and the window opened in main().
+Rendering is event driven: the loop blocks in pygame.event.wait() until something happens, so an idle
+board costs no CPU. Board and piece images are scaled once; each frame compares the position and the
+highlighted squares with what is on screen and repaints and updates only the squares that differ.
+The engine runs in another process (engine_worker.py) and its replies wake the loop as ENGINE_EVENTs.
+Keys: z takes back, e hands the side to move to the engine, h makes it human against human, space makes
+the engine move now, f logs the frame times.
+"""
 SIZE = WIDTH, HEIGHT = 600, 600
-SCREEN = pygame.display.set_mode(SIZE)
 PIECES = {'n': 'bN', 'p': 'bp', 'r': 'bR', 'b': 'bB', 'q': 'bQ', 'k': 'bK', 'N': 'wN', 'P': 'wp', 'R': 'wR', 'B': 'wB', 'Q': 'wQ', 'K': 'wK', 'highlight': 'highlight'}
 ACTIVE = True
-CLOCK = pygame.time.Clock()
 BOARD_WHITE = (238, 238, 210)
 RANDOM_COLOR = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
 BOARD_BLACK = (118, 150, 86)
 HIGHLIGHT_COLOR = pygame.Color(255, 0, 0)
 SQUARE_SIZE = WIDTH // 8
-FPS = 10
+ENGINE_EVENT = pygame.event.custom_type()
+# the only events that wake the loop, mouse motion and the like are dropped by SDL
+EVENTS = [pygame.QUIT, pygame.MOUSEBUTTONDOWN, pygame.KEYDOWN, pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE, ENGINE_EVENT]
 
 
 def load_images():
     images = {}
     for img in PIECES:
-        images[img] = pygame.transform.scale(pygame.image.load(os.path.join('images', f'{PIECES[img]}.png')),(SQUARE_SIZE, SQUARE_SIZE))
+        images[img] = pygame.transform.scale(pygame.image.load(os.path.join('images', f'{PIECES[img]}.png')),(SQUARE_SIZE, SQUARE_SIZE)).convert_alpha()
     return images
 
-def draw_board():
-    image = pygame.transform.scale(pygame.image.load(os.path.join('images', 'board.png')), (WIDTH, HEIGHT))
-    SCREEN.blit(image, (0, 0))
-
-def draw_images(images, board: Board):
-    for x in range(8):
-        for y in range(8):
-            piece: ChessPiece = board.get_piece_on_square(Pos(x, y))
-            if piece.color != Color.EMPTY:
-                
-                SCREEN.blit(images[piece.name], (SQUARE_SIZE * y, SQUARE_SIZE * x))
-
-def highligh_squares(squares_to_highlight, images):
-    if not squares_to_highlight:
-        return False
-    squares_to_highlight = [i[1] for i in squares_to_highlight]
-    for x in range(8):
-        for y in range(8):
-            if (x, y) in squares_to_highlight:
-                SCREEN.blit(images['highlight'], (SQUARE_SIZE * y, SQUARE_SIZE * x))
-
-def draw_game(images, board, valid_moves):
-    draw_board()
-    draw_images(images, board)
-    highligh_squares(valid_moves, images)
-
-def main(arrangment = None):
-    engine = ChessEngine(arrangment)
-    engine.generate_all_valid_moves()
-    move = []
-    squares_to_highlight = []
-    images = load_images()
+def load_board():
+    return pygame.transform.scale(pygame.image.load(os.path.join('images', 'board.png')), (WIDTH, HEIGHT)).convert()
+
+def square_rect(square: int) -> pygame.Rect:
+    return pygame.Rect(SQUARE_SIZE * (square & 7), SQUARE_SIZE * (square >> 3), SQUARE_SIZE, SQUARE_SIZE)
+
+
+class Renderer:
+    def __init__(self, screen: pygame.Surface) -> None:
+        self.screen = screen
+        self.images = load_images()
+        self.board_image = load_board()
+        # what is on screen: a piece code per square and the highlighted squares, None forces a full repaint
+        self.shown: bytes | None = None
+        self.shown_highlights: set[int] = set()
+        # frame time counter: frames drawn, total, last and worst time spent drawing them, in seconds
+        self.frames = 0
+        self.frame_time = 0.0
+        self.last_frame = 0.0
+        self.worst_frame = 0.0
+
+    def invalidate(self) -> None:
+        self.shown = None
+
+    def render(self, squares: bytearray, highlights: set[int]) -> int:
+        # repaints the squares that changed since the last frame, returns how many
+        start = time.perf_counter()
+        if self.shown is None:
+            dirty = range(64)
+        else:
+            dirty = [square for square, (code, shown) in enumerate(zip(squares, self.shown)) if code != shown]
+            dirty += [square for square in highlights ^ self.shown_highlights if square not in dirty]
+        if not dirty:
+            return 0
+        screen, images, board_image = self.screen, self.images, self.board_image
+        rects = []
+        for square in dirty:
+            rect = square_rect(square)
+            screen.blit(board_image, rect, rect)
+            if squares[square]:
+                screen.blit(images[PIECE_NAMES[squares[square]]], rect)
+            if square in highlights:
+                screen.blit(images['highlight'], rect)
+            rects.append(rect)
+        pygame.display.update(rects)
+        self.shown = bytes(squares)
+        self.shown_highlights = set(highlights)
+        elapsed = time.perf_counter() - start
+        self.frames += 1
+        self.frame_time += elapsed
+        self.last_frame = elapsed
+        self.worst_frame = max(self.worst_frame, elapsed)
+        return len(dirty)
+
+    def report(self) -> str:
+        average = self.frame_time / self.frames if self.frames else 0.0
+        return (f'{self.frames} frames  last {self.last_frame * 1000:.2f}ms  average {average * 1000:.2f}ms  '
+                f'worst {self.worst_frame * 1000:.2f}ms')
+
+
+def move_between(state: Snapshot, start: int, end: int) -> int:
+    # the legal move from start to end, promoting to a queen
+    for move in state.moves:
+        if move & 63 == start and move >> 6 & 63 == end and PROMOTION_PIECES[move >> 12] in (EMPTY, QUEEN):
+            return move
+    return NO_MOVE
+
+
+def main(arrangment = None, engine_side: int | None = None, movetime: float = 1.0, ponder: bool = True):
+    pygame.init()
+    screen = pygame.display.set_mode(SIZE)
+    # blocking event types drops queued ones, so the filter goes up before the engine can post anything
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed(EVENTS)
+    # the engine lives in its own process; its replies arrive as ENGINE_EVENTs, so the loop never waits on it
+    worker = EngineWorker(lambda reply: pygame.event.post(pygame.event.Event(ENGINE_EVENT, reply=reply)), arrangment)
+    state: Snapshot | None = None
+    # serial of the go request in flight, 0 when the engine is not thinking
+    thinking = 0
+    selected = None
+    highlights: set[int] = set()
+    renderer = Renderer(screen)
+
+    def think() -> None:
+        nonlocal thinking
+        if state is not None and state.side == engine_side and state.moves and not thinking:
+            thinking = worker.go(movetime=movetime)
+            pygame.display.set_caption('thinking...')
+
     while ACTIVE:
-        for event in pygame.event.get():
+        if state is not None:
+            renderer.render(state.squares, highlights)
+        # sleep until there is something to do, then take everything that queued up meanwhile
+        for event in [pygame.event.wait(), *pygame.event.get()]:
             if event.type == pygame.QUIT:
+                log.info('frame time: %s', renderer.report())
+                worker.close()
                 sys.exit()
+            elif event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+                renderer.invalidate()
+            elif event.type == ENGINE_EVENT:
+                reply = event.reply
+                if isinstance(reply, Snapshot):
+                    state = reply
+                    if not state.moves:
+                        pygame.display.set_caption('checkmate' if state.in_check else 'stalemate')
+                    think()
+                elif reply.serial == thinking:
+                    thinking = 0
+                    result = reply.result
+                    pygame.display.set_caption(f'{move_name(reply.move)}  depth {result.depth}  score {result.score}'
+                                               f'{"  ponder hit" if reply.pondered else ""}')
+                    worker.move(reply.move)
+                    if ponder and reply.ponder:
+                        worker.ponder(reply.ponder)
             elif event.type == pygame.MOUSEBUTTONDOWN:
-                mouse_pos = pygame.mouse.get_pos()
-                square_clicked: Pos = (mouse_pos[1] // (HEIGHT // 8), mouse_pos[0] // (WIDTH // 8))
-                move.append(square_clicked)
-                if len(move) == 1:
-                    piece: ChessPiece = engine.board.get_piece_on_square(Pos(move[0][0], move[0][1]))
-                    if piece.color is not Color.EMPTY:
-                        squares_to_highlight = piece.valid_moves
-                elif len(move) == 2:
-                    if move[0] == move[1]:
-                        move = []
-                        squares_to_highlight = []
-                    else:
-                        squares_to_highlight = []
-                        engine.validate_and_make_move(Move(Pos(move[0][0], move[0][1]), Pos(move[1][0], move[1][1])))
-                        move = []
+                if state is None or thinking or state.side == engine_side:
+                    continue
+                square = event.pos[1] // SQUARE_SIZE * 8 + event.pos[0] // SQUARE_SIZE
+                if selected is None or square == selected:
+                    targets = {move >> 6 & 63 for move in state.moves if move & 63 == square}
+                    selected, highlights = (square, targets) if targets and square != selected else (None, set())
+                else:
+                    if (move := move_between(state, selected, square)) != NO_MOVE:
+                        worker.move(move)
+                    selected, highlights = None, set()
             elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_z:
-                    move = []
-                    squares_to_highlight = []
-                    engine.undo_move()
-        draw_game(images, engine.board, squares_to_highlight)
-        CLOCK.tick(FPS)
-        pygame.display.flip()
+                if event.key == pygame.K_z and state is not None:
+                    # take back the engine's reply too, unless it is still thinking about it
+                    plies = 2 if engine_side is not None and state.side != engine_side and not thinking else 1
+                    thinking = 0
+                    selected, highlights = None, set()
+                    worker.undo(plies)
+                elif event.key == pygame.K_e and state is not None:
+                    # the engine takes over the side to move
+                    engine_side = state.side
+                    think()
+                elif event.key == pygame.K_h:
+                    # human against human, a search in progress is dropped
+                    engine_side = None
+                    if thinking:
+                        thinking = 0
+                        worker.stop()
+                elif event.key == pygame.K_SPACE and thinking:
+                    worker.stop()
+                elif event.key == pygame.K_f:
+                    log.info('frame time: %s', renderer.report())
 
 
 if __name__ == '__main__':
-    main()
+    logging.basicConfig(level=logging.DEBUG)
+    parser = argparse.ArgumentParser(description='Play against the engine')
+    parser.add_argument('--fen', default=None)
+    parser.add_argument('--engine', choices=('white', 'black'), help='side the engine plays, e takes over later')
+    parser.add_argument('-t', '--movetime', type=float, default=1.0, help='seconds per engine move')
+    parser.add_argument('--no-ponder', action='store_true', help="do not think on the opponent's time")
+    args = parser.parse_args()
+    main(args.fen, {'white': 0, 'black': 1}.get(args.engine), args.movetime, not args.no_ponder)
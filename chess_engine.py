@@ -1,342 +1,528 @@
 from utils import *
+from bitboard import BitboardEngine, bishop_attacks, rook_attacks
+from engine_base import EngineBase
+from transposition import *
+from evaluation import *
+from fen import Position
 import logging
+from functools import reduce
+from operator import or_
 
 
-#logging.basicConfig(level=logging.INFO)
-logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger('engine')
 
 
-class MoveLog(NamedTuple):
-    move: Move
-    piece_moved: ChessPiece
-    piece_eaten: ChessPiece
-    en_passnst: bool
-    castling: bool
+def piece_attacks(code: int, square: int, occupied: int) -> int:
+    # the squares the piece attacks from square as a mask, sliders stopping at the first square in occupied
+    piece_type = code & TYPE_MASK
+    if piece_type == PAWN:
+        return PAWN_CAPTURE_MASKS[code >> 3][square]
+    if piece_type == KNIGHT:
+        return KNIGHT_MASKS[square]
+    if piece_type == BISHOP:
+        return bishop_attacks(square, occupied)
+    if piece_type == ROOK:
+        return rook_attacks(square, occupied)
+    if piece_type == QUEEN:
+        return bishop_attacks(square, occupied) | rook_attacks(square, occupied)
+    return KING_MASKS[square]
 
 
-"""
-TODO 1. undo pawn promotion and add promotion bool to move log
-"""
+def least_valuable_attacker(squares: bytearray, square: int, side: int) -> int:
+    # the square of the cheapest piece of side attacking square, OFF_BOARD when there is none
+    flag = side << 3
+    pawn = PAWN | flag
+    for start in PAWN_CAPTURES[side ^ 1][square]:
+        if squares[start] == pawn:
+            return start
+    knight = KNIGHT | flag
+    for start in KNIGHT_TARGETS[square]:
+        if squares[start] == knight:
+            return start
+    found, found_type = OFF_BOARD, KING
+    for direction, ray in enumerate(RAYS[square]):
+        slider = BISHOP if direction < 4 else ROOK
+        for start in ray:
+            code = squares[start]
+            if code:
+                piece_type = code & TYPE_MASK
+                if code >> 3 == side and (piece_type == slider or piece_type == QUEEN) and piece_type < found_type:
+                    found, found_type = start, piece_type
+                break
+    if found != OFF_BOARD:
+        return found
+    king = KING | flag
+    for start in KING_TARGETS[square]:
+        if squares[start] == king:
+            return start
+    return OFF_BOARD
+
+
+class ChessEngine(EngineBase):
+    backend = 'object'
 
-class ChessEngine:
     def __init__(self, arrangment=None) -> None:
-        self.board: Board = Board()
-        self.pieces_directions: dict[str, list[Pos]] = {
-                    'n': [Pos(2, 1), Pos(2, -1), Pos(-1, -2), Pos(1, -2), Pos(-2, 1), Pos(-2, -1), Pos(-1, 2), Pos(1, 2)],
-                    'k': [Pos(1, 0), Pos(-1, 0), Pos(0, 1), Pos(0, -1), Pos(1, 1), Pos(-1, 1), Pos(1, -1), Pos(-1, -1)],
-                    'q': [Pos(1, 1), Pos(-1, 1), Pos(1, -1), Pos(-1, -1), Pos(1, 0), Pos(-1, 0), Pos(0, 1), Pos(0, -1)],
-                    'b': [Pos(1, 1), Pos(-1, 1), Pos(1, -1), Pos(-1, -1)],
-                    'r': [Pos(1, 0), Pos(-1, 0), Pos(0, 1), Pos(0, -1)],
-                    'P': [Pos(-1, 0), Pos(-2, 0)],
-                    'p': [Pos(1, 0), Pos(2, 0)],
-                            }
-        self.pieces_class: list[str, ChessPiece] = {
-            'n': Knight,
-            'k': King,
-            'p': Pawn,
-            'r': Rook,
-            'q': Queen,
-            'b': Bishop,
-        }
-        self.move: int = 0
-        self.en_passant_squares: list[Pos] = []
-        self.white_king = Pos(7, 4)
-        self.black_king = Pos(0, 4)
-        self.white_pinned_squares: list[Pos] = []
-        self.black_pinned_squares: list[Pos] = []
-        self.move_log: list[MoveLog] = []
-        self.all_valid_moves = []
-        self.white_attack_squares: list[Pos] = []
-        self.black_attack_squares: list[Pos] = []
-        self.init_new_baord(arrangment) 
-
-
-    def init_new_baord(self, custom_arrangment: str) -> None:
-        arrangment: str = custom_arrangment.strip() if custom_arrangment else self.board.arrangement
-        x, y = 0, 0
-        row = []
-        for i in range(len(arrangment)):
-            if i == len(arrangment) - 1:
-                self.board.board.append(row)
-            if arrangment[i] == '/':
-                self.board.board.append(row)
-                row = []
-                x += 1
-                y = 0
-            elif arrangment[i].isdigit():
-                for _ in range(int(arrangment[i])):
-                    row.append(EmptyPiece(position=Pos(x, y)))
-                    y += 1
+        self.white_king: int = 60
+        self.black_king: int = 4
+        # per side, the attack mask of each of its pieces by square and its slider squares, and the occupied
+        # squares. make_move only adds the squares it changed to both sides' attacks_stale, the first query of a
+        # side's attacks after it brings that side's masks up to date; undo_move takes the earlier ones back from
+        # attack_history. attack_maps are each side's attacked squares, the union of its pieces' masks, for the
+        # position with hash key attack_maps_keys[side], so is_attacked is a bit test
+        self.attacks: list[dict[int, int]] = [{}, {}]
+        self.sliders: list[int] = [0, 0]
+        self.occupied: int = 0
+        self.attacks_stale: list[int] = [0, 0]
+        self.attack_history: list[tuple[list[dict[int, int]], list[int], int, list[int]]] = []
+        self.attack_maps: list[int] = [0, 0]
+        self.attack_maps_keys: list[int] = [-1, -1]
+        super().__init__(arrangment)
+
+    def place(self, position: Position) -> None:
+        squares = self.board.squares
+        squares[:] = position.squares
+        self.white_king = squares.find(KING)
+        self.black_king = squares.find(KING | BLACK_PIECE)
+        self.move = 2 * (position.fullmove_number - 1) + position.side
+        self.castling_rights = position.castling_rights
+        self.en_passant_square = position.en_passant_square
+        self.halfmove_clock = position.halfmove_clock
+        self.history.clear()
+        self.moves_stale = True
+        self.checks_key = -1
+        self.reset_attacks()
+
+    def reset_attacks(self) -> None:
+        # every square stale, the first query builds the side's masks from the board
+        self.attacks, self.sliders, self.occupied, self.attacks_stale = [{}, {}], [0, 0], 0, [FULL, FULL]
+        self.attack_history.clear()
+        self.attack_maps_keys = [-1, -1]
+
+    def update_attacks(self, side: int) -> None:
+        # the pieces of side now on its stale squares get new masks, and so do its sliders whose attacks reached
+        # one of them, as only their rays can have been cut or extended; holds for the squares of several moves
+        squares = self.board.squares
+        changed = self.attacks_stale[side]
+        side_attacks = self.attacks[side].copy()
+        sliders = self.sliders[side] & ~changed
+        occupied = self.occupied
+        placed = []
+        bits = changed
+        while bits:
+            bit = bits & -bits
+            bits ^= bit
+            square = bit.bit_length() - 1
+            code = squares[square]
+            if code:
+                occupied |= bit
+                if code >> 3 == side:
+                    placed.append(square)
+                    if BISHOP <= code & TYPE_MASK <= QUEEN:
+                        sliders |= bit
+                    continue
             else:
-                name = arrangment[i]
-                color = Color.WHITE if arrangment[i].isupper() else Color.BLACK
-                position = Pos(x, y)
-                if name in 'pP':
-                    directions = self.pieces_directions[name]
+                occupied &= ~bit
+            side_attacks.pop(square, None)
+        bits = sliders & ~changed
+        while bits:
+            bit = bits & -bits
+            bits ^= bit
+            square = bit.bit_length() - 1
+            if side_attacks[square] & changed:
+                side_attacks[square] = piece_attacks(squares[square], square, occupied)
+        for square in placed:
+            side_attacks[square] = piece_attacks(squares[square], square, occupied)
+        # fresh containers, attack_history keeps the old ones
+        if side:
+            self.attacks = [self.attacks[0], side_attacks]
+            self.sliders = [self.sliders[0], sliders]
+            self.attacks_stale = [self.attacks_stale[0], 0]
+        else:
+            self.attacks = [side_attacks, self.attacks[1]]
+            self.sliders = [sliders, self.sliders[1]]
+            self.attacks_stale = [0, self.attacks_stale[1]]
+        self.occupied = occupied
+
+    def attack_map(self, side: int) -> int:
+        # the squares attacked by side (0 white, 1 black), put together from its piece masks once per position
+        if self.attacks_stale[side]:
+            self.update_attacks(side)
+        if self.attack_maps_keys[side] != self.hash_key:
+            self.attack_maps[side] = reduce(or_, self.attacks[side].values(), 0)
+            self.attack_maps_keys[side] = self.hash_key
+        return self.attack_maps[side]
+
+    def generate_moves(self, kind: int = ALL_MOVES, square: int = OFF_BOARD, limit: int = MAX_MOVES) -> array:
+        # king moves come first
+        if not self.moves_stale and not kind & CHECKS_ONLY:
+            if kind == ALL_MOVES and square == OFF_BOARD:
+                return self.all_valid_moves
+            return array('H', [move for move in self.all_valid_moves
+                               if MOVE_KINDS[move >> 12] & kind and (square == OFF_BOARD or move & 63 == square)])
+        if self.checks_key != self.hash_key:
+            self.check_for_check()
+        squares = self.board.squares
+        side = self.move % 2
+        enemy = side ^ 1
+        king = self.black_king if side else self.white_king
+        moves = self.move_buffer
+        count = 0
+        if kind & CHECKS_ONLY:
+            check_masks, discoverers, enemy_king = self.check_squares()
+
+        if square == OFF_BOARD or square == king:
+            mask = FULL
+            if kind & CHECKS_ONLY:
+                # a king only checks by uncovering one
+                mask = ~LINE[enemy_king][king] if discoverers >> king & 1 else 0
+            attacked = None
+            for end in KING_TARGETS[king]:
+                target = squares[end]
+                if target and target >> 3 == side or not kind & (TACTICAL_MOVES if target else QUIET_MOVES) \
+                        or not mask >> end & 1:
+                    continue
+                if attacked is None:
+                    attacked = self.king_danger(king, enemy)
+                if not attacked >> end & 1:
+                    moves[count] = king | end << 6 | (CAPTURE << 12 if target else 0)
+                    count += 1
+            if not self.checkers and kind & QUIET_MOVES and not kind & CHECKS_ONLY:
+                count = self.castling_moves(king, side, count)
+
+        evasion_mask = self.evasion_mask
+        if evasion_mask and count < limit and square != king:
+            pin_rays = self.pin_rays
+            en_passant_square = self.en_passant_square
+            starts = range(64) if square == OFF_BOARD else (square,)
+            for square in starts:
+                code = squares[square]
+                if not code or code >> 3 != side or code & TYPE_MASK == KING:
+                    continue
+                mask = evasion_mask & pin_rays[square] if square in pin_rays else evasion_mask
+                if kind & CHECKS_ONLY:
+                    piece_type = code & TYPE_MASK
+                    if discoverers >> square & 1:
+                        mask &= check_masks[piece_type] | ~LINE[enemy_king][square]
+                    elif check_masks[piece_type] & REACH_MASKS[piece_type][square]:
+                        mask &= check_masks[piece_type]
+                    else:
+                        continue
+                first = count
+                if code & TYPE_MASK == PAWN:
+                    count = Pawn.generate_sudo_valid_moves(squares, square, moves, count, en_passant_square, kind)
                 else:
-                    directions = self.pieces_directions[name.lower()]
-                row.append(self.pieces_class[arrangment[i].lower()](
-                                                    name=name, 
-                                                    color=color,
-                                                    position=position,
-                                                    directions=directions
-                                                    ))
-                if name == 'k':
-                    self.black_king = position
-                elif name == 'K':
-                    self.white_king = position
-                y += 1
-
-    def move_is_catling(self, move: Move) -> bool:
-        piece_moved = self.board.get_piece_on_square(move.start)
-        if piece_moved.name not in 'kK':
-            return False
-        start_sq = Pos(7, 4) if piece_moved.color is Color.WHITE else Pos(0, 4)
-        end_sq = [Pos(7 ,6), Pos(7, 2)] if piece_moved.color is Color.WHITE else [Pos(0 ,6), Pos(0, 2)]
-        return move.start == start_sq and move.end in end_sq
+                    count = PIECE_CLASSES[code].generate_sudo_valid_moves(squares, square, moves, count, kind)
+                if mask != FULL or en_passant_square != OFF_BOARD and code & TYPE_MASK == PAWN:
+                    kept = first
+                    for index in range(first, count):
+                        move = moves[index]
+                        if move >> 12 == EN_PASSANT:
+                            legal = self.en_passant_is_legal(move, king)
+                        else:
+                            legal = mask >> (move >> 6 & 63) & 1
+                        if legal:
+                            moves[kept] = move
+                            kept += 1
+                    count = kept
+                if count >= limit:
+                    break
+        return moves[:count]
+
+    def check_squares(self) -> tuple[list[int], int, int]:
+        # for the side to move: the squares each piece type would check the enemy king from, per type, the pieces
+        # whose leaving their line with the king uncovers a check by a slider behind them, and the king's square
+        squares = self.board.squares
+        side = self.move % 2
+        enemy_king = self.white_king if side else self.black_king
+        diagonal = straight = discoverers = 0
+        for direction, ray in enumerate(RAYS[enemy_king]):
+            slider = BISHOP | side << 3 if direction < 4 else ROOK | side << 3
+            blocker = OFF_BOARD
+            for end in ray:
+                code = squares[end]
+                if not code:
+                    if blocker == OFF_BOARD:
+                        if direction < 4:
+                            diagonal |= 1 << end
+                        else:
+                            straight |= 1 << end
+                    continue
+                if code >> 3 != side:
+                    break
+                if blocker != OFF_BOARD:
+                    if code == slider or code == QUEEN | side << 3:
+                        discoverers |= 1 << blocker
+                    break
+                blocker = end
+        check_masks = [0, PAWN_CAPTURE_MASKS[side ^ 1][enemy_king], KNIGHT_MASKS[enemy_king], diagonal, straight,
+                       diagonal | straight, 0]
+        return check_masks, discoverers, enemy_king
+
+    def see(self, move: int) -> int:
+        # static exchange evaluation: the material the side to move comes out with when both sides keep recapturing
+        # on the move's end square with their least valuable piece, each free to stop; worked out on a scratch copy
+        # of the board, so pieces that have captured uncover the ones behind them
+        start, end, flags = move & 63, move >> 6 & 63, move >> 12
+        squares = self.board.squares
+        code = squares[start]
+        side = code >> 3
+        gains = [EXCHANGE_VALUES[squares[end]]]
+        if flags != EN_PASSANT and not self.is_attacked(end, side ^ 1) and not self.x_rayed(start, end, side ^ 1):
+            # nothing can recapture, not even a slider the move uncovers
+            if flags & PROMOTION:
+                return gains[0] + EXCHANGE_VALUES[PROMOTION_PIECES[flags]] - EXCHANGE_VALUES[PAWN]
+            return gains[0]
+        board = bytearray(squares)
+        if flags == EN_PASSANT:
+            board[end + (8 if side == 0 else -8)] = EMPTY
+            gains[0] = EXCHANGE_VALUES[PAWN]
+        elif flags & PROMOTION:
+            code = PROMOTION_PIECES[flags] | side << 3
+            gains[0] += EXCHANGE_VALUES[code] - EXCHANGE_VALUES[PAWN]
+        board[start] = EMPTY
+        board[end] = code
+        while (attacker := least_valuable_attacker(board, end, side ^ 1)) != OFF_BOARD:
+            # what the recapture wins less what the other side was up before it; when neither side
+            # can gain by going on, the recapture is left out and the exchange ends here
+            gain = EXCHANGE_VALUES[board[end]] - gains[-1]
+            if max(-gains[-1], gain) < 0:
+                break
+            gains.append(gain)
+            board[end] = board[attacker]
+            board[attacker] = EMPTY
+            side ^= 1
+        while len(gains) > 1:
+            gain = gains.pop()
+            gains[-1] = -max(-gains[-1], gain)
+        return gains[0]
 
-    def move_is_en_passant(self, move: Move) -> bool:
-        piece_moved = self.board.get_piece_on_square(move.start)
-        if piece_moved.name not in 'pP':
+    def x_rayed(self, start: int, end: int, side: int) -> bool:
+        # is there a slider of side aiming at end through the piece on start
+        if not self.attack_map(side) >> start & 1:
             return False
-        offset = -1 if piece_moved.color is Color.WHITE else 1
-        piece_eaten: Pawn = self.board.get_piece_on_square(Pos(move.end.x - offset, move.end.y))
-        log.debug(f'piece eaten: {piece_eaten.name}')
-        if isinstance(piece_eaten, Pawn) and piece_eaten.ep and piece_eaten.color is piece_moved.enemy_color:
-            return True
+        attacks = self.attacks[side]
+        sliders = self.sliders[side]
+        while sliders:
+            bit = sliders & -sliders
+            sliders ^= bit
+            square = bit.bit_length() - 1
+            if attacks[square] >> start & 1 and BETWEEN[square][end] >> start & 1:
+                return True
         return False
 
-    def move_is_promotion(self, move: Move) -> bool:
-        piece = self.board.get_piece_on_square(move.start)
-        promotion_square = 0 if piece.color is Color.WHITE else 7
-        if isinstance(piece, Pawn) and move.end.x == promotion_square:
-            return True
-        return False
+    def king_danger(self, king: int, enemy: int) -> int:
+        # squares the king cannot step to: the ones enemy attacks and the ones behind it on a checking slider's line
+        attacked = self.attack_map(enemy)
+        checkers = self.checkers
+        while checkers:
+            bit = checkers & -checkers
+            checkers ^= bit
+            checker = bit.bit_length() - 1
+            if BISHOP <= self.board.squares[checker] & TYPE_MASK <= QUEEN:
+                attacked |= LINE[king][checker] & ~bit
+        return attacked
 
-    def validate_and_make_move(self, move: Move) -> None:
-        color_to_move = Color.WHITE if self.move % 2 == 0 else Color.BLACK
-        piece_moved = self.board.get_piece_on_square(move.start)
-        if piece_moved.color != color_to_move:
-            pass
-        if move not in self.all_valid_moves:
-            return
-        self.make_move(move)
-
-    def generate_all_sudo_moves(self) -> list[Move]:
-        self.all_valid_moves.clear()
-        self.white_attack_squares.clear()
-        self.black_attack_squares.clear()
-        for x in self.board.board:
-            for piece in x:
-                if piece.color is not Color.EMPTY:
-                    if isinstance(piece, Pawn) and self.move - piece.ep_move > 0\
-                                               and piece.ep:
-                        piece.ep = False
-                    pinned_squares = self.white_pinned_squares if piece.color is Color.WHITE else self.black_pinned_squares
-                    if isinstance(piece, King):
-                        continue
-                    ally_king = self.white_king if piece.color is Color.WHITE else self.black_king
-                    ally_king_in_check = True if ally_king in self.board.checked_squares else False
-                    self.all_valid_moves.extend(piece.generate_sudo_valid_moves(self.board, pinned_squares, ally_king_in_check))
-                    if piece.color is Color.WHITE: self.white_attack_squares.extend([i.end for i in piece.valid_moves])
-                    elif piece.color is Color.BLACK: self.black_attack_squares.extend([i.end for i in piece.valid_moves])
-        kings: list[King] = [self.white_king, self.black_king]
-        for king_pos in kings:
-            king = self.board.get_piece_on_square(king_pos)
-            if not isinstance(king, King):
-                continue
-            pinned_squares = self.white_pinned_squares if king.color is Color.WHITE else self.black_pinned_squares
-            enemy_attack_squares = self.black_attack_squares if king.color is Color.WHITE else self.black_attack_squares
-            king.generate_sudo_valid_moves(self.board, pinned_squares, enemy_attack_squares)
-            self.all_valid_moves.extend(king.valid_moves)
-        return self.all_valid_moves
-
-    def generate_all_valid_moves(self) -> list[Move]:
-        self.check_for_check()
-        self.all_valid_moves: list[Move] = self.generate_all_sudo_moves()
-        return self.all_valid_moves
-
-    def check_for_check(self) -> list[Pos]:
-        self.white_pinned_squares.clear()
-        self.black_pinned_squares.clear()
-        self.board.checked_squares.clear()
-        white_king: King = self.board.get_piece_on_square(self.white_king)
-        black_king: King = self.board.get_piece_on_square(self.black_king)
-        white_king.checked = False
-        black_king.checked = False
-        kings: list[King] = [white_king, black_king]
-        linear_directions = [Pos(1, 1), Pos(-1, 1), Pos(1, -1), Pos(-1, -1), Pos(1, 0), Pos(-1, 0), Pos(0, 1), Pos(0, -1)]
-        knigth_directions = [Pos(2, 1), Pos(2, -1), Pos(-1, -2), Pos(1, -2), Pos(-2, 1), Pos(-2, -1), Pos(-1, 2), Pos(1, 2)]
-        for king in kings:
-            for d in linear_directions:
-                pinns: list[Pos] = []
-                ally = False
-                for n in range(1, 8):
-                    end: Pos = king.adder(king.position, Pos(d.x * n, d.y * n))
-                    if not (end.x in range(8) and end.y in range(8)):
+    def castling_moves(self, king: int, side: int, count: int) -> int:
+        # only called when not in check; the king may not pass through or land on an attacked square
+        if king != (4 if side else 60):
+            return count
+        squares = self.board.squares
+        moves = self.move_buffer
+        short, long = (BLACK_SHORT, BLACK_LONG) if side else (WHITE_SHORT, WHITE_LONG)
+        rook = ROOK | side << 3
+        enemy = side ^ 1
+        if (self.castling_rights & short and squares[king + 3] == rook and not squares[king + 1]
+                and not squares[king + 2] and not self.is_attacked(king + 1, enemy)
+                and not self.is_attacked(king + 2, enemy)):
+            moves[count] = king | king + 2 << 6 | KING_CASTLE << 12
+            count += 1
+        if (self.castling_rights & long and squares[king - 4] == rook and not squares[king - 1]
+                and not squares[king - 2] and not squares[king - 3] and not self.is_attacked(king - 1, enemy)
+                and not self.is_attacked(king - 2, enemy)):
+            moves[count] = king | king - 2 << 6 | QUEEN_CASTLE << 12
+            count += 1
+        return count
+
+    def en_passant_is_legal(self, move: int, king: int) -> bool:
+        # both pawns leave the same row, which can uncover a slider; play it on the board and look
+        squares = self.board.squares
+        start, end = move & 63, move >> 6 & 63
+        eaten_square = end + (8 if start >> 3 == 3 else -8)
+        pawn, eaten = squares[start], squares[eaten_square]
+        squares[start] = squares[eaten_square] = EMPTY
+        squares[end] = pawn
+        legal = not square_attacked(squares, king, pawn >> 3 ^ 1)
+        squares[end] = EMPTY
+        squares[start], squares[eaten_square] = pawn, eaten
+        return legal
+
+    def is_attacked(self, square: int, side: int) -> bool:
+        # is square attacked by the pieces of side (0 white, 1 black)
+        return bool(self.attack_map(side) >> square & 1)
+
+    def in_check(self) -> bool:
+        side = self.move % 2
+        return self.is_attacked(self.black_king if side else self.white_king, side ^ 1)
+
+    def check_for_check(self) -> None:
+        # checkers, evasion mask and pin rays against the king of the side to move, one scan out from the king
+        squares = self.board.squares
+        side = self.move % 2
+        king = self.black_king if side else self.white_king
+        enemy = (side ^ 1) << 3
+        checkers = 0
+        evasion_mask = 0
+        pin_rays: dict[int, int] = {}
+        self.checks_key = self.hash_key
+        if squares[king] & TYPE_MASK == KING:
+            attacked = self.is_attacked(king, side ^ 1)
+            sliders = self.sliders[side ^ 1]
+            for direction, ray in enumerate(RAYS[king]):
+                # only a line holding an enemy slider can carry a check or a pin
+                if not RAY_MASKS[direction][king] & sliders:
+                    continue
+                slider = BISHOP | enemy if direction < 4 else ROOK | enemy
+                blocker = OFF_BOARD
+                for end in ray:
+                    code = squares[end]
+                    if not code:
                         continue
-                    target = self.board.get_piece_on_square(end)
-                    if isinstance(target, EmptyPiece):
-                        pinns.append(end)
-                    elif d in linear_directions[:4] and target.color is king.enemy_color:
-                        if not target.name in 'bBqQ':
-                            break
-                        if not ally: king.checked = True
-                        pinns.append(end)
-                        if king.color is Color.WHITE: self.white_pinned_squares.extend(pinns)
-                        elif king.color is Color.BLACK: self.black_pinned_squares.extend(pinns)
-                        break
-                    elif d in linear_directions[3:] and target.color is king.enemy_color:
-                        if not target.name in 'rRqQ':
+                    if code & BLACK_PIECE != enemy:
+                        if blocker != OFF_BOARD:
                             break
-                        if not ally: king.checked = True
-                        pinns.append(end)
-                        if king.color is Color.WHITE: self.white_pinned_squares.extend(pinns)
-                        elif king.color is Color.BLACK: self.black_pinned_squares.extend(pinns)
-                        break
-                    elif target.color is king.ally_color:
-                        ally = True
-                        pinns.clear()
-                        pinns.append(end)
-            for d in knigth_directions:
-                    end: Pos = king.adder(king.position, d)
-                    if not (end.x in range(8) and end.y in range(8)):
+                        blocker = end
                         continue
-                    target = self.board.get_piece_on_square(end)
-                    if isinstance(target, Knight) and target.color is king.enemy_color:
-                        if king.color is Color.WHITE: self.white_pinned_squares.append(end)
-                        elif king.color is Color.BLACK: self.black_pinned_squares.append(end)
-                        king.checked = True
-            if king.checked: self.board.checked_squares.add(king.position)
-
-    def make_move(self, move: Move) -> None:
+                    if code == slider or code == QUEEN | enemy:
+                        if blocker == OFF_BOARD:
+                            checkers |= 1 << end
+                            evasion_mask |= BETWEEN[king][end] | 1 << end
+                        else:
+                            pin_rays[blocker] = BETWEEN[king][end] | 1 << end
+                    break
+            if attacked:
+                for end in KNIGHT_TARGETS[king]:
+                    if squares[end] == KNIGHT | enemy:
+                        checkers |= 1 << end
+                        evasion_mask |= 1 << end
+                for end in PAWN_CAPTURES[side][king]:
+                    if squares[end] == PAWN | enemy:
+                        checkers |= 1 << end
+                        evasion_mask |= 1 << end
+        if not checkers:
+            evasion_mask = FULL
+        elif checkers & (checkers - 1):
+            evasion_mask = 0
+        self.checkers = checkers
+        self.evasion_mask = evasion_mask
+        self.pin_rays = pin_rays
+
+    def make_move(self, move: int) -> None:
+        # a cheap reversible state change, move lists are only rebuilt when someone asks for them
         self.move += 1
-        castling, en_passant, promotion = False, False, False
-        piece_moved = self.board.get_piece_on_square(move.start)
-        piece_eaten = self.board.get_piece_on_square(move.end)
-        empty_piece = EmptyPiece(position=move.start)
-
-        if self.move_is_catling(move): castling = True
-        elif self.move_is_en_passant(move): en_passant = True
-        elif self.move_is_promotion(move): promotion = True
-
-        if isinstance(piece_moved, King):
-            if piece_moved.color is Color.WHITE: self.white_king = move.end
-            elif piece_moved.color is Color.BLACK: self.black_king = move.end
-
-        if isinstance(piece_moved, Pawn) and piece_moved.position.x == piece_moved.start_square\
-                                         and piece_eaten.position.x == piece_moved.ep_square\
-                                         and not piece_moved.ep:
-            piece_moved.ep = True
-            piece_moved.ep_move = self.move
-
-        if castling:
+        start, end, flags = move & 63, move >> 6 & 63, move >> 12
+        squares = self.board.squares
+        piece_moved = squares[start]
+        piece_eaten = squares[end]
+        self.history.push(move, piece_eaten, self.castling_rights, self.en_passant_square, self.halfmove_clock,
+                          self.hash_key)
+        self.halfmove_clock = 0 if piece_eaten or piece_moved & TYPE_MASK == PAWN else self.halfmove_clock + 1
+
+        if piece_moved & TYPE_MASK == KING:
+            if piece_moved & BLACK_PIECE: self.black_king = end
+            else: self.white_king = end
+
+        if flags == KING_CASTLE or flags == QUEEN_CASTLE:
             self.castle(move)
-        elif en_passant:
-            log.debug(f'move is en passant')
+        elif flags == EN_PASSANT:
             self.en_passant(move)
-        elif promotion:
-            name = 'Q' if piece_moved.color is Color.WHITE else 'q'
-            queen = Queen(
-                name=name,
-                color=piece_moved.color,
-                position=move.start,
-                directions=self.pieces_directions['q']
-                )
-            piece_moved = queen
-
-        self.board.move(move, piece_moved, empty_piece)
-        piece_moved.position = move.end
-
-        self.move_log.append(MoveLog(move, piece_moved, piece_eaten, en_passnst=en_passant, castling=castling))
-        self.generate_all_valid_moves()
-        log.debug(f'{self.move_log[-2:]}')
-
-    def castle(self, move: Move):
-        short = False
-        if move.end.y == 6:
-            short = True
-        y = 7 if short else 0
-        king: King = self.board.get_piece_on_square(move.start)
-        rook: Rook = self.board.get_piece_on_square(Pos(move.start.x, y))
-        rook_end_pos = Pos(king.position.x, king.position.y - 1) if short else Pos(king.position.x, king.position.y + 1)
-        empty_piece_king = EmptyPiece(position=move.start)
-        empty_piece_rook = EmptyPiece(position=rook.position)
-        self.board.move(move, king, empty_piece_king)
-        self.board.move(Move(rook.position, rook_end_pos), rook, empty_piece_rook)
-        self.move_log.append(MoveLog(Move(rook.position, rook_end_pos), rook, empty_piece_rook, False, False))
-        king.castling = False
-        rook.castling = False
-        king.position = move.end
-        rook.position = rook_end_pos
-
-    def en_passant(self, move: Move):
-        piece_moved: Pawn = self.board.get_piece_on_square(move.start)
-        offset = -1 if piece_moved.color is Color.WHITE else 1
-        piece_eaten: Pawn = self.board.get_piece_on_square(Pos(move.end.x - offset, move.end.y))
-        log.debug(f'PIECE EATEN {piece_eaten.name}, {piece_eaten.ep}, {piece_eaten.position}')
-        empty_piece = EmptyPiece(position=piece_eaten.position)
-        log.debug(f'EMPTY EATEN {empty_piece.name}, {piece_eaten.ep}, {piece_eaten.position}')
-        self.move_log.append(MoveLog(Move(piece_eaten.position, piece_eaten.position), piece_eaten, empty_piece, False, False))
-        self.board.move(Move(piece_eaten.position, piece_eaten.position), piece_eaten, empty_piece)
-
-    def promote(self, move: Move) -> None:
-        piece = self.board.get_piece_on_square(move.start)
-        log.debug(f'------> PROMOTING {piece.color} PAWN')
-        name = 'Q' if piece.color is Color.WHITE else 'q'
-        queen = Queen(
-            name=name,
-            color=piece.color,
-            position=move.start,
-            directions=self.pieces_directions['q']
-            )
-        self.board.board[move.end.x][move.end.y] = queen
-        self.board.move(Move(move.end, move.end), queen, piece)
+
+        key = self.hash_key ^ EN_PASSANT_KEYS[self.en_passant_square] ^ CASTLING_KEYS[self.castling_rights]
+        self.en_passant_square = (start + end) // 2 if flags == DOUBLE_PUSH else OFF_BOARD
+        self.castling_rights &= CASTLING_MASK[start] & CASTLING_MASK[end]
+
+        piece_placed = PROMOTION_PIECES[flags] | piece_moved & BLACK_PIECE if flags & PROMOTION else piece_moved
+        self.board.move(start, end, piece_placed)
+        key ^= PIECE_KEYS[piece_moved][start] ^ PIECE_KEYS[piece_eaten][end] ^ PIECE_KEYS[piece_placed][end]
+        self.mg_score += MG_SCORES[piece_placed][end] - MG_SCORES[piece_moved][start] - MG_SCORES[piece_eaten][end]
+        self.eg_score += EG_SCORES[piece_placed][end] - EG_SCORES[piece_moved][start] - EG_SCORES[piece_eaten][end]
+        self.phase += PHASE_WEIGHTS[piece_placed] - PHASE_WEIGHTS[piece_moved] - PHASE_WEIGHTS[piece_eaten]
+        self.hash_key = key ^ SIDE_KEY ^ EN_PASSANT_KEYS[self.en_passant_square] ^ CASTLING_KEYS[self.castling_rights]
+        self.moves_stale = True
+        changed = 1 << start | 1 << end
+        if flags == KING_CASTLE:
+            changed |= 1 << (start + 3) | 1 << (start + 1)
+        elif flags == QUEEN_CASTLE:
+            changed |= 1 << (start - 4) | 1 << (start - 1)
+        elif flags == EN_PASSANT:
+            changed |= 1 << (end + (8 if start >> 3 == 3 else -8))
+        stale = self.attacks_stale
+        self.attack_history.append((self.attacks, self.sliders, self.occupied, stale))
+        self.attacks_stale = [stale[0] | changed, stale[1] | changed]
+
+    def castle(self, move: int):
+        start, end = move & 63, move >> 6 & 63
+        rook_start, rook_end = (start + 3, start + 1) if end > start else (start - 4, start - 1)
+        rook = self.board.squares[rook_start]
+        self.board.move(rook_start, rook_end, rook)
+        self.hash_key ^= PIECE_KEYS[rook][rook_start] ^ PIECE_KEYS[rook][rook_end]
+        self.mg_score += MG_SCORES[rook][rook_end] - MG_SCORES[rook][rook_start]
+        self.eg_score += EG_SCORES[rook][rook_end] - EG_SCORES[rook][rook_start]
+
+    def en_passant(self, move: int):
+        start, end = move & 63, move >> 6 & 63
+        eaten_square = end + (8 if start >> 3 == 3 else -8)
+        eaten = self.board.squares[eaten_square]
+        self.hash_key ^= PIECE_KEYS[eaten][eaten_square]
+        self.mg_score -= MG_SCORES[eaten][eaten_square]
+        self.eg_score -= EG_SCORES[eaten][eaten_square]
+        self.board.squares[eaten_square] = EMPTY
 
     def undo_move(self):
-        if not self.move_log:
-            log.debug(f'No Moves')
+        if not self.history:
+            log.debug('no moves to undo')
             return
         self.move -= 1
-        last_move: MoveLog = self.move_log.pop()
-        move = last_move.move
-        piece_moved = last_move.piece_moved
-        piece_eaten = last_move.piece_eaten
-        piece_moved.position = move.start
-        piece_eaten.position = move.end
-        if last_move.en_passnst or last_move.castling:
-            self.board.move(move, piece_eaten, piece_moved)
-            last_move = self.move_log.pop()
-            move = last_move.move
-            piece_moved = last_move.piece_moved
-            piece_eaten = last_move.piece_eaten
-            piece_moved.position = move.start
-            piece_eaten.position = move.end
-            self.board.move(move, piece_eaten, piece_moved)
-            return
-        log.debug(f'{piece_moved.name}: {piece_moved.position}')
-        self.board.move(move, piece_eaten, piece_moved)
-        self.generate_all_valid_moves()
-
-
-
-if __name__ == '__main__':
-    custom_arrangement = 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R'
-    engine = ChessEngine(custom_arrangement)
-    engine.board.print_board()
-    start = time.time()
-    def test():
-        g = 0
-        cnt = 0
-        global start
-        print(start)
-        while g <= 10:
-            engine.generate_all_valid_moves()
-            cnt += 1
-            if time.time() - start >= 1:
-                g += 1
-                print(cnt)
-                cnt = 0
-                start = time.time()
-    test()
+        history = self.history
+        index = history.pop()
+        move = history.moves[index]
+        start, end, flags = move & 63, move >> 6 & 63, move >> 12
+        squares = self.board.squares
+        piece_placed = squares[end]
+        piece_moved = PAWN | piece_placed & BLACK_PIECE if flags & PROMOTION else piece_placed
+        piece_eaten = history.captured[index]
+        squares[end] = piece_eaten
+        squares[start] = piece_moved
+        self.mg_score -= MG_SCORES[piece_placed][end] - MG_SCORES[piece_moved][start] - MG_SCORES[piece_eaten][end]
+        self.eg_score -= EG_SCORES[piece_placed][end] - EG_SCORES[piece_moved][start] - EG_SCORES[piece_eaten][end]
+        self.phase -= PHASE_WEIGHTS[piece_placed] - PHASE_WEIGHTS[piece_moved] - PHASE_WEIGHTS[piece_eaten]
+        if flags == KING_CASTLE or flags == QUEEN_CASTLE:
+            rook_start, rook_end = (start + 3, start + 1) if end > start else (start - 4, start - 1)
+            rook = squares[rook_end]
+            self.board.move(rook_end, rook_start, rook)
+            self.mg_score += MG_SCORES[rook][rook_start] - MG_SCORES[rook][rook_end]
+            self.eg_score += EG_SCORES[rook][rook_start] - EG_SCORES[rook][rook_end]
+        elif flags == EN_PASSANT:
+            eaten_square = end + (8 if start >> 3 == 3 else -8)
+            eaten = PAWN | piece_moved & BLACK_PIECE ^ BLACK_PIECE
+            squares[eaten_square] = eaten
+            self.mg_score += MG_SCORES[eaten][eaten_square]
+            self.eg_score += EG_SCORES[eaten][eaten_square]
+        if piece_moved & TYPE_MASK == KING:
+            if piece_moved & BLACK_PIECE: self.black_king = start
+            else: self.white_king = start
+        self.castling_rights = history.castling_rights[index]
+        self.en_passant_square = history.en_passant_squares[index]
+        self.halfmove_clock = history.halfmove_clocks[index]
+        self.hash_key = history.hash_keys[index]
+        self.moves_stale = True
+        self.attacks, self.sliders, self.occupied, self.attacks_stale = self.attack_history.pop()
+
+
+BACKENDS: dict[str, type[EngineBase]] = {ChessEngine.backend: ChessEngine, BitboardEngine.backend: BitboardEngine}
+
+
+def new_engine(arrangment=None, backend: str = 'object') -> EngineBase:
+    # an engine of the named backend; both have the same move generation, make/undo and search API
+    if backend not in BACKENDS:
+        raise ValueError(f'unknown backend {backend!r}')
+    return BACKENDS[backend](arrangment)
@@ -0,0 +1,259 @@
+import logging
+from abc import ABC, abstractmethod
+
+from utils import *
+from transposition import hash_position
+from evaluation import MOBILITY_WEIGHT, TABLEBASE_WIN, evaluate_squares, pawn_structure, taper
+from fen import EngineSnapshot, Position, check_position, format_fen, parse_fen
+from search import Searcher, SearchResult
+
+
+log = logging.getLogger('engine')
+
+
+"""
+EngineBase holds the position state and the API both backends share. ChessEngine (chess_engine.py) and
+BitboardEngine (bitboard.py) subclass it and supply place, generate_moves, attack_map, is_attacked, in_check,
+see and make_move/undo_move, abstract here so a backend missing one fails when it is constructed, not mid-search.
+new_engine in chess_engine.py builds one by backend name.
+"""
+
+
+class EngineBase(ABC):
+    backend: str = ''
+
+    def __init__(self, arrangment=None) -> None:
+        self.board: Board = Board()
+        self.move: int = 0
+        self.castling_rights: int = 0
+        self.en_passant_square: int = OFF_BOARD
+        # plies since the last capture or pawn move; the fullmove number is self.move // 2 + 1
+        self.halfmove_clock: int = 0
+        self.hash_key: int = 0
+        # white's middlegame and endgame material + piece-square sums and the game phase, kept by make/undo
+        self.mg_score: int = 0
+        self.eg_score: int = 0
+        self.phase: int = 0
+        # evaluate() compares the incremental sums with a full recompute when set
+        self.debug_evaluation: bool = False
+        # computed once per position by check_for_check for the side to move: the enemy pieces giving check,
+        # the squares a non-king move must land on (FULL when not in check, 0 in double check)
+        # and the ray each pinned piece may still move along, keyed by its square
+        self.checkers: int = 0
+        self.evasion_mask: int = FULL
+        self.pin_rays: dict[int, int] = {}
+        # hash key of the position they were computed for, so they survive the undo back to it
+        self.checks_key: int = -1
+        self.history: UndoStack = UndoStack()
+        # generation writes into move_buffer, all_valid_moves is a compact copy of the filled part
+        self.move_buffer: array = array('H', bytes(2 * MAX_MOVES))
+        self.all_valid_moves: array = array('H')
+        self.moves_stale: bool = True
+        self.searcher: Searcher | None = None
+        self.parallel = None
+        # an OpeningBook consulted by search() before searching, book_mode is 'weighted' or 'best'
+        self.book = None
+        self.book_mode: str = 'weighted'
+        # Tablebases probed by search and evaluate() once few enough pieces are left
+        self.tablebases = None
+        self.init_new_baord(arrangment)
+
+    def init_new_baord(self, custom_arrangment: str) -> None:
+        # a full FEN sets everything, a bare placement keeps the side to move and
+        # infers castling rights from kings and rooks on their home squares
+        arrangment: str = custom_arrangment.strip() if custom_arrangment else self.board.arrangement
+        if ' ' in arrangment:
+            self.set_position(parse_fen(arrangment))
+            return
+        self.board.load_arrangement(arrangment)
+        position = Position(bytes(self.board.squares), self.move % 2, self.board.castling_rights(), OFF_BOARD,
+                            0, self.move // 2 + 1)
+        check_position(position)
+        self.set_position(position)
+
+    def set_position(self, position: Position) -> None:
+        self.place(position)
+        self.hash_key = self.compute_hash()
+        self.mg_score, self.eg_score, self.phase = evaluate_squares(self.board.squares)
+
+    @abstractmethod
+    def place(self, position: Position) -> None:
+        # the position's own fields, set_position and restore add the derived ones
+        ...
+
+    def compute_hash(self) -> int:
+        # full recompute, make_move keeps self.hash_key up to date incrementally
+        return hash_position(self.board.squares, self.move % 2 == 1, self.castling_rights, self.en_passant_square)
+
+    def game_keys(self) -> list[int]:
+        # hash keys of the earlier positions of the game that can still come back, the ones since the last
+        # capture or pawn move, as far as the undo history goes
+        size = len(self.history)
+        return self.history.hash_keys[max(size - self.halfmove_clock, 0):size].tolist()
+
+    def position(self) -> Position:
+        return Position(bytes(self.board.squares), self.move % 2, self.castling_rights, self.en_passant_square,
+                        self.halfmove_clock, self.move // 2 + 1)
+
+    def snapshot(self) -> EngineSnapshot:
+        return EngineSnapshot(self.position(), self.hash_key, self.mg_score, self.eg_score, self.phase)
+
+    def restore(self, snapshot: EngineSnapshot) -> None:
+        # set_position with the hash key and evaluation sums taken from the snapshot; the undo history is cleared
+        self.place(snapshot.position)
+        _, self.hash_key, self.mg_score, self.eg_score, self.phase = snapshot
+
+    def clone(self):
+        # a fresh engine of the same backend on this position, for side lines that leave this one alone;
+        # it shares the opening book and tablebases but not the undo history or the search state
+        engine = type(self)()
+        engine.restore(self.snapshot())
+        engine.book, engine.book_mode, engine.tablebases = self.book, self.book_mode, self.tablebases
+        return engine
+
+    def load_fen(self, fen: str) -> None:
+        self.set_position(parse_fen(fen))
+
+    def to_fen(self) -> str:
+        return format_fen(self.position())
+
+    def evaluate(self) -> int:
+        # centipawns for the side to move: tapered material and piece-square sums, pawn structure and mobility,
+        # the squares the side to move attacks less those its opponent attacks, so no move list is generated
+        if self.debug_evaluation:
+            self.check_evaluation()
+        if self.tablebases is not None and (probe := self.probe_tablebase()) is not None:
+            return probe.wdl * (TABLEBASE_WIN - probe.dtm)
+        score = taper(self.mg_score, self.eg_score, self.phase) + pawn_structure(self.board.squares)
+        if self.move % 2:
+            score = -score
+        side = self.move & 1
+        return score + MOBILITY_WEIGHT * (self.attack_map(side).bit_count() - self.attack_map(side ^ 1).bit_count())
+
+    def check_evaluation(self) -> None:
+        incremental = self.mg_score, self.eg_score, self.phase
+        full = evaluate_squares(self.board.squares)
+        if incremental != full:
+            raise AssertionError(f'incremental evaluation {incremental} != full recompute {full} '
+                                 f'after {" ".join(map(move_name, self.history.moves[:len(self.history)]))}')
+
+    def search(self, depth: int | None = None, movetime: float | None = None, nodes: int | None = None,
+               workers: int = 1) -> SearchResult:
+        # the searcher keeps its transposition table and history between calls,
+        # workers > 1 runs a parallel search in a pool of processes kept until close()
+        # a book move comes back at once, as a depth 0 result
+        if (move := self.book_move()) != NO_MOVE:
+            return SearchResult(move, 0, [move], 0, 0, 0.0, 0)
+        if workers > 1:
+            if self.parallel is None or self.parallel.workers != workers:
+                from parallel import ParallelSearch
+                self.close()
+                self.parallel = ParallelSearch(workers)
+            return self.parallel.search(self, depth, movetime, nodes)
+        if self.searcher is None:
+            self.searcher = Searcher(self)
+        return self.searcher.search(depth, movetime, nodes)
+
+    def load_book(self, path: str, mode: str = 'weighted') -> None:
+        from book import OpeningBook
+        if self.book is not None:
+            self.book.close()
+        self.book = OpeningBook(path)
+        self.book_mode = mode
+
+    def book_move(self) -> int:
+        return self.book.choose(self, self.book_mode) if self.book is not None else NO_MOVE
+
+    def load_tablebases(self, directory: str) -> None:
+        from tablebase import Tablebases
+        if self.tablebases is not None:
+            self.tablebases.close()
+        self.tablebases = Tablebases(directory)
+
+    def probe_tablebase(self):
+        # the exact Probe(wdl, dtm) of the position when the tablebases cover it, otherwise None;
+        # castling rights and en passant captures are not in the tables
+        if self.tablebases is None or self.castling_rights:
+            return None
+        probe = self.tablebases.probe(self.board.squares, self.move & 1)
+        if probe is not None and self.en_passant_square != OFF_BOARD and \
+                any(move >> 12 == EN_PASSANT for move in self.valid_moves()):
+            return None
+        return probe
+
+    def stop(self) -> None:
+        if self.searcher is not None:
+            self.searcher.stop()
+        if self.parallel is not None:
+            self.parallel.stop()
+
+    def close(self) -> None:
+        if self.parallel is not None:
+            self.parallel.close()
+            self.parallel = None
+
+    def valid_moves(self) -> array:
+        if self.moves_stale:
+            self.generate_all_valid_moves()
+        return self.all_valid_moves
+
+    def piece_valid_moves(self, position: Pos) -> list[Move]:
+        return [to_move(move) for move in self.generate_moves(ALL_MOVES, square_of(position))]
+
+    def has_legal_move(self) -> bool:
+        if not self.moves_stale:
+            return bool(self.all_valid_moves)
+        return bool(self.generate_moves(ALL_MOVES, limit=1))
+
+    def generate_captures(self) -> array:
+        # captures, en passant and promotions
+        return self.generate_moves(TACTICAL_MOVES)
+
+    def generate_checks(self) -> array:
+        # quiet moves giving check, direct or discovered; castling is left out
+        return self.generate_moves(QUIET_CHECKS)
+
+    def validate_and_make_move(self, move: Move) -> None:
+        if not move.promotion and move.end.x in (0, 7) and self.board.squares[square_of(move.start)] & TYPE_MASK == PAWN:
+            move = move._replace(promotion=QUEEN)
+        packed = from_move(move, self.valid_moves())
+        if packed != NO_MOVE:
+            self.make_move(packed)
+
+    def generate_all_valid_moves(self) -> array:
+        # strictly legal moves of the side to move
+        self.all_valid_moves = self.generate_moves()
+        self.moves_stale = False
+        return self.all_valid_moves
+
+    @abstractmethod
+    def generate_moves(self, kind: int = ALL_MOVES, square: int = OFF_BOARD, limit: int = MAX_MOVES) -> array:
+        # the legal moves of one kind, only those of the piece on square unless it is OFF_BOARD;
+        # generation stops after the first piece that brings the count to limit
+        ...
+
+    @abstractmethod
+    def attack_map(self, side: int) -> int:
+        # the squares attacked by side (0 white, 1 black) as a mask
+        ...
+
+    @abstractmethod
+    def is_attacked(self, square: int, side: int) -> bool:
+        ...
+
+    @abstractmethod
+    def in_check(self) -> bool:
+        ...
+
+    @abstractmethod
+    def see(self, move: int) -> int:
+        # static exchange value of move for the side making it, in EXCHANGE_VALUES centipawns
+        ...
+
+    @abstractmethod
+    def make_move(self, move: int) -> None:
+        ...
+
+    @abstractmethod
+    def undo_move(self) -> None:
+        ...
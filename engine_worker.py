@@ -0,0 +1,166 @@
+import logging
+import multiprocessing
+import threading
+from typing import Callable, NamedTuple
+
+from utils import *
+from chess_engine import new_engine
+from search import MAX_PLY, Searcher, SearchResult
+
+
+log = logging.getLogger('engine_worker')
+
+
+"""
+The engine in a process of its own, for the GUI. Requests go down one queue and replies come back on another,
+where a reader thread hands each one to a callback (the GUI posts it to its event loop), so neither searching
+nor move generation runs on the GUI thread. Any request interrupts a running search: the client counts the
+requests it sent, the worker the ones it took, and the search's stop check compares the two.
+After its move the engine can ponder on the reply it expects. When that reply is played the pondered search
+is reused: returned at once when it already covers the search asked for, otherwise continued for the time
+left with its transposition table warm.
+"""
+
+
+class Snapshot(NamedTuple):
+    # the engine's position after the request numbered serial, 0 for the starting position
+    serial: int
+    squares: bytes
+    side: int
+    moves: tuple[int, ...]
+    in_check: bool
+    fen: str
+
+
+class BestMove(NamedTuple):
+    # answer to the go request numbered serial; ponder is the expected reply or NO_MOVE
+    serial: int
+    move: int
+    ponder: int
+    result: SearchResult
+    # the result comes from pondering on the move that was played
+    pondered: bool
+
+
+class PendingRequests:
+    # stands in for the searcher's stop event: set while requests the worker has not taken are queued
+    def __init__(self, sent) -> None:
+        self.sent = sent
+        self.taken: int = 0
+
+    def is_set(self) -> bool:
+        return self.sent.value > self.taken
+
+
+def _snapshot(engine, serial: int) -> Snapshot:
+    moves = tuple(engine.valid_moves())
+    return Snapshot(serial, bytes(engine.board.squares), engine.move % 2, moves, engine.in_check(), engine.to_fen())
+
+
+def _serve(tasks, replies, sent, fen: str | None, backend: str, hash_mb: float) -> None:
+    logging.disable(logging.DEBUG)
+    engine = new_engine(fen, backend=backend)
+    searcher = engine.searcher = Searcher(engine, hash_mb)
+    pending = searcher.stop_event = PendingRequests(sent)
+    # (hash key of the position pondered, its search result) from the last ponder request
+    pondered: tuple[int, SearchResult] | None = None
+    replies.put(_snapshot(engine, 0))
+    try:
+        while (task := tasks.get()) is not None:
+            pending.taken += 1
+            serial, command, *args = task
+            if command == 'position':
+                engine.load_fen(args[0])
+                replies.put(_snapshot(engine, serial))
+            elif command == 'move':
+                if args[0] in engine.valid_moves():
+                    engine.make_move(args[0])
+                replies.put(_snapshot(engine, serial))
+            elif command == 'undo':
+                for _ in range(min(args[0], len(engine.history))):
+                    engine.undo_move()
+                replies.put(_snapshot(engine, serial))
+            elif command == 'go':
+                depth, movetime = args
+                found = pondered[1] if pondered is not None and pondered[0] == engine.hash_key else None
+                pondered = None
+                if found is not None and found.move in engine.valid_moves() and \
+                        (depth and found.depth >= depth or movetime and found.time >= movetime):
+                    result = found
+                else:
+                    if found is not None and movetime:
+                        movetime = max(movetime - found.time, 0.01)
+                    result = searcher.search(depth, movetime)
+                    found = None
+                ponder = result.pv[1] if len(result.pv) > 1 else NO_MOVE
+                replies.put(BestMove(serial, result.move, ponder, result, found is not None))
+            elif command == 'ponder':
+                move = args[0]
+                if move in engine.valid_moves():
+                    engine.make_move(move)
+                    # runs until the next request arrives
+                    pondered = engine.hash_key, searcher.search(depth=MAX_PLY - 8)
+                    engine.undo_move()
+            elif command != 'stop':
+                log.warning('unknown engine request %r', command)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        replies.put(None)
+
+
+class EngineWorker:
+    def __init__(self, on_reply: Callable[[Snapshot | BestMove], None], fen: str | None = None,
+                 backend: str = 'object', hash_mb: float = 16) -> None:
+        # on_reply runs on the reader thread
+        self.on_reply = on_reply
+        self.tasks = multiprocessing.Queue()
+        self.replies = multiprocessing.Queue()
+        self.sent = multiprocessing.Value('q', 0)
+        self.process = multiprocessing.Process(target=_serve, name='engine', daemon=True,
+                                               args=(self.tasks, self.replies, self.sent, fen, backend, hash_mb))
+        self.process.start()
+        self.reader = threading.Thread(target=self.read, name='engine-replies', daemon=True)
+        self.reader.start()
+
+    def read(self) -> None:
+        while (reply := self.replies.get()) is not None:
+            self.on_reply(reply)
+
+    def request(self, command: str, *args) -> int:
+        # returns the serial the reply will carry
+        with self.sent.get_lock():
+            self.sent.value += 1
+            serial = self.sent.value
+        self.tasks.put((serial, command, *args))
+        return serial
+
+    def position(self, fen: str) -> int:
+        return self.request('position', fen)
+
+    def move(self, move: int) -> int:
+        return self.request('move', move)
+
+    def undo(self, plies: int = 1) -> int:
+        return self.request('undo', plies)
+
+    def go(self, depth: int | None = None, movetime: float | None = None) -> int:
+        return self.request('go', depth, movetime)
+
+    def ponder(self, move: int) -> int:
+        return self.request('ponder', move)
+
+    def stop(self) -> int:
+        # a running search answers with the best move found so far
+        return self.request('stop')
+
+    def close(self) -> None:
+        with self.sent.get_lock():
+            self.sent.value += 1
+        self.tasks.put(None)
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+            self.replies.put(None)
+        self.reader.join(timeout=1)
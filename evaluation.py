@@ -0,0 +1,169 @@
+import logging
+
+from utils import *
+
+
+log = logging.getLogger('evaluation')
+
+
+"""
+Material plus tapered piece-square tables. Tables are written from white's side with rank 8 on the first row,
+so a white piece reads them at its square and a black piece at the mirrored square (square ^ 56).
+MG_SCORES/EG_SCORES[code][square] fold the piece value into the table and are negative for black pieces,
+so a position's score is a plain sum over its pieces, kept up to date by make_move/undo_move.
+"""
+TOTAL_PHASE = 24
+# game phase contributed by each piece type, 24 with all minor and major pieces on the board
+PHASE_WEIGHTS: list[int] = [0, 0, 1, 1, 2, 4, 0, 0] * 2
+MOBILITY_WEIGHT = 2
+# per pawn beyond the first on a file, and per pawn with no friendly pawn on a neighbouring file
+DOUBLED_PAWN = -15
+ISOLATED_PAWN = -10
+# a position the tablebases call won scores this less its distance to mate in plies
+TABLEBASE_WIN = 20000
+
+# piece values by code for static exchange evaluation, where a knight and a bishop are worth the same
+EXCHANGE_VALUES: list[int] = [0, 100, 300, 300, 500, 900, 20000, 0] * 2
+
+MG_VALUES = (0, 100, 320, 330, 500, 900, 0)
+EG_VALUES = (0, 120, 300, 320, 520, 950, 0)
+
+PAWN_MG = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     10,  10,  20,  30,  30,  20,  10,  10,
+      5,   5,  10,  25,  25,  10,   5,   5,
+      0,   0,   0,  20,  20,   0,   0,   0,
+      5,  -5, -10,   0,   0, -10,  -5,   5,
+      5,  10,  10, -20, -20,  10,  10,   5,
+      0,   0,   0,   0,   0,   0,   0,   0,
+)
+PAWN_EG = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+     80,  80,  80,  80,  80,  80,  80,  80,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     30,  30,  30,  30,  30,  30,  30,  30,
+     20,  20,  20,  20,  20,  20,  20,  20,
+     10,  10,  10,  10,  10,  10,  10,  10,
+     10,  10,  10,  10,  10,  10,  10,  10,
+      0,   0,   0,   0,   0,   0,   0,   0,
+)
+KNIGHT_TABLE = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50,
+)
+BISHOP_TABLE = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20,
+)
+ROOK_TABLE = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+      5,  10,  10,  10,  10,  10,  10,   5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+      0,   0,   0,   5,   5,   0,   0,   0,
+)
+QUEEN_TABLE = (
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+)
+KING_MG = (
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20,
+)
+KING_EG = (
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+)
+_EMPTY_TABLE = (0,) * 64
+MG_TABLES = (_EMPTY_TABLE, PAWN_MG, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_MG)
+EG_TABLES = (_EMPTY_TABLE, PAWN_EG, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_EG)
+
+
+def _scores(values: tuple[int, ...], tables: tuple[tuple[int, ...], ...]) -> list[list[int]]:
+    scores = []
+    for code in range(16):
+        piece_type = code & TYPE_MASK
+        if not PAWN <= piece_type <= KING:
+            scores.append([0] * 64)
+        elif code & BLACK_PIECE:
+            scores.append([-values[piece_type] - tables[piece_type][square ^ 56] for square in range(64)])
+        else:
+            scores.append([values[piece_type] + tables[piece_type][square] for square in range(64)])
+    return scores
+
+
+MG_SCORES: list[list[int]] = _scores(MG_VALUES, MG_TABLES)
+EG_SCORES: list[list[int]] = _scores(EG_VALUES, EG_TABLES)
+
+
+def evaluate_squares(squares: bytearray) -> tuple[int, int, int]:
+    # full recompute of (middlegame score, endgame score, phase), white's point of view
+    mg = eg = phase = 0
+    for square, code in enumerate(squares):
+        if code:
+            mg += MG_SCORES[code][square]
+            eg += EG_SCORES[code][square]
+            phase += PHASE_WEIGHTS[code]
+    return mg, eg, phase
+
+
+def taper(mg: int, eg: int, phase: int) -> int:
+    # blend by game phase; promotions can push phase past TOTAL_PHASE, which still counts as a full middlegame;
+    # rounded towards zero so swapping the colours exactly negates the result
+    phase = min(phase, TOTAL_PHASE)
+    blend = mg * phase + eg * (TOTAL_PHASE - phase)
+    return blend // TOTAL_PHASE if blend >= 0 else -(-blend // TOTAL_PHASE)
+
+
+def pawn_structure(squares: bytearray) -> int:
+    # doubled and isolated pawns from per-file pawn counts, white's point of view
+    score = 0
+    for pawn, sign in ((PAWN, 1), (PAWN | BLACK_PIECE, -1)):
+        files = [0] + [squares[file::8].count(pawn) for file in range(8)] + [0]
+        for file in range(1, 9):
+            count = files[file]
+            if count:
+                penalty = DOUBLED_PAWN * (count - 1)
+                if not files[file - 1] and not files[file + 1]:
+                    penalty += ISOLATED_PAWN * count
+                score += sign * penalty
+    return score
+
+
+def evaluate_position(squares: bytearray) -> int:
+    # the static part of ChessEngine.evaluate from white's point of view, without mobility
+    return taper(*evaluate_squares(squares)) + pawn_structure(squares)
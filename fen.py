@@ -0,0 +1,126 @@
+import logging
+import re
+from typing import Iterator
+
+from utils import *
+
+
+log = logging.getLogger('fen')
+
+
+"""
+FEN and EPD parsing and serialization. A Position holds everything a FEN line says, engines load one with
+set_position() and produce one with position(). Fields are looked up in prebuilt tables, no per-character loop.
+Engines also take and restore EngineSnapshots, for handing positions to other engines and processes.
+"""
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+SIDES: dict[str, int] = {'w': 0, 'b': 1}
+SIDE_NAMES = 'wb'
+# castling field <-> rights bitmask for every subset in FEN order, '-' for none
+CASTLING_NAMES: list[str] = [''.join(letter for letter, right in zip('KQkq', (WHITE_SHORT, WHITE_LONG, BLACK_SHORT, BLACK_LONG))
+                                     if rights & right) or '-' for rights in range(16)]
+CASTLING_RIGHTS: dict[str, int] = {name: rights for rights, name in enumerate(CASTLING_NAMES)}
+# only the third and sixth ranks can hold an en passant square
+EN_PASSANT_SQUARES: dict[str, int] = {'-': OFF_BOARD} | {SQUARE_NAMES[square]: square
+                                                         for square in [*range(16, 24), *range(40, 48)]}
+EN_PASSANT_NAMES: dict[int, str] = {square: name for name, square in EN_PASSANT_SQUARES.items()}
+EPD_OPERATION = re.compile(r'\s*(\w+)\s*((?:"[^"]*"|[^;"])*);')
+
+
+class Position(NamedTuple):
+    squares: bytes
+    side: int
+    castling_rights: int
+    en_passant_square: int
+    halfmove_clock: int
+    fullmove_number: int
+
+
+class EngineSnapshot(NamedTuple):
+    # a Position plus what engines derive from it, so restoring one skips the recompute; immutable,
+    # hashable and about 200 bytes pickled
+    position: Position
+    hash_key: int
+    mg_score: int
+    eg_score: int
+    phase: int
+
+
+def parse_fen(fen: str) -> Position:
+    # clocks may be left out, as in EPD, and default to 0 1
+    return _parse_fields(fen.split(), fen)
+
+
+def _parse_fields(fields: list[str], fen: str) -> Position:
+    if not 4 <= len(fields) <= 6:
+        raise ValueError(f'FEN needs 4 to 6 fields: {fen!r}')
+    try:
+        position = Position(encode_placement(fields[0]), SIDES[fields[1]], CASTLING_RIGHTS[fields[2]],
+                            EN_PASSANT_SQUARES[fields[3]], int(fields[4]) if len(fields) > 4 else 0,
+                            int(fields[5]) if len(fields) > 5 else 1)
+        check_position(position)
+        return position
+    except (KeyError, ValueError) as error:
+        raise ValueError(f'bad FEN {fen!r}: {error}') from None
+
+
+def check_position(position: Position) -> None:
+    # ValueError for positions the engines cannot play from: one king a side, no pawns on the first or
+    # last rank, the side that just moved not left in check and counters in range
+    squares = position.squares
+    for name, king in (('white', KING), ('black', KING | BLACK_PIECE)):
+        if (count := squares.count(king)) != 1:
+            raise ValueError(f'{name} has {count} kings')
+    edges = squares[:8] + squares[56:]
+    if PAWN in edges or PAWN | BLACK_PIECE in edges:
+        raise ValueError('pawn on the first or last rank')
+    enemy = position.side ^ 1
+    if square_attacked(squares, squares.find(KING | enemy << 3), position.side):
+        raise ValueError(f'{("white", "black")[enemy]} is in check with {("white", "black")[position.side]} to move')
+    if position.halfmove_clock < 0:
+        raise ValueError(f'halfmove clock {position.halfmove_clock} is negative')
+    if position.fullmove_number < 1:
+        raise ValueError(f'fullmove number {position.fullmove_number} is below 1')
+
+
+def format_fen(position: Position) -> str:
+    return (f'{placement(position.squares)} {SIDE_NAMES[position.side]} {CASTLING_NAMES[position.castling_rights]} '
+            f'{EN_PASSANT_NAMES[position.en_passant_square]} {position.halfmove_clock} {position.fullmove_number}')
+
+
+def parse_epd(line: str) -> tuple[Position, dict[str, str]]:
+    # four position fields then operations such as bm e4; id "name"; hmvc and fmvn set the clocks
+    fields = line.split(maxsplit=4)
+    if len(fields) < 4:
+        raise ValueError(f'EPD needs 4 position fields: {line!r}')
+    operations = {opcode: operand.strip().strip('"')
+                  for opcode, operand in EPD_OPERATION.findall(fields[4] if len(fields) > 4 else '')}
+    position = parse_fen(' '.join(fields[:4]))
+    if 'hmvc' in operations or 'fmvn' in operations:
+        position = position._replace(halfmove_clock=int(operations.get('hmvc', 0)),
+                                     fullmove_number=int(operations.get('fmvn', 1)))
+    return position, operations
+
+
+def format_epd(position: Position, operations: dict[str, str] | None = None) -> str:
+    fields = format_fen(position).rsplit(maxsplit=2)[0]
+    ops = ''.join(f' {opcode} {operand};' if ' ' not in operand else f' {opcode} "{operand}";'
+                  for opcode, operand in (operations or {}).items())
+    return fields + ops
+
+
+def read_fens(path: str) -> Iterator[Position]:
+    # one FEN or EPD line per position, blank lines and # comments skipped, EPD operations dropped
+    with open(path) as file:
+        for line in file:
+            fields = line.split()
+            if not fields or fields[0][0] == '#':
+                continue
+            if len(fields) > 4 and not fields[4].isdigit():
+                yield parse_epd(line)[0]
+            else:
+                yield _parse_fields(fields, line)
+
+
+START_POSITION = parse_fen(START_FEN)
@@ -0,0 +1,179 @@
+import argparse
+import cProfile
+import logging
+import pstats
+import sys
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator
+
+
+log = logging.getLogger('instrumentation')
+
+
+"""
+Counters and phase timers for the engine hot paths. Nothing is counted in the engine code itself:
+enable() swaps counting and timing wrappers in for the instrumented methods on the engine classes and
+disable() puts the originals back, so a disabled build runs exactly the uninstrumented code.
+Timers are inclusive, generate includes the check_for_check it calls.
+"""
+counters: dict[str, int] = {}
+timers: dict[str, float] = {}
+_originals: list[tuple[type, str, Callable]] = []
+
+
+def reset() -> None:
+    for name in ('moves_generated', 'generations', 'makes', 'unmakes', 'check_detections', 'checks_found',
+                 'cache_hits', 'cache_misses'):
+        counters[name] = 0
+    for name in ('check_for_check', 'generate', 'make_move'):
+        timers[name] = 0.0
+
+
+def _timed(name: str, method: Callable) -> Callable:
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            timers[name] += time.perf_counter() - start
+    return wrapper
+
+
+def _wrappers(cls: type) -> dict[str, Callable]:
+    generate, make_move, undo_move, valid_moves = \
+        cls.generate_moves, cls.make_move, cls.undo_move, cls.valid_moves
+
+    @wraps(generate)
+    def generate_moves(self, *args, **kwargs):
+        # a call served from the cached move list is not a generation
+        stale = self.moves_stale
+        moves = generate(self, *args, **kwargs)
+        if stale:
+            counters['generations'] += 1
+            counters['moves_generated'] += len(moves)
+        return moves
+
+    @wraps(make_move)
+    def counted_make_move(self, move):
+        counters['makes'] += 1
+        return make_move(self, move)
+
+    @wraps(undo_move)
+    def counted_undo_move(self):
+        counters['unmakes'] += 1
+        return undo_move(self)
+
+    @wraps(valid_moves)
+    def cached_valid_moves(self):
+        counters['cache_misses' if self.moves_stale else 'cache_hits'] += 1
+        return valid_moves(self)
+
+    wrappers = {'generate_moves': _timed('generate', generate_moves),
+                'make_move': _timed('make_move', counted_make_move),
+                'undo_move': counted_undo_move,
+                'valid_moves': cached_valid_moves}
+    if hasattr(cls, 'check_for_check'):
+        check_for_check = cls.check_for_check
+
+        @wraps(check_for_check)
+        def counted_check_for_check(self):
+            check_for_check(self)
+            counters['check_detections'] += 1
+            if self.checkers:
+                counters['checks_found'] += 1
+
+        wrappers['check_for_check'] = _timed('check_for_check', counted_check_for_check)
+    return wrappers
+
+
+def enable() -> None:
+    from chess_engine import ChessEngine
+    from bitboard import BitboardEngine
+    if _originals:
+        return
+    reset()
+    for cls in (ChessEngine, BitboardEngine):
+        for name, wrapper in _wrappers(cls).items():
+            # methods inherited from EngineBase are wrapped on the backend class, which disable() deletes again
+            _originals.append((cls, name, cls.__dict__.get(name)))
+            setattr(cls, name, wrapper)
+
+
+def disable() -> None:
+    while _originals:
+        cls, name, method = _originals.pop()
+        if method is None:
+            delattr(cls, name)
+        else:
+            setattr(cls, name, method)
+
+
+def enabled() -> bool:
+    return bool(_originals)
+
+
+@contextmanager
+def instrumented() -> Iterator[dict[str, int]]:
+    enable()
+    try:
+        yield counters
+    finally:
+        disable()
+
+
+def report() -> str:
+    lines = [f'{name:<18} {value:>12}' for name, value in counters.items()]
+    lines += [f'{name + " time":<18} {value:>11.3f}s' for name, value in timers.items()]
+    return '\n'.join(lines)
+
+
+@contextmanager
+def profiled(path: str | None) -> Iterator[None]:
+    # cProfile the block and dump the stats to path for pstats/snakeviz, a no-op when path is None
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        log.info('profile written to %s', path)
+
+
+def main(argv: list[str] | None = None) -> int:
+    from chess_engine import new_engine
+    from utils import move_name
+    parser = argparse.ArgumentParser(description='Instrumented or profiled search run')
+    parser.add_argument('--fen', default='r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1')
+    parser.add_argument('-d', '--depth', type=int)
+    parser.add_argument('-t', '--movetime', type=float, help='seconds')
+    parser.add_argument('-b', '--backend', choices=('object', 'bitboard'), default='object')
+    parser.add_argument('--stats', action='store_true', help='print counters and phase timers')
+    parser.add_argument('--profile', metavar='FILE', help='dump a cProfile of the search to FILE')
+    args = parser.parse_args(argv)
+
+    engine = new_engine(args.fen, backend=args.backend)
+    if args.stats:
+        enable()
+    try:
+        with profiled(args.profile):
+            result = engine.search(depth=args.depth, movetime=args.movetime)
+    finally:
+        disable()
+    print(f'bestmove {move_name(result.move)} score {result.score} depth {result.depth} '
+          f'nodes {result.nodes} {result.time:.3f}s {result.nps} nps')
+    if args.stats:
+        print(report())
+    if args.profile:
+        pstats.Stats(args.profile).sort_stats('cumulative').print_stats(15)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+import os
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import shared_memory
+
+from utils import *
+from chess_engine import new_engine
+from search import MATE_BOUND, MAX_PLY, Searcher, SearchResult
+from transposition import TranspositionTable
+from fen import EngineSnapshot
+
+
+log = logging.getLogger('parallel')
+
+
+"""
+Lazy SMP: every worker process runs its own Searcher on the same root position, all of them reading and
+writing one transposition table in shared memory, so work one worker stores cuts off subtrees for the others.
+Odd workers search one ply deeper than the iteration they are on to spread the workers over the tree.
+Worker 0 decides when the search is over, the others are stopped through a shared event.
+Table entries are written without locks; each slot's key is stored xored with its data word, so a slot two
+workers wrote at once fails the key check on probe and reads as a miss instead of giving a wrong score.
+"""
+EngineState = tuple[str, EngineSnapshot]
+
+
+def engine_state(engine) -> EngineState:
+    return engine.backend, engine.snapshot()
+
+
+def restore_engine(state: EngineState, engine=None):
+    # rebuild the position in engine, or in a fresh engine of the same backend
+    backend, snapshot = state
+    if engine is None:
+        engine = new_engine(backend=backend)
+    engine.restore(snapshot)
+    return engine
+
+
+def _worker(index: int, name: str, hash_mb: float, tasks, results, stop_event) -> None:
+    logging.disable(logging.DEBUG)
+    memory = shared_memory.SharedMemory(name)
+    engines: dict[str, object] = {}
+    table = TranspositionTable(hash_mb, memory.buf)
+    try:
+        while (task := tasks.get()) is not None:
+            state, played, tablebases, depth, movetime, nodes, age = task
+            engine = engines.get(state[0])
+            if engine is None:
+                engine = engines[state[0]] = new_engine(backend=state[0])
+                engine.searcher = Searcher(engine, hash_mb=0)
+                engine.searcher.table = table
+            restore_engine(state, engine)
+            if tablebases != (engine.tablebases and engine.tablebases.directory):
+                if tablebases:
+                    engine.load_tablebases(tablebases)
+                elif engine.tablebases is not None:
+                    engine.tablebases.close()
+                    engine.tablebases = None
+            searcher = engine.searcher
+            searcher.stop_event = stop_event
+            searcher.depth_offset = index & 1
+            table.age = age
+            # helpers run until worker 0 is done, the limits apply to worker 0
+            if index:
+                result = searcher.search(depth=MAX_PLY - 8, played=played)
+            else:
+                result = searcher.search(depth, movetime, nodes, played)
+                stop_event.set()
+            results.put((index, result))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        table.release()
+        memory.close()
+
+
+class ParallelSearch:
+    def __init__(self, workers: int | None = None, hash_mb: float = 64) -> None:
+        self.workers: int = workers or os.cpu_count() or 1
+        self.hash_mb: float = hash_mb
+        self.memory = shared_memory.SharedMemory(create=True, size=TranspositionTable.buffer_size(hash_mb))
+        self.table: TranspositionTable = TranspositionTable(hash_mb, self.memory.buf)
+        self.stop_event = multiprocessing.Event()
+        self.results = multiprocessing.Queue()
+        self.tasks = [multiprocessing.Queue() for _ in range(self.workers)]
+        self.processes = [multiprocessing.Process(target=_worker, name=f'search-{index}', daemon=True,
+                                                  args=(index, self.memory.name, hash_mb, tasks, self.results,
+                                                        self.stop_event))
+                          for index, tasks in enumerate(self.tasks)]
+        for process in self.processes:
+            process.start()
+
+    def search(self, engine, depth: int | None = None, movetime: float | None = None,
+               nodes: int | None = None) -> SearchResult:
+        # runs until worker 0 finishes or stop() is called, nodes and nps are summed over all workers
+        start = time.perf_counter()
+        self.stop_event.clear()
+        self.table.new_search()
+        state = engine_state(engine)
+        # the snapshot has no undo history, the game's positions go along for the repetition check
+        played = engine.game_keys()
+        # workers open the same tablebase directory as the engine
+        tablebases = engine.tablebases.directory if engine.tablebases is not None else None
+        for tasks in self.tasks:
+            tasks.put((state, played, tablebases, depth, movetime, nodes, self.table.age))
+        results: list[SearchResult | None] = [None] * self.workers
+        for _ in range(self.workers):
+            index, result = self.results.get()
+            results[index] = result
+        elapsed = time.perf_counter() - start
+        total = sum(result.nodes for result in results)
+        # the deepest completed iteration wins, worker 0 on ties
+        best = max(results, key=lambda result: result.depth)
+        if best.depth == results[0].depth:
+            best = results[0]
+        log.debug('workers %d depths %s nodes %d', self.workers, [result.depth for result in results], total)
+        return best._replace(nodes=total, time=elapsed, nps=int(total / max(elapsed, 1e-9)))
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def clear(self) -> None:
+        self.table.clear()
+
+    def close(self) -> None:
+        self.stop_event.set()
+        for tasks in self.tasks:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.table.release()
+        self.memory.close()
+        self.memory.unlink()
+        self.processes = []
+
+    def __enter__(self) -> 'ParallelSearch':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+_analysis_engines: dict[str, object] = {}
+
+
+def _analyse(state: EngineState, depth: int | None, movetime: float | None, nodes: int | None) -> SearchResult:
+    # one engine and searcher per backend and pool process, kept for every line the process is given
+    engine = _analysis_engines[state[0]] = restore_engine(state, _analysis_engines.get(state[0]))
+    if engine.searcher is None:
+        logging.disable(logging.DEBUG)
+        engine.searcher = Searcher(engine)
+    return engine.searcher.search(depth, movetime, nodes)
+
+
+def analyse_moves(engine, moves, depth: int | None = None, movetime: float | None = None, nodes: int | None = None,
+                  jobs: int | None = None) -> list[tuple[int, SearchResult]]:
+    # searches the position after each candidate move in a pool of processes, each line shipped as a snapshot;
+    # scores are from the side to move in engine, best move first
+    states = []
+    for move in moves:
+        engine.make_move(move)
+        states.append(engine_state(engine))
+        engine.undo_move()
+    with ProcessPoolExecutor(jobs) as pool:
+        results = list(pool.map(_analyse, states, repeat(depth), repeat(movetime), repeat(nodes)))
+    lines = []
+    for move, result in zip(moves, results):
+        # one ply further from the mate seen from the position before the move
+        score = -result.score
+        score -= (score > MATE_BOUND) - (score < -MATE_BOUND)
+        lines.append((move, result._replace(score=score, pv=[move, *result.pv])))
+    return sorted(lines, key=lambda line: -line[1].score)
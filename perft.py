@@ -0,0 +1,207 @@
+import argparse
+from array import array
+import logging
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import NamedTuple
+
+import instrumentation
+from chess_engine import new_engine
+from engine_base import EngineBase
+from fen import parse_fen
+from parallel import EngineState, engine_state, restore_engine
+from transposition import TranspositionTable
+from utils import move_name
+
+
+class PerftPosition(NamedTuple):
+    name: str
+    fen: str
+    nodes: list[int]
+
+
+# nodes[i] is the reference leaf count at depth i + 1
+POSITIONS: list[PerftPosition] = [
+    PerftPosition('start', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+                  [20, 400, 8902, 197281, 4865609]),
+    PerftPosition('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+                  [48, 2039, 97862, 4085603]),
+    PerftPosition('position3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+                  [14, 191, 2812, 43238, 674624]),
+    PerftPosition('position4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+                  [6, 264, 9467, 422333]),
+    PerftPosition('position5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+                  [44, 1486, 62379, 2103487]),
+    PerftPosition('position6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+                  [46, 2079, 89890, 3894594]),
+    PerftPosition('illegal_ep', '3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1',
+                  [18, 92, 1670, 10138, 185429, 1134888]),
+    PerftPosition('illegal_ep_mirrored', '8/8/8/8/k1p4R/8/3P4/3K4 w - - 0 1',
+                  [18, 92, 1670, 10138, 185429, 1134888]),
+    PerftPosition('ep_discovered_check', '8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1',
+                  [13, 102, 1266, 10276, 135655, 1015133]),
+    PerftPosition('short_castle_check', '5k2/8/8/8/8/8/8/4K2R w K - 0 1',
+                  [15, 66, 1198, 6399, 120330, 661072]),
+    PerftPosition('long_castle_check', '3k4/8/8/8/8/8/8/R3K3 w Q - 0 1',
+                  [16, 71, 1286, 7418, 141077, 803711]),
+    PerftPosition('castle_rights', 'r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1',
+                  [26, 1141, 27826, 1274206]),
+    PerftPosition('castle_prevented', 'r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1',
+                  [44, 1494, 50509, 1720476]),
+    PerftPosition('promote_out_of_check', '2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1',
+                  [11, 133, 1442, 19174, 266199, 3821001]),
+    PerftPosition('discovered_check', '8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1',
+                  [29, 165, 5160, 31961, 1004658]),
+    PerftPosition('promote_to_check', '4k3/1P6/8/8/8/8/K7/8 w - - 0 1',
+                  [9, 40, 472, 2661, 38983, 217342]),
+    PerftPosition('underpromote_to_check', '8/P1k5/K7/8/8/8/8/8 w - - 0 1',
+                  [6, 27, 273, 1329, 18135, 92683]),
+    PerftPosition('self_stalemate', 'K1k5/8/P7/8/8/8/8/8 w - - 0 1',
+                  [2, 6, 13, 63, 382, 2217]),
+    PerftPosition('stalemate_checkmate', '8/k1P5/8/1K6/8/8/8/8 w - - 0 1',
+                  [10, 25, 268, 926, 10857, 43261]),
+    PerftPosition('stalemate_checkmate2', '8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1',
+                  [37, 183, 6559, 23527]),
+]
+
+
+def load_position(fen: str, backend: str = 'object') -> EngineBase:
+    return new_engine(fen, backend=backend)
+
+
+def legal_moves(engine: EngineBase) -> array:
+    return engine.generate_all_valid_moves()
+
+
+def perft(engine: EngineBase, depth: int, table: TranspositionTable | None = None) -> int:
+    if depth == 0:
+        return 1
+    if table is not None and depth > 1:
+        entry = table.probe(engine.hash_key)
+        if entry and entry >> 2 & 0xFF == depth:
+            return entry >> 26
+    moves = legal_moves(engine)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        engine.make_move(move)
+        nodes += perft(engine, depth - 1, table)
+        engine.undo_move()
+    if table is not None:
+        table.store(engine.hash_key, depth, nodes, TranspositionTable.EXACT)
+    return nodes
+
+
+def divide(engine: EngineBase, depth: int, table: TranspositionTable | None = None) -> list[tuple[int, int]]:
+    result = []
+    for move in legal_moves(engine):
+        engine.make_move(move)
+        result.append((move, perft(engine, depth - 1, table)))
+        engine.undo_move()
+    return result
+
+
+_worker_table: TranspositionTable | None = None
+
+
+def _init_worker(hash_mb: float) -> None:
+    global _worker_table
+    logging.disable(logging.DEBUG)
+    _worker_table = TranspositionTable(hash_mb) if hash_mb else None
+
+
+def _perft_after(state: EngineState, move: int, depth: int) -> int:
+    engine = restore_engine(state)
+    engine.make_move(move)
+    return perft(engine, depth, _worker_table)
+
+
+def parallel_divide(engine: EngineBase, depth: int, jobs: int, hash_mb: float = 0) -> list[tuple[int, int]]:
+    # root splitting: every root move is an independent task for a pool of jobs processes
+    moves = legal_moves(engine)
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(hash_mb,)) as pool:
+        counts = pool.map(_perft_after, repeat(engine_state(engine)), moves, repeat(depth - 1))
+        return list(zip(moves, counts))
+
+
+def run_position(position: PerftPosition, depth: int, show_divide: bool = False, backend: str = 'object',
+                 hash_mb: float = 0, jobs: int = 1) -> bool:
+    depth = min(depth, len(position.nodes)) if position.nodes else depth
+    engine = load_position(position.fen, backend)
+    table = TranspositionTable(hash_mb) if hash_mb else None
+    start = time.perf_counter()
+    if jobs > 1:
+        breakdown = parallel_divide(engine, depth, jobs, hash_mb)
+        nodes = sum(count for _, count in breakdown)
+    elif show_divide:
+        breakdown = divide(engine, depth, table)
+        nodes = sum(count for _, count in breakdown)
+    else:
+        nodes = perft(engine, depth, table)
+    elapsed = time.perf_counter() - start
+    expected = position.nodes[depth - 1] if position.nodes else None
+    ok = expected is None or nodes == expected
+    if show_divide:
+        for move, count in sorted(breakdown, key=lambda item: move_name(item[0])):
+            print(f'  {move_name(move)}: {count}')
+    status = 'ok' if ok else f'FAIL (expected {expected})'
+    nps = nodes / elapsed if elapsed else 0
+    hits = f'  tt hits {table.hits}/{table.probes}' if table else ''
+    print(f'{position.name:<24} depth {depth}  nodes {nodes:>10}  {elapsed:8.3f}s  {nps:10.0f} nps{hits}  {status}')
+    return ok
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Perft move generator benchmark')
+    parser.add_argument('-d', '--depth', type=int, default=3)
+    parser.add_argument('-p', '--position', action='append', default=[],
+                        help='run only the named reference position (repeatable)')
+    parser.add_argument('--fen', help='run an arbitrary position instead of the reference suite')
+    parser.add_argument('--divide', action='store_true', help='print node counts per root move')
+    parser.add_argument('-b', '--backend', choices=('object', 'bitboard'), default='object')
+    parser.add_argument('--hash', type=float, default=0, metavar='MB',
+                        help='share subtree counts between transpositions through a table of this size')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='split root moves over this many processes')
+    parser.add_argument('--stats', action='store_true', help='print move generation counters and phase timers')
+    parser.add_argument('--profile', metavar='FILE', help='dump a cProfile of the run to FILE')
+    args = parser.parse_args(argv)
+    logging.disable(logging.DEBUG)
+
+    if args.fen:
+        try:
+            parse_fen(args.fen)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return 1
+        positions = [PerftPosition('fen', args.fen, [])]
+    elif args.position:
+        by_name = {position.name: position for position in POSITIONS}
+        unknown = [name for name in args.position if name not in by_name]
+        if unknown:
+            parser.error(f'unknown position(s): {", ".join(unknown)}')
+        positions = [by_name[name] for name in args.position]
+    else:
+        positions = POSITIONS
+
+    # counters and timers only see this process, with --jobs the work happens in the pool
+    if args.stats:
+        instrumentation.enable()
+    try:
+        with instrumentation.profiled(args.profile):
+            failed = [position.name for position in positions
+                      if not run_position(position, args.depth, args.divide, args.backend, args.hash, args.jobs)]
+    finally:
+        instrumentation.disable()
+    if args.stats:
+        print(instrumentation.report())
+    if failed:
+        print(f'{len(failed)} position(s) failed: {", ".join(failed)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
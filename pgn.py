@@ -0,0 +1,320 @@
+import argparse
+import gzip
+import logging
+import re
+import sys
+import time
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, TextIO
+
+from utils import *
+from chess_engine import new_engine
+from fen import START_FEN, Position
+
+
+log = logging.getLogger('pgn')
+
+
+"""
+Streaming PGN reader: files (plain or gzip) are read line by line and games are yielded one at a time,
+so memory depends on the longest game, not the file. SAN moves are resolved against the engine's legal
+move list and replayed with make_move.
+"""
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+HEADER = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*]')
+TOKEN = re.compile(r'[{}();]|\$\d+|[^\s{}();]+')
+MOVE_NUMBER = re.compile(r'^\d+\.+')
+SAN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQnbrq]))?$')
+SAN_PIECES: dict[str, int] = {'N': KNIGHT, 'B': BISHOP, 'R': ROOK, 'Q': QUEEN, 'K': KING}
+# games are handed to the pool in batches, with this many batches per worker in flight
+POOL_BATCH = 64
+POOL_BACKLOG = 4
+
+
+class Game(NamedTuple):
+    headers: dict[str, str]
+    # SAN tokens of the main line, comments, variations and NAGs removed
+    moves: list[str]
+    result: str
+
+
+class PlyRecord(NamedTuple):
+    # the position before the move, the move played and its SAN as written in the game
+    ply: int
+    position: Position
+    move: int
+    san: str
+
+
+class GameSummary(NamedTuple):
+    index: int
+    headers: dict[str, str]
+    plies: int
+    result: str
+    final_fen: str
+    # None when every move replayed, otherwise what went wrong
+    error: str | None
+    # FEN after every move when asked for
+    positions: list[str] | None
+
+
+def open_pgn(path: str) -> TextIO:
+    # gzip is recognised by its magic bytes, - reads stdin
+    if path == '-':
+        return sys.stdin
+    with open(path, 'rb') as file:
+        magic = file.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+
+def read_games(lines: Iterable[str]) -> Iterator[Game]:
+    headers: dict[str, str] = {}
+    moves: list[str] = []
+    comment = False
+    depth = 0
+    for line in lines:
+        if not comment and not depth:
+            stripped = line.strip()
+            if stripped.startswith('%'):
+                continue
+            if stripped.startswith('['):
+                if moves:
+                    # a new game started without a result token
+                    yield Game(headers, moves, headers.get('Result', '*'))
+                    headers, moves = {}, []
+                for name, value in HEADER.findall(stripped):
+                    headers[name] = value.replace('\\"', '"').replace('\\\\', '\\')
+                continue
+        for token in TOKEN.findall(line):
+            if comment:
+                comment = token != '}'
+            elif token == '{':
+                comment = True
+            elif token == ';':
+                break
+            elif token == '(':
+                depth += 1
+            elif token == ')':
+                depth = max(depth - 1, 0)
+            elif depth or token[0] == '$':
+                continue
+            elif token in RESULTS:
+                yield Game(headers, moves, token)
+                headers, moves = {}, []
+            else:
+                token = MOVE_NUMBER.sub('', token)
+                if token:
+                    moves.append(token)
+    if moves or headers:
+        yield Game(headers, moves, headers.get('Result', '*'))
+
+
+def parse_san(engine, san: str) -> int:
+    # the legal move written as san in the engine's position, ValueError when there is not exactly one
+    text = san.rstrip('+#!?')
+    moves = engine.valid_moves()
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        flags = KING_CASTLE if len(text) == 3 else QUEEN_CASTLE
+        for move in moves:
+            if move >> 12 == flags:
+                return move
+        raise ValueError(f'illegal castling {san}')
+    match = SAN.match(text)
+    if not match:
+        raise ValueError(f'unreadable move {san!r}')
+    piece, file, rank, target, promotion = match.groups()
+    piece_type = SAN_PIECES[piece] if piece else PAWN
+    end = SQUARE_INDEX[target]
+    promoted = SAN_PIECES[promotion.upper()] if promotion else EMPTY
+    squares = engine.board.squares
+    found = NO_MOVE
+    for move in moves:
+        if move >> 6 & 63 != end or squares[move & 63] & TYPE_MASK != piece_type:
+            continue
+        start_name = SQUARE_NAMES[move & 63]
+        if file and start_name[0] != file or rank and start_name[1] != rank:
+            continue
+        if PROMOTION_PIECES[move >> 12] != promoted:
+            continue
+        if found != NO_MOVE:
+            raise ValueError(f'ambiguous move {san}')
+        found = move
+    if found == NO_MOVE:
+        raise ValueError(f'illegal move {san}')
+    return found
+
+
+def move_san(engine, move: int) -> str:
+    # SAN of a legal move in the engine's position, with + or # from playing it
+    flags = move >> 12
+    if flags == KING_CASTLE or flags == QUEEN_CASTLE:
+        san = 'O-O' if flags == KING_CASTLE else 'O-O-O'
+    else:
+        squares = engine.board.squares
+        start, end = move & 63, move >> 6 & 63
+        piece_type = squares[start] & TYPE_MASK
+        capture = 'x' if flags >= CAPTURE and (squares[end] or flags == EN_PASSANT) else ''
+        if piece_type == PAWN:
+            san = (SQUARE_NAMES[start][0] + capture if capture else '') + SQUARE_NAMES[end]
+            if flags & PROMOTION:
+                san += '=' + PIECE_NAMES[PROMOTION_PIECES[flags]]
+        else:
+            rivals = [other & 63 for other in engine.valid_moves()
+                      if other >> 6 & 63 == end and other & 63 != start and squares[other & 63] & TYPE_MASK == piece_type]
+            name = SQUARE_NAMES[start]
+            if not rivals:
+                origin = ''
+            elif all(SQUARE_NAMES[other][0] != name[0] for other in rivals):
+                origin = name[0]
+            elif all(SQUARE_NAMES[other][1] != name[1] for other in rivals):
+                origin = name[1]
+            else:
+                origin = name
+            san = PIECE_NAMES[piece_type] + origin + capture + SQUARE_NAMES[end]
+    engine.make_move(move)
+    if engine.in_check():
+        san += '+' if engine.has_legal_move() else '#'
+    engine.undo_move()
+    return san
+
+
+def format_game(headers: dict[str, str], sans: list[str], result: str, first_ply: int = 0) -> str:
+    # export-style PGN text, first_ply is the ply number of the first move (odd when black moves first)
+    tags = ''.join(f'[{name} "{value.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"]\n'
+                   for name, value in (headers | {'Result': result}).items())
+    words = []
+    for ply, san in enumerate(sans, first_ply):
+        if ply % 2 == 0:
+            words.append(f'{ply // 2 + 1}.')
+        elif ply == first_ply:
+            words.append(f'{ply // 2 + 1}...')
+        words.append(san)
+    words.append(result)
+    lines, line = [], ''
+    for word in words:
+        if line and len(line) + 1 + len(word) > 79:
+            lines.append(line)
+            line = word
+        else:
+            line = f'{line} {word}' if line else word
+    lines.append(line)
+    return tags + '\n' + '\n'.join(lines) + '\n'
+
+
+def start_engine(game: Game, engine=None, backend: str = 'object'):
+    fen = game.headers.get('FEN', START_FEN)
+    if engine is None:
+        return new_engine(fen, backend=backend)
+    engine.load_fen(fen)
+    return engine
+
+
+def replay(game: Game, engine=None, backend: str = 'object') -> Iterator[PlyRecord]:
+    # plays the game on engine (a fresh one when None) yielding each position before its move;
+    # ValueError names the ply of the first move that does not resolve
+    engine = start_engine(game, engine, backend)
+    for ply, san in enumerate(game.moves):
+        try:
+            move = parse_san(engine, san)
+        except ValueError as error:
+            raise ValueError(f'ply {ply + 1}: {error}') from None
+        yield PlyRecord(ply, engine.position(), move, san)
+        engine.make_move(move)
+
+
+def summarize(index: int, game: Game, engine=None, with_positions: bool = False,
+              backend: str = 'object') -> GameSummary:
+    # replays the whole game, stopping at the first move that does not resolve;
+    # a game whose SetUp position does not load fails at ply 0 with no final FEN
+    positions: list[str] | None = [] if with_positions else None
+    try:
+        engine = start_engine(game, engine, backend)
+    except ValueError as exception:
+        return GameSummary(index, game.headers, 0, game.result, '', f'start position: {exception}', positions)
+    error = None
+    plies = 0
+    try:
+        for san in game.moves:
+            move = parse_san(engine, san)
+            engine.make_move(move)
+            plies += 1
+            if positions is not None:
+                positions.append(engine.to_fen())
+    except ValueError as exception:
+        error = f'ply {plies + 1}: {exception}'
+    return GameSummary(index, game.headers, plies, game.result, engine.to_fen(), error, positions)
+
+
+_worker_engine = None
+
+
+def _init_worker(backend: str) -> None:
+    global _worker_engine
+    logging.disable(logging.DEBUG)
+    _worker_engine = new_engine(backend=backend)
+
+
+def _summarize_batch(batch: list[tuple[int, Game]], with_positions: bool, backend: str) -> list[GameSummary]:
+    return [summarize(index, game, _worker_engine, with_positions, backend) for index, game in batch]
+
+
+def summarize_games(games: Iterable[Game], jobs: int = 1, backend: str = 'object',
+                    with_positions: bool = False) -> Iterator[GameSummary]:
+    # summaries in input order; with jobs > 1 batches of games fan out to a process pool, each worker
+    # reusing one engine, and only a bounded number of batches is in flight at any time
+    if jobs <= 1:
+        engine = new_engine(backend=backend)
+        for index, game in enumerate(games):
+            yield summarize(index, game, engine, with_positions, backend)
+        return
+    numbered = enumerate(games)
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(backend,)) as pool:
+        pending = deque()
+        while batch := list(islice(numbered, POOL_BATCH)):
+            pending.append(pool.submit(_summarize_batch, batch, with_positions, backend))
+            if len(pending) >= jobs * POOL_BACKLOG:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Replay PGN games through the engine')
+    parser.add_argument('file', help='PGN file, optionally gzipped, - for stdin')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='replay games in this many processes')
+    parser.add_argument('-b', '--backend', choices=('object', 'bitboard'), default='object')
+    parser.add_argument('--positions', metavar='FILE', help='write the FEN after every move to FILE')
+    parser.add_argument('--errors', action='store_true', help='print every game that fails to replay')
+    args = parser.parse_args(argv)
+    logging.disable(logging.DEBUG)
+
+    output = open(args.positions, 'w') if args.positions else None
+    games = moves = failed = 0
+    start = time.perf_counter()
+    with open_pgn(args.file) as source:
+        try:
+            for summary in summarize_games(read_games(source), args.jobs, args.backend, output is not None):
+                games += 1
+                moves += summary.plies
+                if summary.error:
+                    failed += 1
+                    if args.errors:
+                        name = f'{summary.headers.get("White", "?")} - {summary.headers.get("Black", "?")}'
+                        print(f'game {summary.index + 1} ({name}): {summary.error}')
+                if output and summary.positions:
+                    output.write('\n'.join(summary.positions) + '\n')
+        finally:
+            if output:
+                output.close()
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f'{games} games  {moves} moves  {failed} failed  {elapsed:.3f}s  '
+          f'{games / elapsed:.1f} games/s  {moves / elapsed:.0f} moves/s')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
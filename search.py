@@ -0,0 +1,402 @@
+import time
+import logging
+from array import array
+from typing import Iterator
+
+from utils import *
+from evaluation import EXCHANGE_VALUES
+from transposition import TranspositionTable
+
+
+log = logging.getLogger('search')
+
+
+"""
+Negamax alpha-beta over the engine's make_move/undo_move. Scores are centipawns from the side to move,
+mate scores are MATE minus the distance in plies so shorter mates score higher.
+Moves come from staged_moves, which only generates each kind of move once the search gets to it, so a cutoff
+on the hash move or a capture never pays for the quiet moves. Quiescence skips captures that static exchange
+evaluation calls losing and, on its first ply, also tries quiet checks.
+"""
+INFINITY = 1_000_000
+MATE = 100_000
+MATE_BOUND = MATE - 1000
+MAX_PLY = 128
+ASPIRATION_WINDOW = 50
+# the clock and node limit are checked once per this many nodes, which keeps the overshoot to a few milliseconds
+CHECK_EVERY = 64
+
+PIECE_VALUES: list[int] = [0, 100, 320, 330, 500, 900, 20000, 0, 0, 100, 320, 330, 500, 900, 20000, 0]
+KILLER_SCORE = 1 << 20
+CAPTURE_SCORE = 1 << 24
+HASH_MOVE_SCORE = 1 << 30
+
+
+class SearchResult(NamedTuple):
+    # packed moves, move is NO_MOVE when the side to move has none
+    move: int
+    score: int
+    pv: list[int]
+    depth: int
+    nodes: int
+    time: float
+    nps: int
+
+
+class SearchStopped(Exception):
+    pass
+
+
+class Searcher:
+    def __init__(self, engine, hash_mb: float = 16) -> None:
+        self.engine = engine
+        self.table: TranspositionTable = TranspositionTable(hash_mb)
+        self.killers: list[list[int]] = [[NO_MOVE, NO_MOVE] for _ in range(MAX_PLY)]
+        # history[code][end square], bumped by depth squared when a quiet move causes a cutoff
+        self.history: list[list[int]] = [[0] * 64 for _ in range(16)]
+        self.nodes: int = 0
+        self.node_limit: int = 0
+        self.deadline: float = 0
+        self.stopped: bool = False
+        self.next_check: int = CHECK_EVERY
+        self.path: list[int] = []
+        # set by parallel search: a multiprocessing.Event stopping all workers, and extra plies for helpers
+        self.stop_event = None
+        self.depth_offset: int = 0
+        # called with the SearchResult of every completed iteration
+        self.info = None
+
+    def stop(self) -> None:
+        # safe to call from another thread, the search notices at its next clock check
+        self.stopped = True
+
+    def clear(self) -> None:
+        self.table.clear()
+        self.history = [[0] * 64 for _ in range(16)]
+        self.killers = [[NO_MOVE, NO_MOVE] for _ in range(MAX_PLY)]
+
+    def evaluate(self) -> int:
+        return self.engine.evaluate()
+
+    def tablebase_score(self, ply: int) -> int | None:
+        # exact score when the tablebases cover the position, wins and losses as mate scores from the root
+        probe = self.engine.probe_tablebase()
+        if probe is None:
+            return None
+        return probe.wdl * (MATE - ply - probe.dtm) if probe.wdl else 0
+
+    def tablebase_result(self, start: float) -> SearchResult | None:
+        # at a covered root: the move keeping the best result, the quickest mate or the longest defence,
+        # with the line of such moves as the principal variation
+        engine = self.engine
+        root = self.tablebase_score(0)
+        if root is None:
+            return None
+        pv: list[int] = []
+        # a drawn line is only worth its first move
+        while len(pv) < (MAX_PLY if root else 1):
+            best_move, best_score = NO_MOVE, -INFINITY
+            for move in self.legal_moves():
+                engine.make_move(move)
+                score = self.tablebase_score(1)
+                engine.undo_move()
+                if score is None:
+                    best_move = NO_MOVE
+                    break
+                if -score > best_score:
+                    best_move, best_score = move, -score
+            if best_move == NO_MOVE:
+                break
+            pv.append(best_move)
+            engine.make_move(best_move)
+        for _ in pv:
+            engine.undo_move()
+        if not pv:
+            return None
+        elapsed = time.perf_counter() - start
+        return SearchResult(pv[0], root, pv, len(pv), self.nodes, elapsed, int(self.nodes / max(elapsed, 1e-9)))
+
+    def legal_moves(self) -> array:
+        # cached per position
+        return self.engine.valid_moves()
+
+    def order(self, moves: list[int], hash_move: int, ply: int) -> list[int]:
+        squares = self.engine.board.squares
+        killers = self.killers[ply]
+        history = self.history
+        scores: dict[int, int] = {}
+        for move in moves:
+            end = move >> 6 & 63
+            code = squares[move & 63]
+            if move == hash_move:
+                scores[move] = HASH_MOVE_SCORE
+            elif move >> 12 >= CAPTURE:
+                # MVV-LVA: most valuable victim first, cheapest attacker breaking ties
+                scores[move] = (CAPTURE_SCORE + PIECE_VALUES[squares[end] or PAWN] * 16
+                                + PIECE_VALUES[PROMOTION_PIECES[move >> 12]] - (code & TYPE_MASK))
+            elif move == killers[0] or move == killers[1]:
+                scores[move] = KILLER_SCORE
+            else:
+                scores[move] = history[code][end]
+        return sorted(moves, key=scores.__getitem__, reverse=True)
+
+    def staged_moves(self, hash_move: int, ply: int) -> Iterator[int]:
+        # the legal moves in search order, each stage generated only once the ones before it are used up:
+        # the hash move, captures that do not lose material and queen promotions by MVV-LVA, the killers,
+        # quiet moves by history, then losing captures and underpromotions
+        engine = self.engine
+        if hash_move and hash_move in engine.generate_moves(ALL_MOVES, hash_move & 63):
+            yield hash_move
+        losing: list[int] = []
+        for move in self.order(engine.generate_moves(TACTICAL_MOVES), NO_MOVE, ply):
+            if move == hash_move:
+                continue
+            if self.loses_material(move):
+                losing.append(move)
+            else:
+                yield move
+        killers = [killer for killer in self.killers[ply] if killer and killer != hash_move]
+        for killer in killers:
+            if killer in engine.generate_moves(QUIET_MOVES, killer & 63):
+                yield killer
+        squares = engine.board.squares
+        history = self.history
+        quiets = [move for move in engine.generate_moves(QUIET_MOVES) if move != hash_move and move not in killers]
+        quiets.sort(key=lambda move: history[squares[move & 63]][move >> 6 & 63], reverse=True)
+        yield from quiets
+        yield from losing
+
+    def loses_material(self, move: int) -> bool:
+        # by static exchange evaluation; taking a piece worth at least the capturer never loses, and
+        # underpromotions count as losing
+        flags = move >> 12
+        if flags & PROMOTION and PROMOTION_PIECES[flags] != QUEEN:
+            return True
+        squares = self.engine.board.squares
+        if flags >= CAPTURE and EXCHANGE_VALUES[squares[move >> 6 & 63]] >= EXCHANGE_VALUES[squares[move & 63]]:
+            return False
+        return self.engine.see(move) < 0
+
+    def checkup(self) -> None:
+        self.next_check = self.nodes + CHECK_EVERY
+        if self.stopped or self.node_limit and self.nodes >= self.node_limit or \
+                self.deadline and time.perf_counter() >= self.deadline or \
+                self.stop_event is not None and self.stop_event.is_set():
+            self.stopped = True
+            raise SearchStopped
+
+    def quiescence(self, alpha: int, beta: int, ply: int, checks: bool = True) -> int:
+        # captures that do not lose material by SEE, and with checks set quiet checks that do not either,
+        # answered with every evasion
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            self.checkup()
+        engine = self.engine
+        if engine.tablebases is not None and (score := self.tablebase_score(ply)) is not None:
+            return score
+        stand_pat = self.evaluate()
+        if stand_pat >= beta or ply >= MAX_PLY - 1:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+        for move in self.order(engine.generate_captures(), NO_MOVE, ply):
+            if self.loses_material(move):
+                continue
+            engine.make_move(move)
+            try:
+                score = -self.quiescence(-beta, -alpha, ply + 1, False)
+            finally:
+                engine.undo_move()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        if checks:
+            for move in engine.generate_checks():
+                if engine.see(move) < 0:
+                    continue
+                engine.make_move(move)
+                try:
+                    score = -self.evasions(-beta, -alpha, ply + 1)
+                finally:
+                    engine.undo_move()
+                if score >= beta:
+                    return score
+                alpha = max(alpha, score)
+        return alpha
+
+    def evasions(self, alpha: int, beta: int, ply: int) -> int:
+        # the reply to a quiescence check: no standing pat, every legal move is tried
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            self.checkup()
+        engine = self.engine
+        moves = self.legal_moves()
+        if not moves:
+            return -MATE + ply
+        best_score = -INFINITY
+        for move in self.order(moves, NO_MOVE, ply):
+            engine.make_move(move)
+            try:
+                score = -self.quiescence(-beta, -alpha, ply + 1, False)
+            finally:
+                engine.undo_move()
+            if score > best_score:
+                best_score = score
+                if score >= beta:
+                    return score
+                alpha = max(alpha, score)
+        return best_score
+
+    def negamax(self, depth: int, alpha: int, beta: int, ply: int) -> int:
+        if depth <= 0:
+            return self.quiescence(alpha, beta, ply)
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            self.checkup()
+        engine = self.engine
+        key = engine.hash_key
+        if ply and key in self.path:
+            return 0
+        if ply and engine.tablebases is not None and (score := self.tablebase_score(ply)) is not None:
+            return score
+        table = self.table
+        hash_move = NO_MOVE
+        entry = table.probe(key)
+        if entry:
+            # fields unpacked as laid out by TranspositionTable.pack
+            hash_move = entry >> 10 & 0xFFFF
+            if ply and entry >> 2 & 0xFF >= depth:
+                value = entry >> 26
+                # mate scores are stored relative to the node, not the root
+                if value > MATE_BOUND:
+                    value -= ply
+                elif value < -MATE_BOUND:
+                    value += ply
+                flag = entry & 3
+                if flag == table.EXACT or flag == table.LOWER and value >= beta or flag == table.UPPER and value <= alpha:
+                    return value
+
+        squares = engine.board.squares
+        original_alpha = alpha
+        best_score, best_move = -INFINITY, NO_MOVE
+        self.path.append(key)
+        try:
+            for move in self.staged_moves(hash_move, ply):
+                engine.make_move(move)
+                try:
+                    if best_move == NO_MOVE:
+                        score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+                    else:
+                        # principal variation search: prove the move is worse with a null window first
+                        score = -self.negamax(depth - 1, -alpha - 1, -alpha, ply + 1)
+                        if alpha < score < beta:
+                            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+                finally:
+                    engine.undo_move()
+                if score > best_score:
+                    best_score, best_move = score, move
+                    if score > alpha:
+                        alpha = score
+                        if alpha >= beta:
+                            if move >> 12 < CAPTURE:
+                                killers = self.killers[ply]
+                                if killers[0] != move:
+                                    killers[1], killers[0] = killers[0], move
+                                self.history[squares[move & 63]][move >> 6 & 63] += depth * depth
+                            break
+        finally:
+            self.path.pop()
+        if best_move == NO_MOVE:
+            return -MATE + ply if engine.in_check() else 0
+
+        if best_score >= beta:
+            flag = table.LOWER
+        elif best_score > original_alpha:
+            flag = table.EXACT
+        else:
+            flag = table.UPPER
+        stored = best_score + ply if best_score > MATE_BOUND else best_score - ply if best_score < -MATE_BOUND else best_score
+        table.store(key, depth, stored, flag, best_move)
+        return best_score
+
+    def principal_variation(self, depth: int) -> list[int]:
+        # walk hash moves from the root, checking each one is still legal in the position reached
+        engine = self.engine
+        pv: list[int] = []
+        seen: set[int] = set()
+        while len(pv) < depth and engine.hash_key not in seen:
+            seen.add(engine.hash_key)
+            move = self.table.probe(engine.hash_key) >> 10 & 0xFFFF
+            if not move:
+                break
+            if move not in self.legal_moves():
+                break
+            pv.append(move)
+            engine.make_move(move)
+        for _ in pv:
+            engine.undo_move()
+        return pv
+
+    def search(self, depth: int | None = None, movetime: float | None = None, nodes: int | None = None,
+               played: list[int] | None = None) -> SearchResult:
+        # movetime is in seconds; with no limit at all the search runs to depth 4. played are the hash keys of
+        # earlier game positions, a line returning to one scores as a draw; by default the engine's game_keys()
+        if depth is None and movetime is None and nodes is None:
+            depth = 4
+        start = time.perf_counter()
+        self.deadline = start + movetime if movetime else 0
+        self.node_limit = nodes or 0
+        self.nodes = 0
+        self.next_check = CHECK_EVERY
+        self.stopped = False
+        self.path = self.engine.game_keys() if played is None else list(played)
+        self.table.new_search()
+        self.killers = [[NO_MOVE, NO_MOVE] for _ in range(MAX_PLY)]
+        for row in self.history:
+            for end in range(64):
+                row[end] >>= 3
+
+        moves = self.legal_moves()
+        result = SearchResult(moves[0] if moves else NO_MOVE, 0, list(moves[:1]), 0, 0, 0.0, 0)
+        if not moves:
+            score = -MATE if self.engine.in_check() else 0
+            return result._replace(score=score)
+        if self.engine.tablebases is not None and (found := self.tablebase_result(start)) is not None:
+            if self.info:
+                self.info(found)
+            return found
+        score = 0
+        for current in range(1 + self.depth_offset, (depth or MAX_PLY - 8) + 1 + self.depth_offset):
+            try:
+                if current < 3:
+                    score = self.negamax(current, -INFINITY, INFINITY, 0)
+                else:
+                    # aspiration window around the last score, widened on the failing side until it holds
+                    lower, upper = ASPIRATION_WINDOW, ASPIRATION_WINDOW
+                    while True:
+                        alpha, beta = score - lower, score + upper
+                        value = self.negamax(current, alpha, beta, 0)
+                        if value <= alpha:
+                            lower *= 4
+                        elif value >= beta:
+                            upper *= 4
+                        else:
+                            score = value
+                            break
+                        if lower > 1000: lower = INFINITY
+                        if upper > 1000: upper = INFINITY
+            except SearchStopped:
+                break
+            elapsed = time.perf_counter() - start
+            pv = self.principal_variation(current) or result.pv
+            result = SearchResult(pv[0], score, pv, current, self.nodes, elapsed, int(self.nodes / max(elapsed, 1e-9)))
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('depth %d score %d nodes %d pv %s', current, score, self.nodes, ' '.join(map(move_name, pv)))
+            if self.info:
+                self.info(result)
+            if abs(score) > MATE_BOUND and MATE - abs(score) <= current:
+                break
+            if self.deadline and time.perf_counter() - start > movetime / 2:
+                # the next iteration would not finish in the time left
+                break
+        elapsed = time.perf_counter() - start
+        return result._replace(nodes=self.nodes, time=elapsed, nps=int(self.nodes / max(elapsed, 1e-9)))
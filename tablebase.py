@@ -0,0 +1,412 @@
+import argparse
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from itertools import combinations_with_replacement, product
+from typing import NamedTuple
+
+from utils import *
+from evaluation import MG_VALUES
+from fen import Position, parse_fen
+
+
+log = logging.getLogger('tablebase')
+
+
+"""
+Endgame tablebases for up to four pieces. A table holds one byte per position of one material set, white
+being the stronger side (colours are swapped to probe the other way round): 0 for a draw, otherwise 1 plus
+the distance to mate in plies, odd distances win for the side to move and even ones lose.
+Positions are indexed by the white king folded into a1-d1-d4 (a-d files when there are pawns, which only
+allow the left-right mirror), then the square of every other piece and the side to move.
+Tables are built by retrograde value iteration over the move graph the engine's own generator produces and
+read through an mmap. Castling rights and en passant captures are not part of the index: positions with
+either are not probed, and while building a double push is valued as if no en passant capture followed.
+The 50-move rule is ignored.
+"""
+MAX_PIECES = 4
+MAGIC = b'CETB'
+VERSION = 1
+HEADER = struct.Struct('<4sBB2x')
+EXTENSION = '.tb'
+# a win in d plies is stored as MATE_VALUE - d while building, a loss as d - MATE_VALUE
+MATE_VALUE = 1000
+MAX_DISTANCE = 254
+BUILD_BACKEND = 'bitboard'
+# white pieces besides the king, strongest first; a table name lists both sides in this order
+PIECE_ORDER = (QUEEN, ROOK, BISHOP, KNIGHT, PAWN)
+
+
+class Probe(NamedTuple):
+    # 1 the side to move wins, 0 draw, -1 it loses; dtm is the distance to mate in plies, 0 for draws
+    wdl: int
+    dtm: int
+
+
+DRAW = Probe(0, 0)
+
+
+def _transformed(square: int, mirror_file: bool, mirror_rank: bool, transpose: bool) -> int:
+    file, rank = square & 7, 7 - (square >> 3)
+    if mirror_file:
+        file = 7 - file
+    if mirror_rank:
+        rank = 7 - rank
+    if transpose:
+        file, rank = rank, file
+    return (7 - rank) << 3 | file
+
+
+def _king_transform(square: int, pawns: bool) -> tuple[int, ...]:
+    # the board symmetry bringing a white king on square into the indexed region
+    file, rank = square & 7, 7 - (square >> 3)
+    mirror_file = file > 3
+    if pawns:
+        return tuple(_transformed(other, mirror_file, False, False) for other in range(64))
+    file = 7 - file if mirror_file else file
+    mirror_rank = rank > 3
+    rank = 7 - rank if mirror_rank else rank
+    return tuple(_transformed(other, mirror_file, mirror_rank, rank > file) for other in range(64))
+
+
+# KING_TRANSFORMS[pawns][king square] maps every square, KING_SQUARES[pawns] lists the folded king squares
+KING_TRANSFORMS: list[list[tuple[int, ...]]] = [[_king_transform(square, pawns) for square in range(64)]
+                                                for pawns in (False, True)]
+KING_SQUARES: list[list[int]] = [sorted({transforms[square][square] for square in range(64)})
+                                 for transforms in KING_TRANSFORMS]
+
+
+def material_codes(name: str) -> list[int]:
+    # 'KQvKR' -> white king, queen, black king, rook
+    white, separator, black = name.partition('v')
+    if not separator or not white.startswith('K') or not black.startswith('K'):
+        raise ValueError(f'bad material name {name!r}')
+    try:
+        return [PIECE_CODES[letter] for letter in white] + [PIECE_CODES[letter.lower()] for letter in black]
+    except KeyError:
+        raise ValueError(f'bad material name {name!r}') from None
+
+
+def material_name(codes) -> tuple[str, bool]:
+    # canonical table name for a set of piece codes, and whether colours are swapped to read it
+    sides = [sorted((code & TYPE_MASK for code in codes if code >> 3 == color), reverse=True) for color in (0, 1)]
+    white, black = sides
+    swapped = (sum(MG_VALUES[code] for code in black), black) > (sum(MG_VALUES[code] for code in white), white)
+    if swapped:
+        white, black = black, white
+    return ''.join(PIECE_NAMES[code] for code in white) + 'v' + ''.join(PIECE_NAMES[code] for code in black), swapped
+
+
+def trivial_draw(codes) -> bool:
+    # bare kings, or a single knight or bishop beside them: no table needed
+    extra = [code & TYPE_MASK for code in codes if code & TYPE_MASK != KING]
+    return not extra or len(extra) == 1 and extra[0] in (KNIGHT, BISHOP)
+
+
+def materials(pieces: int = 3) -> list[str]:
+    # every non-trivial material set with at most this many pieces, smaller sets first
+    names = []
+    for count in range(3, pieces + 1):
+        for extra in combinations_with_replacement(PIECE_ORDER, count - 2):
+            for split in range(len(extra) + 1):
+                codes = [KING, *extra[:split], KING | BLACK_PIECE, *(code | BLACK_PIECE for code in extra[split:])]
+                name, _ = material_name(codes)
+                if not trivial_draw(codes) and name not in names:
+                    names.append(name)
+    return names
+
+
+def dependencies(name: str) -> list[str]:
+    # the tables a capture or promotion out of this material set leads into
+    codes = material_codes(name)
+    children = []
+    for index, code in enumerate(codes):
+        if code & TYPE_MASK == KING:
+            continue
+        rest = codes[:index] + codes[index + 1:]
+        children.append(rest)
+        if code & TYPE_MASK == PAWN:
+            children += [rest + [piece | code & BLACK_PIECE] for piece in PROMOTIONS]
+    names = []
+    for child in children:
+        child_name, _ = material_name(child)
+        if not trivial_draw(child) and child_name not in names:
+            names.append(child_name)
+    return names
+
+
+class Material:
+    def __init__(self, name: str) -> None:
+        self.codes: list[int] = material_codes(name)
+        self.name: str = material_name(self.codes)[0]
+        if self.name != name:
+            raise ValueError(f'{name} is not a canonical material name, use {self.name}')
+        if len(self.codes) > MAX_PIECES:
+            raise ValueError(f'{name} has more than {MAX_PIECES} pieces')
+        pawns = any(code & TYPE_MASK == PAWN for code in self.codes)
+        self.transforms = KING_TRANSFORMS[pawns]
+        self.king_squares: list[int] = KING_SQUARES[pawns]
+        self.king_index: list[int] = [self.king_squares.index(square) if square in self.king_squares else -1
+                                      for square in range(64)]
+        self.block: int = 64 ** (len(self.codes) - 1)
+        # positions per side to move
+        self.size: int = len(self.king_squares) * self.block
+        # (code, same code as the piece before) for finding the pieces on a board in index order
+        self.lookups: list[tuple[int, bool]] = [(code, index > 0 and code == self.codes[index - 1])
+                                                for index, code in enumerate(self.codes)]
+
+    def index(self, locations, side: int) -> int:
+        # locations are the squares of self.codes in order, the white king first
+        transform = self.transforms[locations[0]]
+        index = self.king_index[transform[locations[0]]]
+        for square in locations[1:]:
+            index = index * 64 + transform[square]
+        return side * self.size + index
+
+    def locations(self, squares: bytes | bytearray, swapped: bool) -> list[int]:
+        # squares of the pieces in index order, read with colours swapped and the board flipped when asked
+        flip, mirror = (BLACK_PIECE, 56) if swapped else (0, 0)
+        result = []
+        found = -1
+        for code, repeat in self.lookups:
+            found = squares.find(code ^ flip, found + 1 if repeat else 0)
+            result.append(found ^ mirror)
+        return result
+
+
+class Table:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.material = Material(os.path.basename(path).removesuffix(EXTENSION))
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, pieces = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION or pieces != len(self.material.codes) or \
+                len(self.data) != HEADER.size + 2 * self.material.size:
+            self.close()
+            raise ValueError(f'{path} is not a version {VERSION} tablebase of {self.material.name}')
+
+    def probe(self, squares: bytes | bytearray, side: int, swapped: bool) -> Probe:
+        material = self.material
+        value = self.data[HEADER.size + material.index(material.locations(squares, swapped), side ^ swapped)]
+        if not value:
+            return DRAW
+        return Probe(1 if value & 1 == 0 else -1, value - 1)
+
+    def close(self) -> None:
+        self.data.close()
+        self.file.close()
+
+
+class Tablebases:
+    # every table file in a directory, looked up by the sorted piece codes of a position
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.tables: dict[str, Table] = {}
+        # sorted piece codes -> (table or None for a trivial draw, colours swapped)
+        self.materials: dict[bytes, tuple[Table | None, bool]] = {}
+        for codes in ([KING], [KING, KNIGHT], [KING, BISHOP]):
+            for swapped in (False, True):
+                key = bytes(sorted([*(code | swapped << 3 for code in codes), KING | (not swapped) << 3]))
+                self.materials[key] = (None, swapped)
+        self.max_pieces: int = 2
+        for entry in sorted(os.listdir(directory)):
+            if entry.endswith(EXTENSION):
+                self.load(os.path.join(directory, entry))
+
+    def load(self, path: str) -> Table:
+        table = Table(path)
+        if table.material.name in self.tables:
+            self.tables[table.material.name].close()
+        self.tables[table.material.name] = table
+        codes = table.material.codes
+        self.materials[bytes(sorted(code ^ BLACK_PIECE for code in codes))] = (table, True)
+        self.materials[bytes(sorted(codes))] = (table, False)
+        self.max_pieces = max(self.max_pieces, len(codes))
+        return table
+
+    def probe(self, squares: bytes | bytearray, side: int) -> Probe | None:
+        # None when the material is not covered
+        if squares.count(EMPTY) < 64 - self.max_pieces:
+            return None
+        found = self.materials.get(bytes(sorted(squares.translate(None, b'\0'))))
+        if found is None:
+            return None
+        table, swapped = found
+        return table.probe(squares, side, swapped) if table is not None else DRAW
+
+    def close(self) -> None:
+        for table in self.tables.values():
+            table.close()
+        self.tables.clear()
+
+
+def _value(probe: Probe) -> int:
+    return probe.wdl * (MATE_VALUE - probe.dtm)
+
+
+def build(name: str, tablebases: Tablebases, backend: str = BUILD_BACKEND) -> Table:
+    # writes name.tb into the tablebases' directory and loads it; the tables captures and promotions
+    # lead into must be loaded already
+    import numpy as np
+    from chess_engine import new_engine
+    material = Material(name)
+    for dependency in dependencies(name):
+        if dependency not in tablebases.tables:
+            raise ValueError(f'{name} needs the {dependency} table first')
+    codes = material.codes
+    count = len(codes)
+    pawns = [index for index, code in enumerate(codes) if code & TYPE_MASK == PAWN]
+    size = material.size
+    engine = new_engine(backend=backend)
+
+    # the move graph: targets[offsets[i]:offsets[i + 1]] are the positions reached from position i, positions
+    # outside this table (after a capture or promotion) point past the end at a slot holding their value
+    targets = [array('i'), array('i')]
+    offsets = [array('q', [0]), array('q', [0])]
+    values = [array('i', bytes(4 * size)), array('i', bytes(4 * size))]
+    outside: dict[int, int] = {}
+    legal = 0
+    start_time = time.perf_counter()
+    index = 0
+    for king in material.king_squares:
+        for rest in product(range(64), repeat=count - 1):
+            locations = (king, *rest)
+            found: list[tuple[array, bool] | None] = [None, None]
+            if len(set(locations)) == count and all(0 < locations[pawn] >> 3 < 7 for pawn in pawns):
+                squares = bytearray(64)
+                for code, square in zip(codes, locations):
+                    squares[square] = code
+                squares = bytes(squares)
+                for side in (0, 1):
+                    engine.set_position(Position(squares, side, 0, OFF_BOARD, 0, 1))
+                    found[side] = array('H', engine.valid_moves()), engine.in_check()
+            for side in (0, 1):
+                side_targets = targets[side]
+                # illegal when the side not to move is in check
+                if found[side] is not None and not found[side ^ 1][1]:
+                    legal += 1
+                    moves, check = found[side]
+                    if not moves and check:
+                        values[side][index] = -MATE_VALUE
+                    for move in moves:
+                        start, end, flags = move & 63, move >> 6 & 63, move >> 12
+                        if flags >= CAPTURE:
+                            child = bytearray(squares)
+                            piece = child[start]
+                            child[start] = EMPTY
+                            child[end] = PROMOTION_PIECES[flags] | piece & BLACK_PIECE if flags & PROMOTION else piece
+                            value = _value(tablebases.probe(child, side ^ 1))
+                            side_targets.append(outside.setdefault(value, 2 * size + len(outside)))
+                        else:
+                            child_locations = list(locations)
+                            child_locations[locations.index(start)] = end
+                            side_targets.append(material.index(child_locations, side ^ 1))
+                offsets[side].append(len(side_targets))
+            index += 1
+        log.debug('%s: king on %s done', name, SQUARE_NAMES[king])
+
+    graph = np.concatenate([np.frombuffer(targets[0], np.int32), np.frombuffer(targets[1], np.int32)])
+    ends = np.concatenate([np.frombuffer(offsets[0], np.int64)[1:],
+                           np.frombuffer(offsets[1], np.int64)[1:] + len(targets[0])])
+    del targets
+    starts = np.concatenate([[0], ends[:-1]])
+    movable = ends > starts
+    first = starts[movable]
+    current = np.concatenate([np.frombuffer(values[0], np.int32), np.frombuffer(values[1], np.int32),
+                              np.array(list(outside), np.int32)])
+    del values
+    # value iteration from all draws: after pass d every result within d plies of mate is known and final
+    passes = 0
+    while True:
+        passes += 1
+        reached = -current[graph]
+        reached -= np.sign(reached, dtype=np.int32)
+        best = np.maximum.reduceat(reached, first)
+        changed = np.flatnonzero(current[:2 * size][movable] != best)
+        if not len(changed):
+            break
+        current[np.flatnonzero(movable)[changed]] = best[changed]
+    result = current[:2 * size]
+    distance = MATE_VALUE - np.abs(result)
+    if distance[result != 0].max(initial=0) > MAX_DISTANCE:
+        raise ValueError(f'{name}: distance to mate does not fit a byte')
+    encoded = np.where(result != 0, distance + 1, 0).astype(np.uint8)
+
+    path = os.path.join(tablebases.directory, name + EXTENSION)
+    with open(path + '.part', 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, count))
+        file.write(encoded.tobytes())
+    os.replace(path + '.part', path)
+    wins = int(np.count_nonzero(result[:size] > 0))
+    longest = int(distance[result != 0].max(initial=0))
+    log.info('%s: %d legal positions, %d white to move wins, longest mate %d plies, %d passes, %.1fs',
+             name, legal, wins, longest, passes, time.perf_counter() - start_time)
+    return tablebases.load(path)
+
+
+def build_all(names: list[str], tablebases: Tablebases, backend: str = BUILD_BACKEND, force: bool = False) -> list[str]:
+    # builds the named tables and whatever they depend on, smallest first; returns the names built
+    built = []
+
+    def visit(name: str) -> None:
+        for dependency in dependencies(name):
+            visit(dependency)
+        if name not in built and (force or name not in tablebases.tables):
+            build(name, tablebases, backend)
+            built.append(name)
+
+    for name in names:
+        visit(name)
+    return built
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Build or probe endgame tablebases')
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate = commands.add_parser('build', help='build tables and the tables they depend on')
+    generate.add_argument('materials', nargs='*', help='e.g. KQvK KBNvK; every 3 piece set when absent')
+    generate.add_argument('-d', '--directory', default='tablebases')
+    generate.add_argument('-p', '--pieces', type=int, choices=(3, 4), help='every set with up to this many pieces')
+    generate.add_argument('-b', '--backend', choices=('object', 'bitboard'), default=BUILD_BACKEND)
+    generate.add_argument('-f', '--force', action='store_true', help='rebuild tables that exist')
+    probe = commands.add_parser('probe', help='look a position up')
+    probe.add_argument('fen')
+    probe.add_argument('-d', '--directory', default='tablebases')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.command == 'build':
+        os.makedirs(args.directory, exist_ok=True)
+        names = args.materials or materials(args.pieces or 3)
+        tablebases = Tablebases(args.directory)
+        try:
+            built = build_all(names, tablebases, args.backend, args.force)
+        finally:
+            tablebases.close()
+        print(f'{len(built)} tables built in {args.directory}')
+        return 0
+    try:
+        position = parse_fen(args.fen)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    tablebases = Tablebases(args.directory)
+    found = tablebases.probe(position.squares, position.side) \
+        if not position.castling_rights and position.en_passant_square == OFF_BOARD else None
+    tablebases.close()
+    if found is None:
+        print('not covered')
+    elif not found.wdl:
+        print('draw')
+    else:
+        print(f'{"win" if found.wdl > 0 else "loss"}, mate in {(found.dtm + 1) // 2} ({found.dtm} plies)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
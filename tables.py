@@ -0,0 +1,99 @@
+"""
+Attack and ray tables built once at import. Squares use the Board.squares numbering (a8 is 0, h1 is 63).
+Target tables are lists of squares for iteration, the *_MASK tables are the same sets as 64-bit masks
+(bit n set for square n) for O(1) membership tests.
+"""
+
+OFF_BOARD = -1
+FULL = (1 << 64) - 1
+# 10x12 mailbox: stepping an offset from MAILBOX64[square] lands on OFF_BOARD when it leaves the board
+MAILBOX: list[int] = [(row - 2) * 8 + column - 1 if 2 <= row <= 9 and 1 <= column <= 8 else OFF_BOARD
+                      for row in range(12) for column in range(10)]
+MAILBOX64: list[int] = [((square >> 3) + 2) * 10 + (square & 7) + 1 for square in range(64)]
+
+# the first four directions are diagonal, direction ^ 1 is the opposite direction
+NORTH_EAST, SOUTH_WEST, NORTH_WEST, SOUTH_EAST, NORTH, SOUTH, EAST, WEST = range(8)
+# mailbox offset of one step in each direction
+DIRECTION_OFFSETS: tuple[int, ...] = (-9, 9, -11, 11, -10, 10, 1, -1)
+# change of the 0..63 square index for one step in each direction
+DIRECTION_STEPS: tuple[int, ...] = (-7, 7, -9, 9, -8, 8, 1, -1)
+KNIGHT_OFFSETS: tuple[int, ...] = (21, 19, -12, -8, -19, -21, 8, 12)
+KING_OFFSETS: tuple[int, ...] = DIRECTION_OFFSETS
+
+
+def _targets(square: int, offsets: tuple[int, ...]) -> list[int]:
+    return [end for offset in offsets if (end := MAILBOX[MAILBOX64[square] + offset]) != OFF_BOARD]
+
+
+def _ray(square: int, offset: int) -> list[int]:
+    ray = []
+    target = MAILBOX64[square] + offset
+    while (end := MAILBOX[target]) != OFF_BOARD:
+        ray.append(end)
+        target += offset
+    return ray
+
+
+def _mask(squares: list[int]) -> int:
+    mask = 0
+    for square in squares:
+        mask |= 1 << square
+    return mask
+
+
+KNIGHT_TARGETS: list[list[int]] = [_targets(square, KNIGHT_OFFSETS) for square in range(64)]
+KING_TARGETS: list[list[int]] = [_targets(square, KING_OFFSETS) for square in range(64)]
+# RAYS[square][direction] lists the squares moving away from square, nearest first
+RAYS: list[list[list[int]]] = [[_ray(square, offset) for offset in DIRECTION_OFFSETS] for square in range(64)]
+# slider rays per square with the empty ones dropped
+BISHOP_RAYS: list[list[list[int]]] = [[ray for ray in RAYS[square][:4] if ray] for square in range(64)]
+ROOK_RAYS: list[list[list[int]]] = [[ray for ray in RAYS[square][4:] if ray] for square in range(64)]
+QUEEN_RAYS: list[list[list[int]]] = [BISHOP_RAYS[square] + ROOK_RAYS[square] for square in range(64)]
+
+
+def _slice(ray: list[int], step: int) -> slice:
+    return slice(ray[0], ray[-1] + step if ray[-1] + step >= 0 else None, step)
+
+
+# the same non-empty rays as slices of a 64 byte board, so a ray's codes are read in one step, nearest first
+BISHOP_SLICES: list[list[slice]] = [[_slice(ray, DIRECTION_STEPS[direction]) for direction, ray
+                                     in enumerate(RAYS[square][:4]) if ray] for square in range(64)]
+ROOK_SLICES: list[list[slice]] = [[_slice(ray, DIRECTION_STEPS[direction + 4]) for direction, ray
+                                   in enumerate(RAYS[square][4:]) if ray] for square in range(64)]
+
+# pawn tables are indexed [side][square], side 0 for white and 1 for black
+PAWN_PUSHES: list[list[list[int]]] = [
+    [[] if not 0 < square >> 3 < 7 else [square - 8, square - 16] if square >> 3 == 6 else [square - 8]
+     for square in range(64)],
+    [[] if not 0 < square >> 3 < 7 else [square + 8, square + 16] if square >> 3 == 1 else [square + 8]
+     for square in range(64)],
+]
+PAWN_CAPTURES: list[list[list[int]]] = [[_targets(square, (-11, -9)) for square in range(64)],
+                                        [_targets(square, (9, 11)) for square in range(64)]]
+
+KNIGHT_MASKS: list[int] = [_mask(targets) for targets in KNIGHT_TARGETS]
+KING_MASKS: list[int] = [_mask(targets) for targets in KING_TARGETS]
+PAWN_CAPTURE_MASKS: list[list[int]] = [[_mask(targets) for targets in side] for side in PAWN_CAPTURES]
+# RAY_MASKS[direction][square]
+RAY_MASKS: list[list[int]] = [[_mask(RAYS[square][direction]) for square in range(64)] for direction in range(8)]
+BISHOP_MASKS: list[int] = [_mask(sum(RAYS[square][:4], [])) for square in range(64)]
+ROOK_MASKS: list[int] = [_mask(sum(RAYS[square][4:], [])) for square in range(64)]
+# REACH_MASKS[piece type][square]: where the piece attacks on an empty board, everywhere for pawns and no piece
+REACH_MASKS: list[list[int]] = [[FULL] * 64, [FULL] * 64, KNIGHT_MASKS, BISHOP_MASKS, ROOK_MASKS,
+                                [BISHOP_MASKS[square] | ROOK_MASKS[square] for square in range(64)], KING_MASKS]
+
+
+def _direction(a: int, b: int) -> int:
+    for direction in range(8):
+        if b in RAYS[a][direction]:
+            return direction
+    return OFF_BOARD
+
+
+# DIRECTION[a][b] is the direction from a towards b, OFF_BOARD when they share no line
+DIRECTION: list[list[int]] = [[_direction(a, b) for b in range(64)] for a in range(64)]
+# squares strictly between a and b, and the whole line through both, as masks; 0 when not aligned
+BETWEEN: list[list[int]] = [[_mask(RAYS[a][d][:RAYS[a][d].index(b)]) if (d := DIRECTION[a][b]) != OFF_BOARD else 0
+                             for b in range(64)] for a in range(64)]
+LINE: list[list[int]] = [[_mask(RAYS[a][d] + RAYS[a][d ^ 1] + [a]) if (d := DIRECTION[a][b]) != OFF_BOARD else 0
+                          for b in range(64)] for a in range(64)]
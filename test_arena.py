@@ -0,0 +1,23 @@
+import math
+
+import pytest
+
+from arena import elo
+
+
+@pytest.mark.parametrize('games', [1, 10, 1000])
+def test_clean_sweep_keeps_a_finite_margin(games):
+    difference, margin = elo(games, 0, 0)
+    assert 0 < difference < math.inf and 0 < margin < math.inf
+    assert elo(0, 0, games) == pytest.approx((-difference, margin))
+    _, drawn_margin = elo(0, games, 0)
+    assert 0 < drawn_margin < math.inf
+
+
+def test_margin_narrows_with_games():
+    margins = [elo(6 * games, 2 * games, 2 * games)[1] for games in (1, 10, 100)]
+    assert margins == sorted(margins, reverse=True)
+    difference, margin = elo(600, 200, 200)
+    assert difference == pytest.approx(-400 * math.log10(1 / 0.7 - 1))
+    # close to the normal approximation once there are many games
+    assert margin == pytest.approx(20.5, abs=0.2)
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from chess_engine import ChessEngine, new_engine, piece_attacks
+from perft import POSITIONS
+from utils import square_attacked
+
+
+def rebuilt(engine: ChessEngine, side: int) -> tuple[dict[int, int], int]:
+    # per piece attack masks of side and their union, recomputed from the board
+    squares = engine.board.squares
+    occupied = sum(1 << square for square in range(64) if squares[square])
+    masks = {square: piece_attacks(code, square, occupied) for square, code in enumerate(squares)
+             if code and code >> 3 == side}
+    return masks, sum(1 << square for square in range(64) if square_attacked(squares, square, side))
+
+
+def check(engine: ChessEngine) -> None:
+    attacked = []
+    for side in (0, 1):
+        masks, union = rebuilt(engine, side)
+        assert engine.attack_map(side) == union
+        assert engine.attacks[side] == masks
+        attacked.append(union)
+    side = engine.move & 1
+    king = engine.black_king if side else engine.white_king
+    assert engine.in_check() == bool(attacked[side ^ 1] >> king & 1)
+
+
+@pytest.mark.parametrize('position', POSITIONS, ids=[position.name for position in POSITIONS])
+def test_attack_maps_after_random_walks(position):
+    engine = ChessEngine(position.fen)
+    generator = random.Random(position.name)
+    for _ in range(6):
+        plies = 0
+        # forward with checks after every move, then back with checks after every undo
+        for _ in range(30):
+            check(engine)
+            moves = engine.valid_moves()
+            if not moves:
+                break
+            engine.make_move(generator.choice(moves))
+            plies += 1
+        for _ in range(generator.randrange(plies + 1)):
+            engine.undo_move()
+            check(engine)
+    check(engine)
+
+
+def test_attack_maps_skipping_queries():
+    # several moves made and taken back between queries leave several moves' squares stale at once
+    engine = ChessEngine(POSITIONS[1].fen)
+    generator = random.Random(11)
+    for step in range(400):
+        moves = engine.valid_moves()
+        if not moves or len(engine.history) > 40:
+            for _ in range(generator.randrange(len(engine.history) + 1)):
+                engine.undo_move()
+        else:
+            engine.make_move(generator.choice(moves))
+        if step % 3 == 0:
+            check(engine)
+
+
+def test_backends_attack_alike():
+    engines = [new_engine(POSITIONS[5].fen, backend=backend) for backend in ('object', 'bitboard')]
+    generator = random.Random(5)
+    for _ in range(300):
+        for side in (0, 1):
+            assert engines[0].attack_map(side) == engines[1].attack_map(side)
+        moves = engines[0].valid_moves()
+        if not moves:
+            break
+        move = generator.choice(moves)
+        for engine in engines:
+            engine.make_move(move)
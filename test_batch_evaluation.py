@@ -0,0 +1,30 @@
+import random
+
+import pytest
+
+from chess_engine import new_engine
+from evaluation import evaluate_position
+from perft import POSITIONS
+
+np = pytest.importorskip('numpy')
+from batch_evaluation import encode, evaluate_batch, planes
+
+
+@pytest.mark.parametrize('position', POSITIONS[:6], ids=[position.name for position in POSITIONS[:6]])
+def test_batch_matches_evaluate_position(position):
+    engine = new_engine(position.fen)
+    generator = random.Random(7)
+    seen = []
+    for _ in range(80):
+        seen.append(bytes(engine.board.squares))
+        moves = engine.valid_moves()
+        if not moves:
+            break
+        engine.make_move(generator.choice(moves))
+    for squares, batched in zip(seen, evaluate_batch(encode(seen))):
+        assert batched == evaluate_position(bytearray(squares))
+
+
+def test_batch_planes_match_codes():
+    codes = encode(position.fen.split()[0] for position in POSITIONS)
+    assert (evaluate_batch(planes(codes)) == evaluate_batch(codes)).all()
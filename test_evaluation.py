@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from chess_engine import new_engine
+from fen import Position
+from evaluation import MOBILITY_WEIGHT, evaluate_squares, pawn_structure, taper
+from perft import POSITIONS
+from utils import BLACK_PIECE, BLACK_LONG, BLACK_SHORT, OFF_BOARD, WHITE_LONG, WHITE_SHORT, square_attacked
+
+
+@pytest.mark.parametrize('backend', ['object', 'bitboard'])
+@pytest.mark.parametrize('position', POSITIONS[:6], ids=[position.name for position in POSITIONS[:6]])
+def test_evaluate_matches_full(position, backend):
+    # along a seeded random game the incremental sums match a full recompute and evaluate() matches
+    # a score built from them and mobility counted by scanning every square for attacks from both sides
+    engine = new_engine(position.fen, backend=backend)
+    generator = random.Random(7)
+    for _ in range(80):
+        assert (engine.mg_score, engine.eg_score, engine.phase) == evaluate_squares(engine.board.squares)
+        side = engine.move & 1
+        mobility = sum(square_attacked(engine.board.squares, square, side)
+                       - square_attacked(engine.board.squares, square, side ^ 1) for square in range(64))
+        static = taper(engine.mg_score, engine.eg_score, engine.phase) + pawn_structure(engine.board.squares)
+        assert engine.evaluate() == (-static if side else static) + MOBILITY_WEIGHT * mobility
+        moves = engine.valid_moves()
+        if not moves:
+            break
+        engine.make_move(generator.choice(moves))
+
+
+def test_backends_evaluate_alike():
+    generator = random.Random(3)
+    engines = [new_engine(POSITIONS[1].fen, backend=backend) for backend in ('object', 'bitboard')]
+    for _ in range(200):
+        assert engines[0].evaluate() == engines[1].evaluate()
+        moves = engines[0].valid_moves()
+        if not moves:
+            break
+        move = generator.choice(moves)
+        for engine in engines:
+            engine.make_move(move)
+
+
+def flipped(position: Position) -> Position:
+    # the position with the board mirrored top to bottom and the colours swapped, the side to move kept
+    squares = bytes(code ^ BLACK_PIECE if code else 0 for code in
+                    (position.squares[square ^ 56] for square in range(64)))
+    rights = position.castling_rights
+    castling = (rights & (WHITE_SHORT | WHITE_LONG)) << 2 | (rights & (BLACK_SHORT | BLACK_LONG)) >> 2
+    return position._replace(squares=squares, castling_rights=castling, en_passant_square=OFF_BOARD)
+
+
+@pytest.mark.parametrize('backend', ['object', 'bitboard'])
+def test_colour_flip_negates(backend):
+    # with the colours swapped the same side to move stands as well as its opponent did, and handing the move
+    # over without moving, as a null move does, negates the score too
+    generator = random.Random(5)
+    engine = new_engine(POSITIONS[1].fen, backend=backend)
+    other = new_engine(backend=backend)
+    for _ in range(60):
+        position = engine.position()._replace(en_passant_square=OFF_BOARD)
+        other.set_position(position)
+        score = other.evaluate()
+        other.set_position(flipped(position))
+        assert other.evaluate() == -score
+        other.set_position(position._replace(side=position.side ^ 1))
+        assert other.evaluate() == -score
+        moves = engine.valid_moves()
+        if not moves:
+            break
+        engine.make_move(generator.choice(moves))
@@ -0,0 +1,46 @@
+import random
+
+import pytest
+
+from chess_engine import new_engine
+from fen import format_epd, format_fen, parse_epd, parse_fen
+from perft import POSITIONS
+
+
+@pytest.mark.parametrize('backend', ['object', 'bitboard'])
+def test_fen_round_trip(backend):
+    for position in POSITIONS:
+        assert format_fen(parse_fen(position.fen)) == position.fen
+        engine = new_engine(position.fen, backend=backend)
+        generator = random.Random(position.name)
+        for _ in range(40):
+            fen = engine.to_fen()
+            assert new_engine(fen, backend=backend).to_fen() == fen
+            assert format_fen(parse_fen(fen)) == fen
+            moves = engine.valid_moves()
+            if not moves:
+                break
+            engine.make_move(generator.choice(moves))
+
+
+def test_epd_round_trip():
+    line = 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - bm e5f7; id "kiwi pete";'
+    position, operations = parse_epd(line)
+    assert operations == {'bm': 'e5f7', 'id': 'kiwi pete'}
+    assert format_epd(position, operations) == line
+
+
+@pytest.mark.parametrize('fen', [
+    '8/8/8/8/8/8/8/8 w - - 0 1',
+    'k7/8/8/8/8/8/8/KK6 w - - 0 1',
+    'k7/1Q6/8/8/8/8/8/K7 w - - 0 1',
+    'k7/8/8/8/8/8/8/K7 w - - 0 0',
+    'kP6/8/8/8/8/8/8/K7 w - - 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq - 0 1',
+])
+def test_bad_fen(fen):
+    with pytest.raises(ValueError):
+        parse_fen(fen)
+    for backend in ('object', 'bitboard'):
+        with pytest.raises(ValueError):
+            new_engine(fen, backend=backend)
@@ -0,0 +1,32 @@
+import pytest
+
+from chess_engine import new_engine
+from perft import POSITIONS, perft
+
+# the deepest reference count at most this large is checked for each position
+MAX_NODES = 100000
+
+
+@pytest.mark.parametrize('backend', ['object', 'bitboard'])
+@pytest.mark.parametrize('position', POSITIONS, ids=[position.name for position in POSITIONS])
+def test_perft(position, backend):
+    engine = new_engine(position.fen, backend=backend)
+    for depth, nodes in enumerate(position.nodes, 1):
+        if nodes > MAX_NODES and depth > 1:
+            break
+        assert perft(engine, depth) == nodes, f'depth {depth}'
+    assert engine.to_fen() == position.fen
+
+
+def test_backends_agree_on_moves():
+    for position in POSITIONS:
+        engines = [new_engine(position.fen, backend=backend) for backend in ('object', 'bitboard')]
+        moves = [sorted(engine.valid_moves()) for engine in engines]
+        assert moves[0] == moves[1], position.name
+
+
+@pytest.mark.parametrize('backend', ['object', 'bitboard'])
+def test_most_moves(backend):
+    # the position with the most legal moves known fills the move buffer furthest
+    engine = new_engine('R6R/3Q4/1Q4Q1/4Q3/2Q4Q/Q4Q2/pp1Q4/kBNN1KB1 w - - 0 1', backend=backend)
+    assert len(engine.valid_moves()) == 218
@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+from chess_engine import new_engine
+from fen import START_FEN
+from perft import POSITIONS
+from pgn import format_game, move_san, read_games, replay, summarize_games
+
+
+def random_game(fen: str, plies: int, seed: int, backend: str = 'object') -> tuple[list[str], list[int], str]:
+    # SANs and packed moves of a seeded random game from fen, and the FEN it ends in
+    engine = new_engine(fen, backend=backend)
+    generator = random.Random(seed)
+    sans, moves = [], []
+    for _ in range(plies):
+        legal = engine.valid_moves()
+        if not legal:
+            break
+        move = generator.choice(legal)
+        sans.append(move_san(engine, move))
+        moves.append(move)
+        engine.make_move(move)
+    return sans, moves, engine.to_fen()
+
+
+@pytest.mark.parametrize('backend', ['object', 'bitboard'])
+@pytest.mark.parametrize('fen', [START_FEN, POSITIONS[1].fen, POSITIONS[4].fen, '4k3/8/8/8/8/8/8/R3K2R b K - 3 40'])
+def test_pgn_round_trip(fen, backend):
+    for seed in range(4):
+        sans, moves, final_fen = random_game(fen, 120, seed, backend)
+        engine = new_engine(fen, backend=backend)
+        first_ply = engine.move
+        headers = {'Event': 'test'} | ({} if fen == START_FEN else {'SetUp': '1', 'FEN': fen})
+        text = format_game(headers, sans, '*', first_ply)
+        [game] = list(read_games(text.splitlines(keepends=True)))
+        assert game.moves == sans
+        assert game.headers['Event'] == 'test'
+        assert [record.move for record in replay(game, engine)] == moves
+        assert engine.to_fen() == final_fen
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_bad_setup_fails_alone(jobs):
+    # a game whose FEN header does not load is reported failed, not with the previous game's final position
+    good = format_game({'Event': 'good'}, ['e4', 'e5'], '*')
+    bad = format_game({'Event': 'bad', 'SetUp': '1', 'FEN': 'k7/8/8/8/8/8/8/KK6 w - - 0 1'}, ['Kb2'], '*')
+    text = good + '\n' + bad + '\n' + good
+    summaries = list(summarize_games(read_games(text.splitlines(keepends=True)), jobs, 'bitboard'))
+    assert [summary.error is None for summary in summaries] == [True, False, True]
+    assert summaries[1].plies == 0 and summaries[1].final_fen == ''
+    assert summaries[2].final_fen == summaries[0].final_fen
@@ -0,0 +1,34 @@
+import pytest
+
+from chess_engine import new_engine
+from utils import move_name
+
+# (FEN, move, static exchange value with EXCHANGE_VALUES: pawn 100, knight and bishop 300, rook 500, queen 900)
+EXCHANGES = [
+    # nothing recaptures
+    ('1k1r4/1pp4p/p7/4p3/8/P5P1/1PP4P/2K1R3 w - - 0 1', 'e1e5', 100),
+    # knight for a pawn
+    ('1k1r3q/1ppn3p/p4b2/4p3/8/P2N2P1/1PP1R1BP/2K1Q3 w - - 0 1', 'd3e5', -200),
+    ('4k3/8/5n2/3p4/8/8/8/3QK3 w - - 0 1', 'd1d5', -800),
+    # x-rays: the piece behind the capturer joins in once it has gone
+    ('4k3/4r3/8/4p3/8/8/4R3/4R1K1 w - - 0 1', 'e2e5', 100),
+    ('4k3/8/2b5/3p4/4B3/5Q2/8/4K3 w - - 0 1', 'e4d5', 100),
+    ('4k3/8/2b5/3p4/4B3/8/8/4K3 w - - 0 1', 'e4d5', -200),
+    # a slider behind the capture's own line uncovered by the capturer
+    ('3rk3/8/8/3p4/8/3R4/3Q4/4K3 w - - 0 1', 'd3d5', 100),
+    ('3rk3/3r4/8/3p4/8/3R4/8/4K3 w - - 0 1', 'd3d5', -400),
+    # en passant and promotion
+    ('4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1', 'e5d6', 100),
+    ('4k3/P7/8/8/8/8/8/4K3 w - - 0 1', 'a7a8q', 800),
+    ('r3k3/1P6/8/8/8/8/8/4K3 w - - 0 1', 'b7a8q', 1300),
+    ('1r2k3/P7/8/8/8/8/8/4K3 w - - 0 1', 'a7a8q', -100),
+]
+
+
+@pytest.mark.parametrize('backend', ['object', 'bitboard'])
+@pytest.mark.parametrize('fen, name, value', EXCHANGES)
+def test_see(fen, name, value, backend):
+    engine = new_engine(fen, backend=backend)
+    moves = {move_name(move): move for move in engine.valid_moves()}
+    assert engine.see(moves[name]) == value
+    assert engine.to_fen() == fen
@@ -0,0 +1,24 @@
+from transposition import TranspositionTable
+
+
+def test_store_and_probe():
+    table = TranspositionTable(1)
+    key = 0x1234_5678_9ABC_DEF0
+    table.store(key, 7, -31000, TranspositionTable.LOWER, 0x1FFF)
+    entry = table.probe(key)
+    assert (entry >> 26, entry >> 10 & 0xFFFF, entry >> 2 & 0xFF, entry & 3) == (-31000, 0x1FFF, 7, table.LOWER)
+    assert table.probe(key ^ 1 << 40) == 0
+
+
+def test_torn_entry_misses():
+    # the key of one write with the data of another, as when two workers store into a slot at once
+    table = TranspositionTable(1)
+    first, second = 0x1000_0000_0000_0000, 0x2000_0000_0000_0000
+    table.store(first, 5, 120, TranspositionTable.EXACT)
+    index = (first & table.mask) << 1
+    key_column = table.keys[index]
+    table.store(second, 9, -40, TranspositionTable.UPPER)
+    assert table.probe(second)
+    table.keys[index] = key_column
+    assert table.probe(first) == 0
+    assert table.probe(second) == 0
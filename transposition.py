@@ -0,0 +1,131 @@
+import random
+from array import array
+import logging
+
+from utils import *
+
+
+log = logging.getLogger('transposition')
+
+
+"""
+Zobrist keys. The generator is seeded so every process, including pool workers, derives the same keys.
+Keys for the empty piece code are 0, so xoring a captured EMPTY square is a no-op.
+"""
+_random = random.Random(0x5EED_C4E55)
+PIECE_KEYS: list[list[int]] = [[0] * 64 if name == '-' else [_random.getrandbits(64) for _ in range(64)]
+                               for name in PIECE_NAMES]
+SIDE_KEY: int = _random.getrandbits(64)
+_CASTLING_RIGHT_KEYS = [_random.getrandbits(64) for _ in range(4)]
+# CASTLING_KEYS[rights] for the 4 bit castling_rights mask
+CASTLING_KEYS: list[int] = [0] * 16
+for _rights in range(16):
+    for _bit in range(4):
+        if _rights >> _bit & 1:
+            CASTLING_KEYS[_rights] ^= _CASTLING_RIGHT_KEYS[_bit]
+_FILE_KEYS = [_random.getrandbits(64) for _ in range(8)]
+# EN_PASSANT_KEYS[square] hashes the file of the en passant square, the extra last entry makes OFF_BOARD (-1) hash to 0
+EN_PASSANT_KEYS: list[int] = [_FILE_KEYS[square & 7] for square in range(64)] + [0]
+
+
+def hash_position(squares: bytearray, black_to_move: bool, castling_rights: int, en_passant_square: int) -> int:
+    key = 0
+    for square, code in enumerate(squares):
+        if code:
+            key ^= PIECE_KEYS[code][square]
+    if black_to_move:
+        key ^= SIDE_KEY
+    return key ^ CASTLING_KEYS[castling_rights] ^ EN_PASSANT_KEYS[en_passant_square]
+
+
+class TranspositionTable:
+    EMPTY, EXACT, LOWER, UPPER = 0, 1, 2, 3
+    ENTRY_SIZE = 8 + 8 + 1
+
+    def __init__(self, megabytes: float = 16, buffer=None) -> None:
+        # buckets of two slots: slot 0 keeps the deepest result, slot 1 is always replaced
+        self.buckets: int = self.bucket_count(megabytes)
+        self.mask: int = self.buckets - 1
+        size = self.buckets * 2
+        # the columns are typed views over one flat buffer, which may be shared memory used by several processes
+        self.buffer: memoryview = memoryview(buffer if buffer is not None else bytearray(size * self.ENTRY_SIZE))
+        view = self.buffer[:size * self.ENTRY_SIZE]
+        # a slot's value, depth, flag and best move are packed into one data word, see pack, and its key
+        # column holds key ^ data, so an entry torn by two processes writing the slot at once fails the key check
+        self.keys: memoryview = view[:8 * size].cast('Q')
+        self.data: memoryview = view[8 * size:16 * size].cast('q')
+        self.ages: memoryview = view[16 * size:17 * size]
+        self.age: int = 0
+        self.probes: int = 0
+        self.hits: int = 0
+        self.stores: int = 0
+
+    @classmethod
+    def bucket_count(cls, megabytes: float) -> int:
+        buckets = max(1, int(megabytes * 1024 * 1024) // (2 * cls.ENTRY_SIZE))
+        return 1 << (buckets.bit_length() - 1)
+
+    @classmethod
+    def buffer_size(cls, megabytes: float) -> int:
+        return cls.bucket_count(megabytes) * 2 * cls.ENTRY_SIZE
+
+    @staticmethod
+    def pack(value: int, depth: int, flag: int, move: int = NO_MOVE) -> int:
+        # value above bit 26, then the packed 16-bit best move (NO_MOVE when there is none), the depth and the flag;
+        # unpacked inline where probed: value data >> 26, move data >> 10 & 0xFFFF, depth data >> 2 & 0xFF, flag data & 3
+        return value << 26 | move << 10 | depth << 2 | flag
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def release(self) -> None:
+        # drop the views so a shared memory buffer under them can be closed
+        for view in (self.keys, self.data, self.ages, self.buffer):
+            view.release()
+
+    def clear(self) -> None:
+        self.keys[:] = array('Q', bytes(8 * len(self.keys)))
+        self.data[:] = array('q', bytes(8 * len(self.data)))
+        self.age = 0
+        self.probes = self.hits = self.stores = 0
+
+    def new_search(self) -> None:
+        # entries written by earlier searches become replaceable in the depth-preferred slot
+        self.age = (self.age + 1) & 0xFF
+
+    def probe(self, key: int) -> int:
+        # the data word of the slot holding key, 0 on a miss; each slot's data is read once and checked against
+        # its key, so the fields unpacked from it belong together
+        self.probes += 1
+        index = (key & self.mask) << 1
+        keys, data = self.keys, self.data
+        entry = data[index]
+        if entry and keys[index] ^ entry & FULL == key:
+            self.hits += 1
+            return entry
+        entry = data[index + 1]
+        if entry and keys[index + 1] ^ entry & FULL == key:
+            self.hits += 1
+            return entry
+        return 0
+
+    def store(self, key: int, depth: int, value: int, flag: int, move: int = NO_MOVE) -> None:
+        self.stores += 1
+        index = (key & self.mask) << 1
+        entry = self.data[index]
+        stored_key = self.keys[index] ^ entry & FULL
+        if entry and stored_key != key and entry >> 2 & 0xFF > depth and self.ages[index] == self.age:
+            index += 1
+        elif entry and stored_key == key and not move:
+            # keep the best move of an earlier search of this position
+            move = entry >> 10 & 0xFFFF
+        entry = self.pack(value, depth, flag, move)
+        self.data[index] = entry
+        self.keys[index] = key ^ entry & FULL
+        self.ages[index] = self.age
+
+    def hashfull(self) -> int:
+        # permille of the first 1000 slots used by the current search, as reported over UCI
+        sample = min(1000, len(self.keys))
+        used = sum(1 for index in range(sample) if self.data[index] and self.ages[index] == self.age)
+        return used * 1000 // sample
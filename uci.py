@@ -0,0 +1,307 @@
+import logging
+import os
+import sys
+import threading
+
+
+log = logging.getLogger('uci')
+
+
+"""
+Headless UCI frontend. The reader loop only parses commands; searches run on a worker thread, so stop and
+isready are answered while a search is running. Engine modules are imported on the first command that
+needs them, which keeps startup to uciok down to interpreter start. The bestmove of go infinite and go ponder
+is held back until stop, or for a ponder search until ponderhit, as the protocol wants; after ponderhit the
+search gets the time the clock in the go command allows.
+"""
+NAME = 'ChessEngine'
+AUTHOR = 'ChessEngine authors'
+DEFAULT_HASH = 16
+MAX_HASH = 4096
+MAX_THREADS = max(os.cpu_count() or 1, 1)
+# time control: expect this many moves still to play when the GUI does not say, keep this much in reserve
+MOVES_TO_GO = 30
+MOVE_OVERHEAD = 0.03
+
+
+class UCI:
+    def __init__(self, output=sys.stdout) -> None:
+        self.output = output
+        self.lock = threading.Lock()
+        self.engine = None
+        self.parallel = None
+        self.hash_mb: int = DEFAULT_HASH
+        self.threads: int = 1
+        self.book_file: str = ''
+        self.own_book: bool = False
+        self.worker: threading.Thread | None = None
+        # set by stop; cleared before a search thread starts, so a stop right after go is never lost
+        self.stop_event = threading.Event()
+        # bestmove is only sent once release is set: at once for a normal search, on stop or ponderhit for
+        # infinite and ponder searches
+        self.release = threading.Event()
+        self.pondering: bool = False
+        # the time a ponder search gets after ponderhit, None to search on until stop
+        self.ponder_time: float | None = None
+        self.timer: threading.Timer | None = None
+
+    def send(self, line: str) -> None:
+        with self.lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def run(self, lines=sys.stdin) -> None:
+        for line in lines:
+            if not self.handle(line):
+                break
+        self.quit()
+
+    def handle(self, line: str) -> bool:
+        # False once the GUI says quit
+        words = line.split()
+        if not words:
+            return True
+        command, args = words[0], words[1:]
+        if command == 'uci':
+            self.send(f'id name {NAME}')
+            self.send(f'id author {AUTHOR}')
+            self.send(f'option name Hash type spin default {DEFAULT_HASH} min 1 max {MAX_HASH}')
+            self.send(f'option name Threads type spin default 1 min 1 max {MAX_THREADS}')
+            self.send('option name Ponder type check default false')
+            self.send('option name OwnBook type check default false')
+            self.send('option name BookFile type string default <empty>')
+            self.send('option name TablebasePath type string default <empty>')
+            self.send('uciok')
+        elif command == 'isready':
+            self.load()
+            self.send('readyok')
+        elif command == 'setoption':
+            self.set_option(args)
+        elif command == 'ucinewgame':
+            self.wait()
+            self.load()
+            self.engine.load_fen(self.fen.START_FEN)
+            self.searcher().clear()
+            if self.parallel is not None:
+                self.parallel.clear()
+        elif command == 'position':
+            self.wait()
+            self.position(args)
+        elif command == 'go':
+            self.wait()
+            self.go(args)
+        elif command == 'stop':
+            self.stop()
+        elif command == 'ponderhit':
+            self.ponderhit()
+        elif command == 'quit':
+            return False
+        elif command == 'd':
+            self.load()
+            self.engine.board.print_board()
+            self.send(f'Fen: {self.engine.to_fen()}')
+        elif command not in ('debug', 'register'):
+            self.send(f'info string unknown command {line.strip()}')
+        return True
+
+    def load(self) -> None:
+        if self.engine is not None:
+            return
+        global ChessEngine, Searcher, MATE, MATE_BOUND, MAX_PLY, move_name
+        import fen
+        from chess_engine import ChessEngine
+        from search import MATE, MATE_BOUND, MAX_PLY, Searcher
+        from utils import move_name
+        self.fen = fen
+        self.engine = ChessEngine(fen.START_FEN)
+
+    def searcher(self):
+        engine = self.engine
+        if engine.searcher is None:
+            engine.searcher = Searcher(engine, self.hash_mb)
+        return engine.searcher
+
+    def set_option(self, args: list[str]) -> None:
+        # setoption name <id> value <x>
+        text = ' '.join(args)
+        name, _, value = text.partition(' value ')
+        name = name.removeprefix('name ').strip().lower()
+        try:
+            if name == 'hash':
+                self.wait()
+                self.hash_mb = min(max(int(value), 1), MAX_HASH)
+                self.load()
+                self.engine.searcher = None
+                self.close_parallel()
+            elif name == 'threads':
+                self.wait()
+                self.threads = min(max(int(value), 1), MAX_THREADS)
+                self.close_parallel()
+            elif name == 'ponder':
+                # the GUI decides when to send go ponder, nothing to set up here
+                pass
+            elif name == 'ownbook':
+                self.own_book = value.strip().lower() == 'true'
+            elif name == 'bookfile':
+                self.wait()
+                self.load()
+                self.book_file = value.strip()
+                if self.book_file and self.book_file != '<empty>':
+                    self.engine.load_book(self.book_file)
+                elif self.engine.book is not None:
+                    self.engine.book.close()
+                    self.engine.book = None
+            elif name == 'tablebasepath':
+                self.wait()
+                self.load()
+                path = value.strip()
+                if path and path != '<empty>':
+                    self.engine.load_tablebases(path)
+                elif self.engine.tablebases is not None:
+                    self.engine.tablebases.close()
+                    self.engine.tablebases = None
+            else:
+                self.send(f'info string unknown option {name}')
+        except (ValueError, OSError) as error:
+            self.send(f'info string bad value for {name}: {error}')
+
+    def position(self, args: list[str]) -> None:
+        # position startpos|fen <fen> [moves <move>...]
+        self.load()
+        engine = self.engine
+        moves_at = args.index('moves') if 'moves' in args else len(args)
+        try:
+            if args and args[0] == 'fen':
+                engine.load_fen(' '.join(args[1:moves_at]))
+            else:
+                engine.load_fen(self.fen.START_FEN)
+        except ValueError as error:
+            self.send(f'info string {error}')
+            return
+        for name in args[moves_at + 1:]:
+            legal = {move_name(move): move for move in engine.valid_moves()}
+            if name not in legal:
+                self.send(f'info string illegal move {name}')
+                return
+            engine.make_move(legal[name])
+
+    def go(self, args: list[str]) -> None:
+        self.load()
+        options: dict[str, int] = {}
+        for key, value in zip(args, args[1:]):
+            if key in ('depth', 'movetime', 'wtime', 'btime', 'winc', 'binc', 'movestogo', 'nodes') and \
+                    value.lstrip('-').isdigit():
+                options[key] = int(value)
+        depth = options.get('depth')
+        nodes = options.get('nodes')
+        movetime = options['movetime'] / 1000 if 'movetime' in options else None
+        side = 'b' if self.engine.move % 2 else 'w'
+        if movetime is None and f'{side}time' in options:
+            remaining = options[f'{side}time'] / 1000
+            increment = options.get(f'{side[0]}inc', 0) / 1000
+            budget = remaining / options.get('movestogo', MOVES_TO_GO) + increment * 0.8
+            movetime = max(min(budget, remaining / 2) - MOVE_OVERHEAD, 0.01)
+        self.pondering = 'ponder' in args
+        self.ponder_time = None
+        if self.pondering:
+            # the clock only starts at ponderhit, until then the search runs without a time limit
+            self.ponder_time, movetime = movetime, None
+        if 'infinite' in args:
+            depth, movetime, nodes = MAX_PLY - 8, None, None
+        elif depth is None and nodes is None and movetime is None:
+            depth = MAX_PLY - 8
+        self.stop_event.clear()
+        if 'infinite' in args or self.pondering:
+            self.release.clear()
+        else:
+            self.release.set()
+        self.worker = threading.Thread(target=self.search, args=(depth, movetime, nodes), name='uci-search',
+                                       daemon=True)
+        self.worker.start()
+
+    def search(self, depth: int | None, movetime: float | None, nodes: int | None) -> None:
+        engine = self.engine
+        if self.own_book and (move := engine.book_move()):
+            self.bestmove(f'bestmove {move_name(move)}')
+            return
+        try:
+            if self.threads > 1:
+                if self.parallel is None:
+                    from parallel import ParallelSearch
+                    self.parallel = engine.parallel = ParallelSearch(self.threads, self.hash_mb)
+                result = self.parallel.search(engine, depth, movetime, nodes)
+                self.info(result)
+            else:
+                searcher = self.searcher()
+                searcher.info = self.info
+                searcher.stop_event = self.stop_event
+                result = searcher.search(depth, movetime, nodes)
+        except Exception as error:
+            log.exception('search failed')
+            self.send(f'info string search failed: {error}')
+            self.bestmove('bestmove 0000')
+            return
+        best = move_name(result.move) if result.move else '0000'
+        ponder = f' ponder {move_name(result.pv[1])}' if len(result.pv) > 1 else ''
+        self.bestmove(f'bestmove {best}{ponder}')
+
+    def bestmove(self, line: str) -> None:
+        # a search that ends by itself while infinite or pondering still waits for stop or ponderhit
+        self.release.wait()
+        self.send(line)
+
+    def info(self, result) -> None:
+        if abs(result.score) > MATE_BOUND:
+            plies = MATE - abs(result.score)
+            score = f'mate {(plies + 1) // 2 if result.score > 0 else -((plies + 1) // 2)}'
+        else:
+            score = f'cp {result.score}'
+        self.send(f'info depth {result.depth} score {score} nodes {result.nodes} nps {result.nps} '
+                  f'time {int(result.time * 1000)} pv {" ".join(map(move_name, result.pv))}')
+
+    def ponderhit(self) -> None:
+        # the GUI's expected move was played: the ponder search becomes a normal one on the go command's clock
+        if self.worker is None or not self.pondering:
+            return
+        self.pondering = False
+        if self.ponder_time is not None:
+            self.timer = threading.Timer(self.ponder_time, self.stop)
+            self.timer.daemon = True
+            self.timer.start()
+        self.release.set()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.release.set()
+        if self.engine is not None:
+            self.engine.stop()
+            if self.parallel is not None:
+                self.parallel.stop()
+
+    def wait(self) -> None:
+        # a new command that changes the position stops the running search first
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.worker is not None:
+            self.stop()
+            self.worker.join()
+            self.worker = None
+
+    def close_parallel(self) -> None:
+        if self.parallel is not None:
+            self.parallel.close()
+            self.parallel = self.engine.parallel = None
+
+    def quit(self) -> None:
+        self.wait()
+        self.close_parallel()
+
+
+def main() -> int:
+    UCI().run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,11 @@
-import time
+from array import array
 from enum import Enum, auto
+from operator import itemgetter
 from typing import NamedTuple, Type
 import logging
 
-logging.basicConfig(level=logging.DEBUG)
+from tables import *
+
 log = logging.getLogger('utils')
 
 
@@ -33,269 +35,424 @@ class Pos(NamedTuple):
 
 
 class Move(NamedTuple):
-    start: Pos 
+    start: Pos
     end: Pos
+    promotion: int = 0
 
     def __str__(self) -> str:
+        if self.promotion:
+            return f'({self.start}, {self.end}, {PIECE_NAMES[self.promotion]})'
         return f'({self.start}, {self.end})'
 
     def __repr__(self) -> str:
-        return f'({self.start}, {self.end})'
+        return self.__str__()
+
+
+"""
+Board layout: squares are ints 0..63, square = x * 8 + y, so a8 is 0 and h1 is 63.
+A piece code is its type in the low 3 bits plus BLACK_PIECE for black pieces, 0 is an empty square.
+Move targets come from the precomputed tables in tables.py, so generators never leave the board.
+"""
+EMPTY = 0
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(1, 7)
+BLACK_PIECE = 8
+TYPE_MASK = 7
+PIECE_NAMES = '-PNBRQK--pnbrqk'
+PIECE_CODES: dict[str, int] = {name: code for code, name in enumerate(PIECE_NAMES) if name != '-'}
+
+POSITIONS: list[Pos] = [Pos(square >> 3, square & 7) for square in range(64)]
+SQUARE_NAMES: list[str] = ['abcdefgh'[square & 7] + str(8 - (square >> 3)) for square in range(64)]
+SQUARE_INDEX: dict[str, int] = {name: square for square, name in enumerate(SQUARE_NAMES)}
+
+# FEN placement <-> piece codes by translation tables: digits expand to runs of '.', one byte per square
+_EXPAND = [(str(n).encode(), b'.' * n) for n in range(1, 9)]
+_TO_CODES = bytes(EMPTY if char == ord('.') else PIECE_CODES.get(chr(char), 255) for char in range(256))
+_TO_NAMES = bytes.maketrans(bytes(range(len(PIECE_NAMES))), PIECE_NAMES.replace('-', '.').encode())
+_RUNS = [('.' * n, str(n)) for n in range(8, 0, -1)]
+
+
+def encode_placement(fen: str) -> bytes:
+    # 64 piece codes from the placement field of a FEN or EPD line
+    squares = fen.split(maxsplit=1)[0].encode()
+    for digit, run in _EXPAND:
+        squares = squares.replace(digit, run)
+    squares = squares.translate(_TO_CODES, b'/')
+    if len(squares) != 64 or 255 in squares:
+        raise ValueError(f'bad piece placement in {fen!r}')
+    return squares
+
+
+def placement(squares: bytes | bytearray) -> str:
+    names = bytes(squares).translate(_TO_NAMES).decode()
+    text = '/'.join(names[row:row + 8] for row in range(0, 64, 8))
+    for run, digit in _RUNS:
+        text = text.replace(run, digit)
+    return text
+
+PROMOTIONS = (QUEEN, ROOK, BISHOP, KNIGHT)
+
+"""
+Engines pass moves around as 16-bit ints: bits 0-5 the start square, bits 6-11 the end square and
+bits 12-15 the flags below. Flags 4 and up capture (or promote), flags 8 and up promote.
+Move/Pos objects are only built at the edges, for the GUI.
+"""
+QUIET, DOUBLE_PUSH, KING_CASTLE, QUEEN_CASTLE, CAPTURE, EN_PASSANT = 0, 1, 2, 3, 4, 5
+PROMOTION, PROMOTION_CAPTURE = 8, 12
+NO_MOVE = 0
+# PROMOTION_FLAGS[piece type] is the promotion flag for that piece, PROMOTION_PIECES[flags] the piece type
+PROMOTION_FLAGS: list[int] = [0, 0, 8, 9, 10, 11, 0]
+PROMOTION_PIECES: tuple[int, ...] = (0,) * 8 + (KNIGHT, BISHOP, ROOK, QUEEN) * 2
+# kinds of move a generator is asked for, combined as bits: captures, en passant and promotions, then the rest;
+# CHECKS_ONLY narrows the quiet moves to those giving check, castling aside
+TACTICAL_MOVES, QUIET_MOVES, ALL_MOVES, CHECKS_ONLY = 1, 2, 3, 4
+QUIET_CHECKS = QUIET_MOVES | CHECKS_ONLY
+MOVE_KINDS: tuple[int, ...] = (QUIET_MOVES,) * 4 + (TACTICAL_MOVES,) * 12
+# move buffers hold the legal moves found so far plus the unfiltered moves of the piece being generated,
+# at most 218 + 27: no position has more than 218 legal moves and a queen has at most 27 targets
+MAX_MOVES = 256
+MAX_GAME_PLY = 2048
+
+
+def pack_move(start: int, end: int, flags: int = QUIET) -> int:
+    return start | end << 6 | flags << 12
+
+
+def move_start(move: int) -> int:
+    return move & 63
+
+
+def move_end(move: int) -> int:
+    return move >> 6 & 63
+
+
+def move_flags(move: int) -> int:
+    return move >> 12
+
+
+def move_promotion(move: int) -> int:
+    return PROMOTION_PIECES[move >> 12]
+
+
+def to_move(move: int) -> Move:
+    return Move(POSITIONS[move & 63], POSITIONS[move >> 6 & 63], PROMOTION_PIECES[move >> 12])
+
+
+def from_move(move: Move, moves) -> int:
+    # the packed move in moves matching a GUI Move, NO_MOVE when it is not there
+    start, end = move.start.x * 8 + move.start.y, move.end.x * 8 + move.end.y
+    for packed in moves:
+        if packed & 63 == start and packed >> 6 & 63 == end and PROMOTION_PIECES[packed >> 12] == move.promotion:
+            return packed
+    return NO_MOVE
+
+
+def move_name(move: int) -> str:
+    # coordinate notation, e2e4 or e7e8q
+    name = SQUARE_NAMES[move & 63] + SQUARE_NAMES[move >> 6 & 63]
+    promotion = PROMOTION_PIECES[move >> 12]
+    return name + PIECE_NAMES[promotion | BLACK_PIECE] if promotion else name
+
+
+class UndoStack:
+    # history kept as one array per field, so pushing a move allocates nothing; a full stack doubles its arrays
+    __slots__ = ('moves', 'captured', 'castling_rights', 'en_passant_squares', 'halfmove_clocks', 'hash_keys', 'size')
+
+    def __init__(self, capacity: int = MAX_GAME_PLY) -> None:
+        self.moves: array = array('H', bytes(2 * capacity))
+        self.captured: array = array('B', bytes(capacity))
+        self.castling_rights: array = array('B', bytes(capacity))
+        self.en_passant_squares: array = array('b', bytes(capacity))
+        self.halfmove_clocks: array = array('H', bytes(2 * capacity))
+        self.hash_keys: array = array('Q', bytes(8 * capacity))
+        self.size: int = 0
+
+    def push(self, move: int, captured: int, castling_rights: int, en_passant_square: int, halfmove_clock: int,
+             hash_key: int) -> None:
+        index = self.size
+        if index == len(self.captured):
+            self.grow()
+        self.moves[index] = move
+        self.captured[index] = captured
+        self.castling_rights[index] = castling_rights
+        self.en_passant_squares[index] = en_passant_square
+        self.halfmove_clocks[index] = halfmove_clock
+        self.hash_keys[index] = hash_key
+        self.size = index + 1
+
+    def grow(self) -> None:
+        # extended in place, so references to the arrays stay valid
+        for field in (self.moves, self.captured, self.castling_rights, self.en_passant_squares, self.halfmove_clocks,
+                      self.hash_keys):
+            field.frombytes(bytes(field.itemsize * len(field)))
+
+    def pop(self) -> int:
+        # index of the entry being removed, its fields stay readable until the next push
+        self.size -= 1
+        return self.size
+
+    def clear(self) -> None:
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+WHITE_SHORT, WHITE_LONG, BLACK_SHORT, BLACK_LONG = 1, 2, 4, 8
+# castling rights that survive a move touching the square
+CASTLING_MASK: list[int] = [15] * 64
+CASTLING_MASK[60] = 15 & ~(WHITE_SHORT | WHITE_LONG)
+CASTLING_MASK[63] = 15 & ~WHITE_SHORT
+CASTLING_MASK[56] = 15 & ~WHITE_LONG
+CASTLING_MASK[4] = 15 & ~(BLACK_SHORT | BLACK_LONG)
+CASTLING_MASK[7] = 15 & ~BLACK_SHORT
+CASTLING_MASK[0] = 15 & ~BLACK_LONG
+# (right, king square, rook square, king code, rook code)
+CASTLING_SQUARES: tuple[tuple[int, int, int, int, int], ...] = (
+    (WHITE_SHORT, 60, 63, KING, ROOK), (WHITE_LONG, 60, 56, KING, ROOK),
+    (BLACK_SHORT, 4, 7, KING | BLACK_PIECE, ROOK | BLACK_PIECE), (BLACK_LONG, 4, 0, KING | BLACK_PIECE, ROOK | BLACK_PIECE),
+)
+
+
+def square_of(position: Pos) -> int:
+    return position.x * 8 + position.y
+
+
+def piece_color(code: int) -> Color:
+    if not code:
+        return Color.EMPTY
+    return Color.BLACK if code & BLACK_PIECE else Color.WHITE
+
+
+# readers giving the codes on the squares a knight or a king reaches from each square as one tuple,
+# every square has at least two of each
+_KNIGHT_READERS = [itemgetter(*targets) for targets in KNIGHT_TARGETS]
+_KING_READERS = [itemgetter(*targets) for targets in KING_TARGETS]
+
+
+def square_attacked(squares: bytearray, square: int, side: int) -> bool:
+    # is square attacked by the pieces of side (0 white, 1 black), read straight off the board;
+    # the nearest piece on a ray is its slice with the leading empty squares stripped
+    flag = side << 3
+    if KNIGHT | flag in _KNIGHT_READERS[square](squares) or KING | flag in _KING_READERS[square](squares):
+        return True
+    pawn = PAWN | flag
+    for end in PAWN_CAPTURES[side ^ 1][square]:
+        if squares[end] == pawn:
+            return True
+    queen = QUEEN | flag
+    bishop = BISHOP | flag
+    for ray in BISHOP_SLICES[square]:
+        if (nearest := squares[ray].lstrip(b'\0')) and (nearest[0] == bishop or nearest[0] == queen):
+            return True
+    rook = ROOK | flag
+    for ray in ROOK_SLICES[square]:
+        if (nearest := squares[ray].lstrip(b'\0')) and (nearest[0] == rook or nearest[0] == queen):
+            return True
+    return False
+
 
 class Board:
     def get_piece_on_square(self, square: Pos):...
 
 class ChessPiece:
-    def __init__(self, *, name: str, color: Color, position: Pos, directions: list[Pos]):
-        self.name: str = name
-        self.color:Color = color
-        self.position: Pos = position
-        self.valid_moves: list[Move] = []
-        self.pinned: bool = False
-        self.enemy_color = Color.BLACK if color is Color.WHITE else Color.WHITE
-        self.ally_color = Color.WHITE if color is Color.WHITE else Color.BLACK
-        self.directions: list[Pos] = directions
-
-    def adder(self, piece: Pos, direction: Pos) -> Pos:
-        return Pos(piece.x + direction.x, piece.y + direction.y)
-
-    def generate_sudo_valid_moves(self, board: Board) -> list[Move]:
-        pass
-        
+    __slots__ = ('board', 'square')
+
+    def __init__(self, board: Board, square: int):
+        self.board: Board = board
+        self.square: int = square
+
+    @property
+    def code(self) -> int:
+        return self.board.squares[self.square]
+
+    @property
+    def name(self) -> str:
+        return PIECE_NAMES[self.code]
+
+    @property
+    def color(self) -> Color:
+        return piece_color(self.code)
+
+    @property
+    def position(self) -> Pos:
+        return POSITIONS[self.square]
+
+    @property
+    def enemy_color(self) -> Color:
+        return Color.BLACK if self.color is Color.WHITE else Color.WHITE
+
+    @property
+    def ally_color(self) -> Color:
+        return self.color
+
+    @classmethod
+    def generate_sudo_valid_moves(cls, squares: bytearray, square: int) -> list[Move]:
+        return []
+
     def __str__(self):
         return f'{self.name}, {self.position}'
 
     def __repr__(self):
         return f'{self.name}'
-    
+
     def __eq__(self, __o: object) -> bool:
         return type(self) == __o
 
 
 class EmptyPiece(ChessPiece):
-    def __init__(self, *, position: Pos):
-        super().__init__(name='-', color=Color.EMPTY, position=position, directions=[])
+    __slots__ = ()
 
 
 class SlidingPiece(ChessPiece):
-    def __init__(self, *, name, color, position, directions):
-        super().__init__(name=name, color=color, position=position, directions=directions)
-
-    def generate_sudo_valid_moves(self, board: Board, pinned_squares: list[Pos], ally_king_in_check: bool) -> list[Move]:
-        self.valid_moves.clear()
-        if self.position in pinned_squares:
-            return self.valid_moves
-        for direction in self.directions:
-            for n in range(1, 8):
-                end: Pos = self.adder(self.position, Pos(n * direction.x, n * direction.y))
-                if not (end.x in range(8) and end.y in range(8)):
-                    break
-                target: ChessPiece = board.get_piece_on_square(end)
-                if target.color == self.ally_color:
+    __slots__ = ()
+    rays: list[list[list[int]]] = []
+
+    @classmethod
+    def generate_sudo_valid_moves(cls, squares: bytearray, square: int, moves: array, count: int,
+                                  kind: int = ALL_MOVES) -> int:
+        # writes packed moves of the given kind into moves from index count on and returns the new count
+        enemy = squares[square] & BLACK_PIECE ^ BLACK_PIECE
+        capture = square | CAPTURE << 12
+        tactical, quiet = kind & TACTICAL_MOVES, kind & QUIET_MOVES
+        for ray in cls.rays[square]:
+            for end in ray:
+                code = squares[end]
+                if code:
+                    if code & BLACK_PIECE == enemy and tactical:
+                        moves[count] = capture | end << 6
+                        count += 1
                     break
-                elif target.color == self.enemy_color:
-                    self.valid_moves.append(Move(self.position, end)) 
-                    break
-                self.valid_moves.append(Move(self.position, end))
-        if ally_king_in_check:
-            self.valid_moves = [move for move in self.valid_moves if move.end in pinned_squares]
-        return self.valid_moves
+                if quiet:
+                    moves[count] = square | end << 6
+                    count += 1
+        return count
 
 
 class NotSlidingPiece(ChessPiece):
-    def __init__(self, *, name, color, position, directions):
-        super().__init__(name=name, color=color, position=position, directions=directions)
-
-    def generate_sudo_valid_moves(self, board: Board, pinned_squares: list[Pos], ally_king_in_check: bool) -> list[Move]:
-        self.valid_moves.clear()
-        for d in self.directions:
-            end = self.adder(self.position, d)
-            if not (end.x in range(8) and end.y in range(8)):
-                continue
-            target: ChessPiece = board.get_piece_on_square(end)
-            if target.color == self.ally_color:
-                continue
-            elif target.color == self.enemy_color:
-                self.valid_moves.append(Move(self.position, end)) 
-                continue
-            self.valid_moves.append(Move(self.position, end))
-        if ally_king_in_check:
-            self.valid_moves = [move for move in self.valid_moves if move.end in pinned_squares]
-        return self.valid_moves
+    __slots__ = ()
+    targets: list[list[int]] = []
+
+    @classmethod
+    def generate_sudo_valid_moves(cls, squares: bytearray, square: int, moves: array, count: int,
+                                  kind: int = ALL_MOVES) -> int:
+        enemy = squares[square] & BLACK_PIECE ^ BLACK_PIECE
+        capture = square | CAPTURE << 12
+        for end in cls.targets[square]:
+            code = squares[end]
+            if not code:
+                if kind & QUIET_MOVES:
+                    moves[count] = square | end << 6
+                    count += 1
+            elif code & BLACK_PIECE == enemy and kind & TACTICAL_MOVES:
+                moves[count] = capture | end << 6
+                count += 1
+        return count
 
 
 class Rook(SlidingPiece):
-    def __init__(self, *, name, color, position, directions):
-        super().__init__(name=name, color=color, position=position, directions=directions)
-        self.castling = True
-    
-    def __str__(self):
-        return f'({self.name}, {self.position}, {self.castling})'
+    __slots__ = ()
+    rays = ROOK_RAYS
 
 
 class Queen(SlidingPiece):
-    def __init__(self, *, name, color, position, directions):
-        super().__init__(name=name, color=color, position=position, directions=directions)
+    __slots__ = ()
+    rays = QUEEN_RAYS
 
 
 class Bishop(SlidingPiece):
-    def __init__(self, *, name, color, position, directions):
-        super().__init__(name=name, color=color, position=position, directions=directions)
+    __slots__ = ()
+    rays = BISHOP_RAYS
 
 
 class Knight(NotSlidingPiece):
-    def __init__(self, *, name, color, position, directions):
-        super().__init__(name=name, color=color, position=position, directions=directions)
+    __slots__ = ()
+    targets = KNIGHT_TARGETS
 
 
 class Pawn(NotSlidingPiece):
-    def __init__(self, *, name, color, position, directions):
-        super().__init__(name=name, color=color, position=position, directions=directions)
-        self.start_square: int = 6 if self.color == Color.WHITE else 1
-        self.ep_square: int = 4 if self.color == Color.WHITE else 3
-        self.ep: bool = False
-        self.eat_directions: list[Pos] = [Pos(-1, -1), Pos(-1, 1)] if self.color == Color.WHITE else [Pos(1, -1), Pos(1, 1)]
-        self.ep_directions: list[Pos] = [Pos(0, 1), Pos(0, -1)]
-        self.ep_move: int = float('-inf')
-
-    def generate_sudo_valid_moves(self, board: Board, pinned_squares: list[Pos], ally_king_in_check: bool) -> list[Move]:
-        self.valid_moves.clear()
-        self.valid_moves.extend(self.generate_forword_moves(board))
-        self.valid_moves.extend(self.generage_eat_moves(board))
-        self.valid_moves.extend(self.generate_en_passant_moves(board))
-        if ally_king_in_check:
-            self.valid_moves = [move for move in self.valid_moves if move.end in pinned_squares]
-        return self.valid_moves
-
-    def generate_forword_moves(self, board: Board):
-        valid_moves: list[Move] = []
-        for d in self.directions:
-            if self.position.x != self.start_square and d == self.directions[1]:
-                continue
-            end = self.adder(self.position, d)
-            if not (end.x in range(8) and end.y in range(8)):
-                continue
-            target: ChessPiece = board.get_piece_on_square(end)
-            if target.color is Color.EMPTY:
-                valid_moves.append(Move(self.position, end))
-            elif target.color is self.ally_color:
-                break
-        return valid_moves
-
-    def generage_eat_moves(self, board: Board):
-        valid_moves: list[Move] = []
-        for d in self.eat_directions:
-            end = self.adder(self.position, d)
-            if not (end.x in range(8) and end.y in range(8)):
-                continue
-            target: ChessPiece = board.get_piece_on_square(end)
-            if target.color is self.enemy_color:
-                valid_moves.append(Move(self.position, end))
-        return valid_moves
-
-    def generate_en_passant_moves(self, board: Board):
-        valid_moves: list[Move] = []
-        offset: int = -1 if self.color is Color.WHITE else 1
-        for d in self.ep_directions:
-            end = self.adder(self.position, d)
-            if not (end.x in range(8) and end.y in range(8)):
-                continue
-            target: Pawn = board.get_piece_on_square(end)
-            if isinstance(target, Pawn) and target.color is self.enemy_color and target.ep and target.position.x == target.ep_square:
-                valid_moves.append(Move(self.position, Pos(end.x + offset, end.y)))
-        return valid_moves
+    __slots__ = ()
+
+    @classmethod
+    def generate_sudo_valid_moves(cls, squares: bytearray, square: int, moves: array, count: int,
+                                  en_passant_square: int = OFF_BOARD, kind: int = ALL_MOVES) -> int:
+        side = squares[square] >> 3
+        enemy = BLACK_PIECE if side == 0 else 0
+        en_passant_row = 4 if side else 3
+        promotes = square >> 3 == (6 if side else 1)
+        first = count
+        # pushes onto the last row promote, which makes them tactical
+        if kind & (TACTICAL_MOVES if promotes else QUIET_MOVES):
+            for end in PAWN_PUSHES[side][square]:
+                if squares[end]:
+                    break
+                moves[count] = square | end << 6 | (DOUBLE_PUSH << 12 if count > first else 0)
+                count += 1
+        if not kind & TACTICAL_MOVES:
+            return count
+        for end in PAWN_CAPTURES[side][square]:
+            code = squares[end]
+            if code and code & BLACK_PIECE == enemy:
+                moves[count] = square | end << 6 | CAPTURE << 12
+                count += 1
+            elif end == en_passant_square and square >> 3 == en_passant_row:
+                moves[count] = square | end << 6 | EN_PASSANT << 12
+                count += 1
+        if promotes:
+            # every push or capture onto the last row becomes four promotions
+            last = count
+            for index in range(first, last):
+                move = moves[index] | PROMOTION << 12
+                moves[index] = move | (PROMOTION_FLAGS[QUEEN] & 3) << 12
+                for promotion in PROMOTIONS[1:]:
+                    moves[count] = move | (PROMOTION_FLAGS[promotion] & 3) << 12
+                    count += 1
+        return count
 
     def __str__(self):
-        return f'{self.position}, {self.ep_move}, {self.ep}'
+        return f'{self.position}'
 
 
 class King(NotSlidingPiece):
-    def __init__(self, *, name, color, position, directions):
-        super().__init__(name=name, color=color, position=position, directions=directions)
-        self.long_side = Pos(self.position.x, 2)
-        self.short_side = Pos(self.position.x, 6)
-        self.checked = False
-        self.start_position = Pos(7, 4) if self.color is Color.WHITE else Pos(0, 4)
-        self.castling = True
-    
-    def generate_sudo_valid_moves(self, board: Board, pinned_squares: list[Pos], enemy_attack_squares: list[Pos]) -> list[Move]:
-        self.valid_moves.clear()
-        for d in self.directions:
-            end = self.adder(self.position, d)
-            skip = False
-            for sd in self.directions:
-                end2 = self.adder(end, sd)
-                if not (end2.x in range(8) and end2.y in range(8)):
-                    continue
-                target2 = board.get_piece_on_square(end2)
-                if isinstance(target2, King) and target2.color is self.enemy_color:
-                    skip = True
-            if not (end.x in range(8) and end.y in range(8)) or skip:
-                continue
-            target: ChessPiece = board.get_piece_on_square(end)
-            if target.color == self.ally_color:
-                continue
-            elif target.color == self.enemy_color and end not in pinned_squares:
-                self.valid_moves.append(Move(self.position, end)) 
-                continue
-            if end not in pinned_squares:
-                self.valid_moves.append(Move(self.position, end))
-        if self.position != self.start_position or not self.castling or self.checked:
-            return self.valid_moves
-        short_side_rook: Rook = board.get_piece_on_square(Pos(self.position.x, 7))
-        long_side_rook: Rook = board.get_piece_on_square(Pos(self.position.x, 0))
-        short_side = board.get_piece_on_square(self.short_side)
-        long_side = board.get_piece_on_square(self.long_side)
-        if (isinstance(short_side_rook, Rook)\
-                        and short_side_rook.castling\
-                        and short_side_rook.color == self.color\
-                        and isinstance(short_side, EmptyPiece)\
-                        and short_side.position not in enemy_attack_squares
-            ):
-            self.valid_moves.append(Move(self.position, self.short_side))
-        if (isinstance(long_side_rook, Rook)\
-                        and long_side_rook.castling\
-                        and long_side_rook.color == self.color\
-                        and isinstance(long_side, EmptyPiece)\
-                        and long_side.position not in enemy_attack_squares
-            ):
-            self.valid_moves.append(Move(self.position, self.long_side))
-        return self.valid_moves
-
-    def in_check(self, board: Board) -> bool:
-        pass
+    __slots__ = ()
+    targets = KING_TARGETS
+
+
+PIECE_CLASSES: list[Type[ChessPiece]] = [EmptyPiece, Pawn, Knight, Bishop, Rook, Queen, King, EmptyPiece,
+                                         EmptyPiece, Pawn, Knight, Bishop, Rook, Queen, King]
+
 
 class Board:
     def __init__(self):
-        self.board: list[list[ChessPiece]] = []
+        self.squares: bytearray = bytearray(64)
         self.arrangement = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR"
-        self.checked_squares: set[Pos] = set()
-        self.pinned_squares: list[Pos] = []
+
+    def load_arrangement(self, arrangement: str) -> None:
+        self.squares[:] = encode_placement(arrangement)
+
+    def castling_rights(self) -> int:
+        # rights implied by kings and rooks standing on their home squares
+        rights = 0
+        for right, king, rook, king_code, rook_code in CASTLING_SQUARES:
+            if self.squares[king] == king_code and self.squares[rook] == rook_code:
+                rights |= right
+        return rights
 
     def get_piece_on_square(self, position: Pos) -> ChessPiece:
-        return self.board[position.x][position.y]
+        square = position.x * 8 + position.y
+        return PIECE_CLASSES[self.squares[square]](self, square)
 
-    def move(self, move: Move, piece_moved: ChessPiece, empty_piece: ChessPiece):
-        self.board[move.end.x][move.end.y] = piece_moved
-        self.board[move.start.x][move.start.y] = empty_piece
+    def move(self, start: int, end: int, piece_moved: int, piece_left: int = EMPTY):
+        self.squares[end] = piece_moved
+        self.squares[start] = piece_left
 
     def print_board(self):
         for x in range(8):
-            row = []
-            for y in range(8):
-                row.append(self.board[x][y].__repr__())
-            print(row)
+            print([PIECE_NAMES[code] for code in self.squares[x * 8:x * 8 + 8]])
 
     def __str__(self) -> str:
-        return self.board
+        return '\n'.join(''.join(PIECE_NAMES[code] for code in self.squares[x * 8:x * 8 + 8]) for x in range(8))
 
     def __repr__(self) -> str:
-        return self.board
+        return self.__str__()
 
     def __eq__(self, __o: object) -> bool:
         return type(self) == __o
-
-if __name__ == '__main__':
-    piece = King(name='K', color=Color.WHITE, position=Pos(7,4), directions=[])
-    board = Board()
-    print(piece.directions)